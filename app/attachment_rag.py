@@ -1,58 +1,364 @@
-from pinecone import Pinecone
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from app.vector_store import get_vector_store, load_local_embedder, VECTOR_STORE_BACKEND
+from app.utils import LRUCache, count_tokens, truncate_to_tokens
+from app.blob_store import AttachmentStore
+from datetime import datetime
 from pathlib import Path
-from langchain_community.document_loaders import PyPDFLoader
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+import hashlib
 import json
-from pathlib import Path
-import google.generativeai as genai 
+import multiprocessing
+import re
+import threading
+import time
 import os
-from dotenv import load_dotenv
+from app.clients import get_genai_model
+from app.tracing import add, record_duration, record_llm_call, register_cache, span
+
+# --- Ingestion settings --- #
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+# Used when no account is known; every account otherwise gets its own namespace
+DEFAULT_NAMESPACE = "document-chunks"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# Worker processes used to parse documents
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(8, os.cpu_count() or 1))))
+# How parse workers are started: "forkserver" where available, else "spawn" (never a bare fork)
+INGEST_START_METHOD = os.getenv(
+    "INGEST_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+# Pinecone integrated-embedding upserts accept at most 96 records / 2 MB per request
+UPSERT_BATCH_RECORDS = 96
+UPSERT_BATCH_BYTES = 2 * 1024 * 1024
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "4"))
+# Pinecone accepts up to 1000 IDs per delete request
+DELETE_BATCH_IDS = 1000
+
+
+# --- Retrieval / answer caches --- #
+RAG_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "256"))
+RAG_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "3600"))
+# Let near-duplicate questions reuse cached hits (embeds every query locally)
+RAG_SEMANTIC_CACHE = os.getenv("RAG_SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# One file per namespace, rewritten after every ingestion that changes the index.
+# Ingestion may run in another process (the sync daemon), so the caches key on it.
+RAG_GENERATION_DIR = os.getenv("RAG_GENERATION_DIR", "rag_generation")
+
+# (namespace, generation, normalized query, top_k, filters) -> hits
+retrieval_cache = LRUCache(RAG_CACHE_SIZE, RAG_CACHE_TTL)
+# (generation, normalized query, hit-set fingerprint) -> answer text
+answer_cache = LRUCache(RAG_CACHE_SIZE, RAG_CACHE_TTL)
+register_cache("retrieval", retrieval_cache)
+register_cache("answer", answer_cache)
+_query_vectors = {}
+_query_embedder = None
+_semantic_lock = threading.Lock()
+
+
+def user_namespace(email_user: Optional[str]) -> str:
+    """Vector store namespace holding one account's attachment chunks."""
+    return f"user-{email_user.strip().lower()}" if email_user else DEFAULT_NAMESPACE
+
+
+def _filter_key(filters: Optional[dict]) -> str:
+    return json.dumps(filters, sort_keys=True) if filters else ""
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+def _generation_path(namespace: str) -> Path:
+    return Path(RAG_GENERATION_DIR) / re.sub(r"[^\w.@+-]", "_", namespace)
+
+
+def index_generation(namespace: str) -> str:
+    """Current ingestion generation of `namespace`, shared by every process; "" before any ingestion."""
+    try:
+        return _generation_path(namespace).read_text()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_index_generation(namespace: str):
+    """Marks `namespace` as changed, so cached retrievals in every process stop matching."""
+    path = _generation_path(namespace)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(f"{time.time_ns()}-{os.getpid()}")
+    os.replace(tmp_path, path)
+
+
+def invalidate_rag_cache():
+    """Drops cached retrievals; called whenever ingestion changes the index."""
+    retrieval_cache.clear()
+    with _semantic_lock:
+        _query_vectors.clear()
+
+
+def _hits_fingerprint(hits: List[dict]) -> str:
+    digest = hashlib.sha256()
+    for hit in hits:
+        digest.update(hit["_id"].encode("utf-8"))
+        digest.update(hit["fields"]["chunk_text"].encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _embed_query(normalized: str):
+    global _query_embedder
+    with _semantic_lock:
+        if _query_embedder is None:
+            _query_embedder = load_local_embedder()
+    return _query_embedder.embed([normalized])[0]
+
+
+def _cached_search(
+    store, namespace: str, query: str, top_k: int, filters: Optional[dict] = None
+) -> Tuple[List[dict], bool]:
+    """Vector search behind the retrieval cache. Returns (hits, cache_hit)."""
+    key = (namespace, index_generation(namespace), normalize_query(query), top_k, _filter_key(filters))
+    hits = retrieval_cache.get(key)
+    if hits is not None:
+        return hits, True
+
+    vector = None
+    if RAG_SEMANTIC_CACHE:
+        vector = _embed_query(key[2])
+        with _semantic_lock:
+            candidates = [
+                k for k in retrieval_cache.keys()
+                if (k[0], k[1], k[3], k[4]) == (key[0], key[1], top_k, key[4]) and k in _query_vectors
+            ]
+            similarities = [float(_query_vectors[k] @ vector) for k in candidates]
+        if candidates and max(similarities) >= SEMANTIC_CACHE_THRESHOLD:
+            hits = retrieval_cache.get(candidates[similarities.index(max(similarities))])
+            if hits is not None:
+                return hits, True
+
+    hits = store.search(namespace, query, top_k=top_k, filter=filters)
+    retrieval_cache.put(key, hits)
+    if vector is not None:
+        with _semantic_lock:
+            _query_vectors[key] = vector
+            # Forget vectors of entries the LRU already evicted
+            live = set(retrieval_cache.keys())
+            for stale in [k for k in _query_vectors if k not in live]:
+                del _query_vectors[stale]
+    return hits, False
+
+
+def extract_text_pages(file_path: str, max_pages: Optional[int] = None) -> List[str]:
+    """
+    Returns the text of a document page by page: PDFs via PyMuPDF, DOCX via
+    python-docx (as a single page). `max_pages` stops early, e.g. for previews.
+    """
+    suffix = Path(file_path).suffix.lower()
+    if suffix == ".pdf":
+        import fitz  # PyMuPDF
+
+        pages = []
+        with fitz.open(file_path) as doc:
+            for page in doc:
+                if max_pages is not None and len(pages) >= max_pages:
+                    break
+                pages.append(page.get_text())
+        return pages
+    if suffix == ".docx":
+        import docx
+
+        document = docx.Document(file_path)
+        return ["\n".join(p.text for p in document.paragraphs)]
+    raise ValueError(f"Unsupported file type: {suffix}")
+
+
+def _parse_and_chunk(file_path: str) -> dict:
+    """
+    Process-pool worker: parses one file and splits it into chunks.
+    Returns the chunks as (page, text, sha256) triples plus per-stage timings.
+    """
+    try:
+        start = time.perf_counter()
+        pages = extract_text_pages(file_path)
+        parsed = time.perf_counter()
+
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        chunks = [
+            (page_no, text, hashlib.sha256(text.encode("utf-8")).hexdigest())
+            for page_no, page_text in enumerate(pages, start=1)
+            for text in splitter.split_text(page_text)
+        ]
+        return {
+            "path": file_path,
+            "chunks": chunks,
+            "pages": len(pages),
+            "bytes": os.path.getsize(file_path),
+            "parse_s": parsed - start,
+            "chunk_s": time.perf_counter() - parsed,
+        }
+    except Exception as e:
+        return {"path": file_path, "error": str(e)}
+
+
+def _parsed_files(paths: List[str]) -> Iterator[dict]:
+    """
+    Yields parse results as soon as each file is done (completion order). At most
+    2 files per worker are parsed ahead of the consumer, so a slow upsert holds
+    parsing back instead of piling up chunks in memory.
+    """
+    if len(paths) <= 1 or INGEST_WORKERS <= 1:
+        for path in paths:
+            yield _parse_and_chunk(path)
+        return
+    workers = min(INGEST_WORKERS, len(paths))
+    # Ingestion runs on Streamlit / daemon threads; forking a multi-threaded process is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(INGEST_START_METHOD)) as pool:
+        pending = iter(paths)
+        in_flight = {pool.submit(_parse_and_chunk, path) for path in islice(pending, 2 * workers)}
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                in_flight.update(pool.submit(_parse_and_chunk, path) for path in islice(pending, 1))
+
+
+def _record_batches(records: Iterator[dict]) -> Iterator[List[dict]]:
+    """Coalesces records into batches bounded by count and payload size."""
+    batch, batch_bytes = [], 0
+    for record in records:
+        size = len(record["chunk_text"].encode("utf-8")) + 256
+        if batch and (len(batch) >= UPSERT_BATCH_RECORDS or batch_bytes + size > UPSERT_BATCH_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(record)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _file_sha256(path: Path) -> str:
+    # Blobs from the attachment store are already named by their SHA-256
+    if path.parent.parent.name == "blobs" and len(path.stem) == 64:
+        return path.stem
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _scan_folder(folder: Path) -> dict:
+    """Top-level files plus the content-addressed blobs (one file per unique content)."""
+    entries = {}
+    for pattern in ("*", "blobs/*/*"):
+        for path in folder.glob(pattern):
+            if path.suffix.lower() in SUPPORTED_EXTENSIONS:
+                st = path.stat()
+                entries[path.relative_to(folder).as_posix()] = (st.st_size, st.st_mtime_ns)
+    return entries
+
+
+def _dir_signature(entries: dict, folder: Optional[Path] = None) -> str:
+    """
+    Fingerprint of (path, size, mtime) for every candidate file, plus the attachment
+    store manifest of `folder`, whose filenames / UIDs / dates end up in chunk metadata.
+    """
+    digest = hashlib.sha256()
+    for rel, (size, mtime_ns) in sorted(entries.items()):
+        digest.update(f"{rel}\0{size}\0{mtime_ns}\n".encode("utf-8"))
+    manifest = folder / "manifest.json" if folder else None
+    if manifest and manifest.exists():
+        st = manifest.stat()
+        digest.update(f"manifest.json\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _chunk_metadata(rel: str, blob_meta: dict) -> dict:
+    """
+    Metadata stored with every chunk of a file: its path in the folder, the names it
+    was received under ("source"), and for downloaded attachments the message UIDs,
+    the message date and its Unix timestamp (for range filters).
+    """
+    path = Path(rel)
+    meta = blob_meta.get(path.stem) if path.parts[0] == "blobs" else None
+    if not meta:
+        return {"file": rel, "source": [path.name]}
+    fields = {"file": rel, "source": meta["source"]}
+    if meta["uid"]:
+        fields["uid"] = meta["uid"]
+    if meta["date"]:
+        fields["date"] = meta["date"]
+        try:
+            fields["timestamp"] = int(datetime.fromisoformat(meta["date"]).timestamp())
+        except ValueError:
+            pass
+    return fields
 
-load_dotenv()
 
-def ingest_files_to_vector_db(folder_path: str) ->dict:
+def file_filter(folder_path: str, file_path: str) -> dict:
     """
-    📂 Tool: Ingest File into Vector DB (Pinecone)
+    Metadata filter for the chunks of one file in `folder_path` (matched on its
+    "file" field), not every file that was received under the same name.
+    """
+    return {"file": Path(os.path.relpath(file_path, folder_path)).as_posix()}
+
+
+def _metadata_fingerprint(fields: dict) -> str:
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()[:16]
 
-    This tool takes a folder path (e.g., `organized_docs/resumes/`) containing multiple PDF resumes,
-    performs text extraction and chunking, and ingests the chunks into a Pinecone vector index for retrieval.
+
+def _throughput(count: float, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+
+def ingest_files_to_vector_db(folder_path: str, namespace: Optional[str] = None) ->dict:
+    """
+    📂 Tool: Ingest File into Vector DB (Pinecone or the local store)
+
+    This tool takes a folder path (e.g., `attachments/<user>/`) containing PDF and DOCX files,
+    performs text extraction and chunking in a process pool, and upserts the chunks into the
+    configured vector store (see `app/vector_store.py`) in size-bounded batches sent concurrently.
+
+    Ingestion is incremental: `.ingest_manifest.json` keeps the size, mtime, content hash and
+    chunk IDs of every file. Unchanged files are skipped, only new chunks of changed files are
+    upserted, and chunks of changed or deleted files that no longer exist are deleted.
+    If nothing in the folder changed, the call returns after listing the folder.
+
+    Chunks go into the account's own namespace and carry their file, source filenames, page,
+    and (for downloaded attachments) message UIDs and date, so queries can be filtered.
+    A file whose metadata changed (e.g. received again in another email) is upserted again.
 
     🔁 Input:
-        - folder_path (str): Path to the folder containing PDF resumes.
+        - folder_path (str): Path to the folder containing the documents.
+        - namespace (str): Optional; defaults to the namespace of the user the folder belongs to.
 
     ✅ Output:
         - status: "success" or "error"
-        - ingested_files: list of file names successfully processed
-        - total_chunks: total number of vector records inserted
+        - ingested_files: list of file names (re)processed in this call
+        - total_chunks: number of vector records upserted
+        - deleted_chunks: number of stale vector records deleted
+        - stats: per-stage (parse / chunk / upsert) counts, seconds and throughput
         - error_message: (optional) if any issue occurred
 
-    Typical use: Helps enable semantic search across all ingested resumes.
-    """
-    
-    # --- Pinecone Setup --- #
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    index_name = "rag-search"
-    namespace = "document-chunks"
-    # --- Create index if needed --- #
-    if not pc.has_index(index_name):
-        pc.create_index_for_model(
-            name=index_name,
-            cloud="aws",
-            region="us-east-1",
-            embed={
-            "model": "llama-text-embed-v2",
-            "field_map": {"text": "chunk_text"}
-            }
+    Typical use: Helps enable semantic search across all ingested attachments.
+    """
+    with span("ingest") as attributes:
+        result = _ingest_folder(folder_path, namespace)
+        attributes.update(
+            status=result["status"],
+            files=len(result["ingested_files"]),
+            chunks=result["total_chunks"],
+            deleted=result.get("deleted_chunks", 0),
         )
+    return result
 
-    index = pc.Index(index_name)
 
-    desc = index.describe_index_stats()
-    print(desc)
-    
-    # --- Text Splitter --- #
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    
+def _ingest_folder(folder_path: str, namespace: Optional[str]) -> dict:
     # ------ Main Function  -----#
     folder = Path(folder_path)
     if not folder.exists():
@@ -62,53 +368,178 @@ def ingest_files_to_vector_db(folder_path: str) ->dict:
             "total_chunks": 0,
             "error_message": f"Folder not found: {folder_path}"
         }
-        
-    record_file = folder / ".ingested_files.json"
-    if record_file.exists():
-        with open(record_file, "r") as f:
-            already_ingested = set(json.load(f))
+
+    manifest_file = folder / ".ingest_manifest.json"
+    if manifest_file.exists():
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
     else:
-        already_ingested = set()
-    
+        manifest = {"signature": None, "files": {}}
+    namespace = namespace or user_namespace(folder.name)
+    if manifest.get("backend") != VECTOR_STORE_BACKEND or manifest.get("namespace") != namespace:
+        # Chunk IDs recorded for another backend / namespace say nothing about this one
+        manifest = {"signature": None, "files": {}}
+
+    with span("ingest.scan") as scan_attributes:
+        entries = _scan_folder(folder)
+        signature = _dir_signature(entries, folder)
+        scan_attributes["files"] = len(entries)
+    if signature == manifest.get("signature"):
+        return {
+            "status": "success",
+            "ingested_files": [],
+            "total_chunks": 0,
+            "deleted_chunks": 0,
+            "error_message": None
+        }
+
+    # --- Vector store Setup --- #
+    store = get_vector_store()
+
     total_chunks = 0
+    deleted_chunks = 0
     ingested_files = []
-
+    stats = {
+        "parse": {"files": 0, "pages": 0, "bytes": 0, "seconds": 0.0},
+        "chunk": {"chunks": 0, "seconds": 0.0},
+        "upsert": {"records": 0, "batches": 0, "seconds": 0.0},
+    }
+    # parse / chunk seconds are summed over worker processes; upsert seconds is wall-clock
 
     try:
-        for pdf_file in folder.glob("*.pdf"):
-            if pdf_file.name in already_ingested:
-                continue
-
-            loader = PyPDFLoader(str(pdf_file))
-            docs = loader.load()
-
-            if not docs:
-                continue
-
-            chunks = splitter.split_documents(docs)
-            records = [
-                {
-                    "_id": f"{pdf_file.stem}-chunk-{i}",
-                    "chunk_text": chunk.page_content,
-                    "category": "resumes"
-                }
-                for i, chunk in enumerate(chunks)
-            ]
+        old_files = manifest["files"]
+        new_files = {}
+        changed = []
+        # Files whose content is unchanged but whose metadata is not: every chunk is upserted again
+        refresh = set()
+        blob_meta = AttachmentStore(folder.name, root=str(folder.parent)).blob_metadata()
+        file_meta = {rel: _chunk_metadata(rel, blob_meta) for rel in entries}
+        # Size / mtime first; only files that look different are hashed
+        with span("ingest.diff") as diff_attributes:
+            for rel, (size, mtime_ns) in entries.items():
+                old = old_files.get(rel)
+                meta = _metadata_fingerprint(file_meta[rel])
+                if old and old.get("meta") != meta:
+                    refresh.add(rel)
+                elif old and old["size"] == size and old["mtime_ns"] == mtime_ns:
+                    new_files[rel] = old
+                    continue
+                sha = _file_sha256(folder / rel)
+                if old and old["sha256"] == sha and rel not in refresh:
+                    new_files[rel] = {**old, "size": size, "mtime_ns": mtime_ns}
+                    continue
+                changed.append(rel)
+                new_files[rel] = {"size": size, "mtime_ns": mtime_ns, "sha256": sha, "meta": meta, "chunks": []}
+            diff_attributes["changed"] = len(changed)
+
+        # Chunks of deleted files go away entirely
+        stale_ids = set()
+        for rel, old in old_files.items():
+            if rel not in entries:
+                stale_ids.update(old["chunks"])
+
+        parse_errors = []
+
+        def _records() -> Iterator[dict]:
+            # Streams records out as each file finishes parsing, so upserts start early
+            for parsed in _parsed_files([str(folder / rel) for rel in changed]):
+                rel = Path(parsed["path"]).relative_to(folder).as_posix()
+                if "error" in parsed:
+                    parse_errors.append(f"{Path(rel).name}: {parsed['error']}")
+                    # Keep the previous state so the file is retried next time
+                    if rel in old_files:
+                        new_files[rel] = old_files[rel]
+                    else:
+                        new_files.pop(rel, None)
+                    continue
+                stats["parse"]["files"] += 1
+                stats["parse"]["pages"] += parsed["pages"]
+                stats["parse"]["bytes"] += parsed["bytes"]
+                stats["parse"]["seconds"] += parsed["parse_s"]
+                stats["chunk"]["chunks"] += len(parsed["chunks"])
+                stats["chunk"]["seconds"] += parsed["chunk_s"]
+                # Measured in the worker process, so only the aggregates are kept
+                record_duration("ingest.parse", parsed["parse_s"])
+                record_duration("ingest.chunk", parsed["chunk_s"])
+                add("ingest.bytes_parsed", parsed["bytes"])
+
+                # IDs are unique per (folder, file path, chunk content), so unchanged chunks
+                # of an edited file keep their ID and are not embedded again
+                file_key = hashlib.sha256(f"{folder.resolve()}/{rel}".encode("utf-8")).hexdigest()[:16]
+                old_ids = set(old_files.get(rel, {}).get("chunks", []))
+                skip_ids = set() if rel in refresh else old_ids
+                chunk_ids = {}
+                for page, text, chunk_sha in parsed["chunks"]:
+                    chunk_id = f"{file_key}-{chunk_sha[:24]}"
+                    if chunk_id in chunk_ids:
+                        continue
+                    chunk_ids[chunk_id] = None
+                    if chunk_id in skip_ids:
+                        continue
+                    yield {
+                        "_id": chunk_id,
+                        "chunk_text": text,
+                        "page": page,
+                        **file_meta[rel],
+                    }
+                stale_ids.update(old_ids - set(chunk_ids))
+                new_files[rel]["chunks"] = list(chunk_ids)
+                ingested_files.append(Path(rel).name)
+
+        def _upsert(batch: List[dict]) -> int:
+            with span("vector.upsert", log=False):
+                store.upsert(namespace, batch)
+            return len(batch)
+
+        start = time.perf_counter()
+        batches = 0
+        with span("ingest.parse_upsert", files=len(changed)) as upsert_attributes:
+            with ThreadPoolExecutor(max_workers=UPSERT_CONCURRENCY) as pool:
+                # At most 2 batches per upsert worker wait in memory; parsing pauses meanwhile
+                in_flight = deque()
+                for batch in _record_batches(_records()):
+                    in_flight.append(pool.submit(_upsert, batch))
+                    batches += 1
+                    while len(in_flight) > 2 * UPSERT_CONCURRENCY:
+                        total_chunks += in_flight.popleft().result()
+                while in_flight:
+                    total_chunks += in_flight.popleft().result()
+            upsert_attributes.update(records=total_chunks, batches=batches)
+        stats["upsert"]["seconds"] = time.perf_counter() - start
+        stats["elapsed_s"] = stats["upsert"]["seconds"]
+        stats["upsert"]["records"] = total_chunks
+        stats["upsert"]["batches"] = batches
+
+        stale_ids = sorted(stale_ids)
+        if stale_ids:
+            with span("ingest.delete", ids=len(stale_ids)):
+                for i in range(0, len(stale_ids), DELETE_BATCH_IDS):
+                    store.delete(namespace, stale_ids[i:i + DELETE_BATCH_IDS])
+        deleted_chunks = len(stale_ids)
+        if total_chunks or deleted_chunks:
+            bump_index_generation(namespace)
+            invalidate_rag_cache()
 
-            index.upsert_records(namespace=namespace, records=records)
-            total_chunks += len(records)
-            ingested_files.append(pdf_file.name)
-            already_ingested.add(pdf_file.name)
+        stats["parse"]["mb_per_s"] = _throughput(stats["parse"]["bytes"] / 1e6, stats["parse"]["seconds"])
+        stats["chunk"]["chunks_per_s"] = _throughput(stats["chunk"]["chunks"], stats["chunk"]["seconds"])
+        stats["upsert"]["records_per_s"] = _throughput(total_chunks, stats["upsert"]["seconds"])
 
-        # --- Save updated list of ingested files --- #
-        with open(record_file, "w") as f:
-            json.dump(sorted(list(already_ingested)), f)
+        # --- Save the manifest (signature only if everything went through) --- #
+        with open(manifest_file, "w") as f:
+            json.dump({
+                "backend": VECTOR_STORE_BACKEND,
+                "namespace": namespace,
+                "signature": None if parse_errors else signature,
+                "files": new_files,
+            }, f)
 
         return {
-            "status": "success",
+            "status": "success" if not parse_errors else "error",
             "ingested_files": ingested_files,
             "total_chunks": total_chunks,
-            "error_message": None
+            "deleted_chunks": deleted_chunks,
+            "stats": stats,
+            "error_message": "; ".join(parse_errors) or None
         }
 
     except Exception as e:
@@ -116,67 +547,286 @@ def ingest_files_to_vector_db(folder_path: str) ->dict:
             "status": "error",
             "ingested_files": ingested_files,
             "total_chunks": total_chunks,
+            "deleted_chunks": deleted_chunks,
+            "stats": stats,
             "error_message": str(e)
         }
 
-def query_vector_db(query: str, top_k: int = 5) -> dict:
+# --- Answer generation --- #
+# Prompt tokens available for retrieved context
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+# Shortest prefix/suffix overlap (chars) treated as splitter overlap between two chunks
+_MIN_OVERLAP = 20
+
+ANSWER_PROMPT_TEMPLATE = """You are an expert assistant answering questions based on extracted  chunks.
+Here is the question:
+{query}
+
+And here is the context:
+{context}
+
+Please answer concisely and accurately based only on the above context.
+"""
+
+
+def _trim_overlap(text: str, kept: List[str]) -> str:
+    """Removes the start / end of `text` that repeats the end / start of an already kept chunk."""
+    for other in kept:
+        for k in range(min(len(other), len(text), 2 * CHUNK_OVERLAP), _MIN_OVERLAP - 1, -1):
+            if other.endswith(text[:k]):
+                text = text[k:]
+                break
+        for k in range(min(len(other), len(text), 2 * CHUNK_OVERLAP), _MIN_OVERLAP - 1, -1):
+            if other.startswith(text[-k:]):
+                text = text[:-k]
+                break
+    return text.strip()
+
+
+def pack_context(hits: List[dict], max_tokens: int = RAG_CONTEXT_TOKENS) -> List[str]:
+    """
+    Context chunks for the answer prompt, best score first. Chunks contained in a
+    better one are dropped, and text that repeats a neighbouring chunk (the splitter's
+    overlap) is cut off. Chunks are added until `max_tokens` is reached; the first
+    chunk that does not fit is truncated so the budget is used.
+    """
+    kept, used = [], 0
+    for hit in sorted(hits, key=lambda h: h.get("_score", 0.0), reverse=True):
+        text = hit["fields"]["chunk_text"].strip()
+        if not text or any(text in other for other in kept):
+            continue
+        text = _trim_overlap(text, kept)
+        if len(text) < _MIN_OVERLAP:
+            continue
+        tokens = count_tokens(text)
+        if used + tokens > max_tokens:
+            remaining = max_tokens - used
+            if remaining >= _MIN_OVERLAP:
+                kept.append(truncate_to_tokens(text, remaining))
+            break
+        kept.append(text)
+        used += tokens
+    return kept
+
+
+def _prepare_answer(query: str, top_k: int, email_user: Optional[str], filters: Optional[dict]) -> dict:
+    """Retrieval, context packing and answer-cache lookup shared by both answer modes."""
+    store = get_vector_store()
+    with span("rag.retrieve", top_k=top_k, filtered=bool(filters)) as attributes:
+        namespace = user_namespace(email_user)
+        hits, cache_hit = _cached_search(store, namespace, query, top_k, filters)
+        attributes.update(hits=len(hits), cache_hit=cache_hit)
+    if not hits:
+        return {"hits": []}
+    with span("rag.pack", log=False):
+        source_chunks = pack_context(hits)
+    # Same question over the same retrieved chunks -> same answer, skip Gemini
+    answer_key = (index_generation(namespace), normalize_query(query), _hits_fingerprint(hits))
+    return {
+        "hits": hits,
+        "source_chunks": source_chunks,
+        "answer_key": answer_key,
+        "cached_answer": answer_cache.get(answer_key),
+        "prompt": ANSWER_PROMPT_TEMPLATE.format(query=query, context="\n\n".join(source_chunks)),
+    }
+
+
+def query_vector_db(
+    query: str,
+    top_k: int = 5,
+    email_user: Optional[str] = None,
+    filters: Optional[dict] = None,
+) -> dict:
     """
     🤖 Tool: Query Vector DB and generate synthesized answer
 
-    - Performs a semantic search over the vector DB
-    - Sends top-k results to an LLM to generate a natural language answer
-    """
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    # --- Pinecone Setup --- #
-    
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY")) 
-    index_name = "rag-search"
-    namespace = "document-chunks"
-    index = pc.Index(index_name)
-    
-    try:
-        search_results = index.search(
-            namespace=namespace,
-            query={"top_k": top_k, "inputs": {"text": query}}
-        )
+    - Performs a semantic search over the account's namespace of the vector DB
+    - `filters` narrows the search with a metadata filter (Pinecone syntax), e.g.
+      {"source": "report.pdf"} or {"timestamp": {"$gte": 1700000000}}
+    - Packs the top-k results into at most RAG_CONTEXT_TOKENS of context (see `pack_context`)
+      and sends them to an LLM to generate a natural language answer
+    - Retrievals and answers are cached (LRU + TTL) under the namespace's ingestion
+      generation, so ingestion in any process (e.g. the sync daemon) invalidates them;
+      answers are also keyed by the exact set of retrieved chunks
+
+    See `stream_vector_db_answer` for the streaming variant used by the UI.
+    """
+    with span("rag.query", top_k=top_k):
+        try:
+            prepared = _prepare_answer(query, top_k, email_user, filters)
+            if not prepared["hits"]:
+                return {
+                    "status": "no_results",
+                    "answer": "No relevant information found.",
+                    "source_chunks": []
+                }
+
+            if prepared["cached_answer"] is not None:
+                return {
+                    "status": "success",
+                    "answer": prepared["cached_answer"],
+                    "source_chunks": prepared["source_chunks"],
+                    "cached": True
+                }
+
+            with span("llm.answer"):
+                response = get_genai_model().generate_content([prepared["prompt"]])
+                parts = response.candidates[0].content.parts
+                answer_text = parts[0].text if parts and hasattr(parts[0], 'text') else str(parts[0])
+                record_llm_call("answer", count_tokens(prepared["prompt"]), answer_text, response)
+            answer_cache.put(prepared["answer_key"], answer_text)
 
-        hits = search_results["result"]["hits"]
-        if not hits:
             return {
-                "status": "no_results",
-                "answer": "No relevant information found.",
-                "source_chunks": []
+                "status": "success",
+                "answer" : answer_text,
+                "source_chunks": prepared["source_chunks"],
+                "cached": False
             }
 
-        source_chunks = [hit["fields"]["chunk_text"] for hit in hits]
-        context = "\n\n".join(source_chunks)
+        except Exception as e:
+            return {
+                "status": "error",
+                "answer": None,
+                "source_chunks": [],
+                "error_message": str(e)
+            }
 
-        prompt = f"""You are an expert assistant answering questions based on extracted  chunks.
-Here is the question:
-{query}
 
-And here is the context:
-{context}
+def _stream_text(response) -> Iterator[str]:
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # A chunk without text parts (e.g. only finish / safety metadata)
+            continue
+        if text:
+            yield text
 
-Please answer concisely and accurately based only on the above context.
-"""
 
-        response = model.generate_content([prompt])
-        parts = response.candidates[0].content.parts
-        answer_text = parts[0].text if parts and hasattr(parts[0], 'text') else str(parts[0])
-        
-        return {
-            "status": "success",
-            "answer" : answer_text,
-            "source_chunks": source_chunks
-        }
+def stream_vector_db_answer(
+    query: str,
+    top_k: int = 5,
+    email_user: Optional[str] = None,
+    filters: Optional[dict] = None,
+) -> dict:
+    """
+    🌊 Streaming version of `query_vector_db`.
+
+    Retrieval runs up front; the answer is returned as `answer_stream`, a generator of
+    text pieces as Gemini produces them (`generate_content(stream=True)`), suitable for
+    `st.write_stream`. The full answer is cached once the stream is complete, and a
+    cached answer is replayed as a single piece. `timings` is filled in while the
+    stream is consumed: first_token_s and total_s, measured from the call.
 
+    ✅ Output:
+        - status: "success", "no_results" or "error"
+        - answer_stream, source_chunks, cached, timings (on success)
+        - error_message (on error); errors while streaming are raised by the generator
+    """
+    start = time.perf_counter()
+    timings = {"first_token_s": None, "total_s": None}
+    try:
+        prepared = _prepare_answer(query, top_k, email_user, filters)
     except Exception as e:
-        return {
-            "status": "error",
-            "answer": None,
-            "source_chunks": [],
-            "error_message": str(e)
-        }
+        return {"status": "error", "source_chunks": [], "error_message": str(e)}
+    if not prepared["hits"]:
+        return {"status": "no_results", "source_chunks": []}
+
+    def _answer_stream() -> Iterator[str]:
+        if prepared["cached_answer"] is not None:
+            yield prepared["cached_answer"]
+            timings["first_token_s"] = timings["total_s"] = time.perf_counter() - start
+            return
+        with span("llm.answer_stream") as attributes:
+            response = get_genai_model().generate_content([prepared["prompt"]], stream=True)
+            answer = []
+            for piece in _stream_text(response):
+                if timings["first_token_s"] is None:
+                    timings["first_token_s"] = time.perf_counter() - start
+                answer.append(piece)
+                yield piece
+            timings["total_s"] = time.perf_counter() - start
+            attributes.update(timings)
+            record_llm_call("answer", count_tokens(prepared["prompt"]), "".join(answer), response)
+        answer_cache.put(prepared["answer_key"], "".join(answer))
+
+    return {
+        "status": "success",
+        "answer_stream": _answer_stream(),
+        "source_chunks": prepared["source_chunks"],
+        "cached": prepared["cached_answer"] is not None,
+        "timings": timings,
+    }
+
+
+# --- Background ingestion --- #
+# One ingestion at a time; it already fans out to a process pool internally
+_ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+_ingest_jobs = {}
+_ingest_lock = threading.Lock()
+
+
+def ingest_in_background(folder_path: str) -> dict:
+    """
+    Starts `ingest_files_to_vector_db` on a background thread when the folder's file
+    list changed since the last job, and reports on that job. Cheap to call on every
+    Streamlit rerun: it only lists the folder.
+
+    ✅ Output:
+        - status: "idle" (nothing to ingest), "running", "success" or "error"
+        - result: the ingestion result once the job finished, else None
+    """
+    folder = Path(folder_path)
+    if not folder.exists():
+        return {"status": "idle", "result": None}
+    signature = _dir_signature(_scan_folder(folder), folder)
+    key = str(folder.resolve())
+
+    with _ingest_lock:
+        job = _ingest_jobs.get(key)
+        # A change while a job runs is picked up by the next call after it finishes
+        if job is None or (job["signature"] != signature and job["future"].done()):
+            job = {
+                "signature": signature,
+                "future": _ingest_executor.submit(ingest_files_to_vector_db, folder_path),
+            }
+            _ingest_jobs[key] = job
+
+    future = job["future"]
+    if not future.done():
+        return {"status": "running", "result": None}
+    try:
+        result = future.result()
+    except Exception as e:
+        result = {"status": "error", "ingested_files": [], "total_chunks": 0, "error_message": str(e)}
+    return {"status": result["status"], "result": result}
+
+
+# --- Preview --- #
+PREVIEW_CHARS = 500
+_preview_cache = LRUCache(RAG_CACHE_SIZE, RAG_CACHE_TTL)
+register_cache("preview", _preview_cache)
+# (path, size, mtime) -> sha256, so plain files are hashed once per version
+_file_hashes = LRUCache(RAG_CACHE_SIZE, RAG_CACHE_TTL)
+
+
+def preview_document(file_path: str, max_chars: int = PREVIEW_CHARS) -> str:
+    """
+    First `max_chars` characters of a document's first page, cached by the file's
+    SHA-256 so the same attachment is parsed once however often it is selected.
+    """
+    path = Path(file_path)
+    st = path.stat()
+    stat_key = (str(path.resolve()), st.st_size, st.st_mtime_ns)
+    sha = _file_hashes.get(stat_key)
+    if sha is None:
+        sha = _file_sha256(path)
+        _file_hashes.put(stat_key, sha)
 
+    key = (sha, max_chars)
+    preview = _preview_cache.get(key)
+    if preview is None:
+        pages = extract_text_pages(file_path, max_pages=1)
+        preview = pages[0][:max_chars] if pages else ""
+        _preview_cache.put(key, preview)
+    return preview
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+ATTACHMENTS_ROOT = "attachments"
+
+# One lock per manifest, shared by every AttachmentStore of the same user in this process
+_manifest_locks: Dict[str, threading.Lock] = {}
+_manifest_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _locked_file(path: Path):
+    """Exclusive lock on `path` across processes (the sync daemon and the Streamlit app)."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class HashingWriter:
+    """
+    File-like object that writes into a temporary file inside the blob store
+    while computing the SHA-256 of everything written. `commit()` moves the
+    file to its content address (or drops it if that content already exists).
+    """
+
+    def __init__(self, store: "AttachmentStore", suffix: str):
+        self._store = store
+        self._suffix = suffix
+        self._hash = hashlib.sha256()
+        self.size = 0
+        store.blob_dir.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.blob_dir, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def commit(self) -> str:
+        self._file.close()
+        digest = self._hash.hexdigest()
+        final_path = self._store.blob_path(digest, self._suffix)
+        if final_path.exists():
+            os.remove(self._tmp_path)
+        else:
+            final_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self._tmp_path, final_path)
+        return digest
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class AttachmentStore:
+    """
+    Per-user, content-addressed attachment storage.
+
+    Blobs live at `attachments/<user>/blobs/<sha[:2]>/<sha256><ext>`, so a file
+    that was sent in many threads is stored (and later parsed / embedded) once.
+    `manifest.json` maps each (message, filename) to the hash of its content. It is
+    only rewritten under a lock shared by all stores of the user in this process and
+    a file lock (`manifest.lock`) shared with other processes, so concurrent
+    downloads never drop each other's entries.
+    """
+
+    def __init__(self, email_user: str, root: str = ATTACHMENTS_ROOT):
+        self.user_dir = Path(root) / email_user
+        self.blob_dir = self.user_dir / "blobs"
+        self.manifest_path = self.user_dir / "manifest.json"
+        key = str(self.manifest_path.resolve())
+        with _manifest_locks_lock:
+            self._lock = _manifest_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def _manifest_lock(self):
+        self.user_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock, _locked_file(self.user_dir / "manifest.lock"):
+            yield
+
+    @staticmethod
+    def message_key(attachment: dict) -> str:
+        """Manifest key of an attachment entry from `SyncStateStore.list_attachments`."""
+        return "{mailbox}/{uidvalidity}/{uid}/{filename}".format(**attachment)
+
+    def blob_path(self, digest: str, suffix: str = "") -> Path:
+        return self.blob_dir / digest[:2] / f"{digest}{suffix.lower()}"
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: Dict[str, dict]):
+        self.user_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Local blob path for a manifest key, if it was already downloaded."""
+        entry = self._load_manifest().get(key)
+        if not entry:
+            return None
+        path = self.blob_path(entry["sha256"], Path(entry["filename"]).suffix)
+        return path if path.exists() else None
+
+    def writer(self, filename: str) -> HashingWriter:
+        return HashingWriter(self, Path(filename).suffix)
+
+    def record(
+        self,
+        key: str,
+        filename: str,
+        digest: str,
+        size: int,
+        uid: Optional[int] = None,
+        date: Optional[str] = None,
+    ) -> Path:
+        entry = {"filename": filename, "sha256": digest, "size": size}
+        if uid is not None:
+            entry["uid"] = str(uid)
+        if date:
+            entry["date"] = date
+        # Read-modify-write under the lock, so the manifest is re-read after any other writer
+        with self._manifest_lock():
+            manifest = self._load_manifest()
+            manifest[key] = entry
+            self._save_manifest(manifest)
+        return self.blob_path(digest, Path(filename).suffix)
+
+    def entries(self) -> Dict[str, dict]:
+        """
+        Every downloaded attachment by manifest key: {"filename", "path", "mailbox", "uid", "date"}.
+        Identical files received in different emails are listed once per email.
+        """
+        entries = {}
+        for key, entry in self._load_manifest().items():
+            path = self.blob_path(entry["sha256"], Path(entry["filename"]).suffix)
+            if not path.exists():
+                continue
+            mailbox, _, uid, _ = key.rsplit("/", 3)
+            entries[key] = {
+                "filename": entry["filename"],
+                "path": str(path),
+                "mailbox": mailbox,
+                "uid": entry.get("uid", uid),
+                "date": entry.get("date"),
+            }
+        return entries
+
+    def files(self) -> List[dict]:
+        """
+        One entry per unique blob: {"sha256", "path", "filenames"}, where
+        `filenames` lists every name this content was received under.
+        """
+        unique = {}
+        for entry in self._load_manifest().values():
+            path = self.blob_path(entry["sha256"], Path(entry["filename"]).suffix)
+            if not path.exists():
+                continue
+            item = unique.setdefault(entry["sha256"], {"sha256": entry["sha256"], "path": str(path), "filenames": []})
+            if entry["filename"] not in item["filenames"]:
+                item["filenames"].append(entry["filename"])
+        return list(unique.values())
+
+    def blob_metadata(self) -> Dict[str, dict]:
+        """
+        Message metadata per blob hash: every filename and message UID the content
+        was received under, and the earliest message date (ISO 8601) if known.
+        """
+        metadata = {}
+        for entry in self._load_manifest().values():
+            item = metadata.setdefault(entry["sha256"], {"source": [], "uid": [], "date": None})
+            if entry["filename"] not in item["source"]:
+                item["source"].append(entry["filename"])
+            if entry.get("uid") and entry["uid"] not in item["uid"]:
+                item["uid"].append(entry["uid"])
+            if entry.get("date") and (item["date"] is None or entry["date"] < item["date"]):
+                item["date"] = entry["date"]
+        return metadata
@@ -0,0 +1,84 @@
+import html
+import re
+
+# Raw bodies are cut to this many characters before any parsing happens
+MAX_RAW_BODY_CHARS = 200_000
+
+# Cheap check for "does this look like HTML at all?": any start/end tag, comment or
+# doctype, or any character reference (`&amp;`, `&#39;`, `&#x27;`). Inline-only
+# fragments like "<b>Due</b> Friday" or "Q&amp;A" must not skip the HTML path.
+_HTML_HINT_RE = re.compile(
+    r"<(?:!|/?[a-z][a-z0-9:-]*[\s/>])|&(?:[a-z][a-z0-9]*|#[0-9]+|#x[0-9a-f]+);",
+    re.I,
+)
+
+# --- Streaming tag stripping (replaces BeautifulSoup's html.parser tree) --- #
+_HTML_DROP_RE = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>|<!--.*?-->", re.I | re.S)
+_HTML_BREAK_RE = re.compile(r"<(?:br|/p|/div|/tr|/li|/h[1-6]|/table)\b[^>]*>", re.I)
+_HTML_TAG_RE = re.compile(r"<[^>]*>")
+
+_CUTOFF_KEYWORDS = ['Manage notifications', 'Privacy policy', 'Contact us', 'Copyright']
+
+# URLs, logo/image boilerplate, dash/equals rules and cutoff keywords in one alternation.
+# Cutoff keywords are matched as a named group: the first one ends the body.
+# The leading lookahead lists every possible first character so most positions
+# are rejected before the alternation is tried.
+_CLEAN_RE = re.compile(
+    r"(?=[hMPCLlIiPpVvCc=-])(?:"
+    r"https?://\S+"
+    r"|(?P<cut>" + "|".join(re.escape(kw) for kw in _CUTOFF_KEYWORDS) + r")"
+    r"|(?i:logo|icon|image|powered by|view in browser|calendar)"
+    r"|[-=]{2,}"
+    r")"
+)
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_TRANSLATE = {ord('\r'): None, ord('\xa0'): ' '}
+
+
+def looks_like_html(body: str) -> bool:
+    return _HTML_HINT_RE.search(body) is not None
+
+
+def html_to_text(body: str) -> str:
+    """
+    Regex-based HTML to text: drops script/style/head blocks and comments,
+    turns block-level closing tags into newlines and strips the rest.
+    """
+    body = _HTML_DROP_RE.sub('', body)
+    body = _HTML_BREAK_RE.sub('\n', body)
+    body = _HTML_TAG_RE.sub('', body)
+    if '&' in body:
+        body = html.unescape(body)
+    return body
+
+
+def clean_email_body(body: str) -> str:
+    """
+    Cleans raw email body text by removing unwanted links, logos, and boilerplate.
+
+    Plain-text bodies skip HTML handling entirely, and URL / boilerplate removal
+    and the cutoff keywords are applied in a single scan over the text.
+    """
+    if not body:
+        return ""
+    body = body[:MAX_RAW_BODY_CHARS]
+
+    if looks_like_html(body):
+        body = html_to_text(body)
+
+    # Replace \r and \xa0
+    body = body.translate(_TRANSLATE)
+
+    pieces = []
+    pos = 0
+    for match in _CLEAN_RE.finditer(body):
+        pieces.append(body[pos:match.start()])
+        pos = match.end()
+        if match.group("cut"):
+            pos = len(body)
+            break
+    pieces.append(body[pos:])
+    body = ''.join(pieces)
+
+    body = _BLANK_LINES_RE.sub('\n\n', body)  # Limit empty lines to 2
+    return body.strip()
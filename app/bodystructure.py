@@ -0,0 +1,288 @@
+from dataclasses import dataclass, field
+import codecs
+from email.errors import HeaderParseError
+from email.header import Header, decode_header, make_header
+from typing import Iterator, List, Optional
+from urllib.parse import unquote
+
+
+class _Literal(bytes):
+    """Marks a literal ({n} + raw bytes) inside a flattened FETCH response."""
+
+
+def _flatten(data: list) -> List[bytes]:
+    """
+    Turns imaplib's FETCH response (a mix of bytes and (meta, literal) tuples)
+    into alternating text / literal segments.
+    """
+    segments = []
+    for item in data:
+        if isinstance(item, tuple):
+            meta, literal = item
+            if segments and not isinstance(segments[-1], _Literal):
+                segments[-1] += meta
+            else:
+                segments.append(meta)
+            segments.append(_Literal(literal))
+        elif isinstance(item, bytes):
+            if segments and not isinstance(segments[-1], _Literal):
+                segments[-1] += item
+            else:
+                segments.append(item)
+    return segments
+
+
+class _Reader:
+    def __init__(self, segments: List[bytes]):
+        self.segments = segments
+        self.index = 0
+        self.pos = 0
+
+    def _text(self) -> Optional[bytes]:
+        """Current text segment, or None when positioned on a literal / at the end."""
+        while self.index < len(self.segments):
+            seg = self.segments[self.index]
+            if isinstance(seg, _Literal):
+                return None
+            if self.pos < len(seg):
+                return seg
+            self.index += 1
+            self.pos = 0
+        return None
+
+    def skip_spaces(self):
+        while True:
+            seg = self._text()
+            if seg is None or seg[self.pos:self.pos + 1] not in (b" ", b"\r", b"\n"):
+                return
+            self.pos += 1
+
+    def at_end(self) -> bool:
+        self.skip_spaces()
+        return self.index >= len(self.segments)
+
+    def read(self):
+        self.skip_spaces()
+        seg = self._text()
+        if seg is None:
+            if self.index < len(self.segments):
+                # Literal whose {n} marker was already consumed
+                literal = self.segments[self.index]
+                self.index += 1
+                self.pos = 0
+                return bytes(literal)
+            raise ValueError("Unexpected end of FETCH response")
+
+        ch = seg[self.pos:self.pos + 1]
+        if ch == b"(":
+            self.pos += 1
+            items = []
+            while True:
+                self.skip_spaces()
+                seg = self._text()
+                if seg is not None and seg[self.pos:self.pos + 1] == b")":
+                    self.pos += 1
+                    return items
+                items.append(self.read())
+        if ch == b'"':
+            self.pos += 1
+            out = bytearray()
+            while True:
+                c = seg[self.pos:self.pos + 1]
+                if not c:
+                    raise ValueError("Unterminated quoted string")
+                self.pos += 1
+                if c == b"\\":
+                    out += seg[self.pos:self.pos + 1]
+                    self.pos += 1
+                elif c == b'"':
+                    return bytes(out)
+                else:
+                    out += c
+        if ch == b"{":
+            end = seg.index(b"}", self.pos)
+            self.pos = end + 1
+            literal = self.segments[self.index + 1]
+            self.index += 2
+            self.pos = 0
+            return bytes(literal)
+
+        # Atom; section specs like BODY[HEADER.FIELDS (FROM)]<0> may contain spaces/parens
+        start = self.pos
+        depth = 0
+        while self.pos < len(seg):
+            c = seg[self.pos:self.pos + 1]
+            if c == b"[":
+                depth += 1
+            elif c == b"]":
+                depth -= 1
+            elif depth == 0 and c in (b" ", b"(", b")", b'"'):
+                break
+            self.pos += 1
+        atom = seg[start:self.pos]
+        return None if atom.upper() == b"NIL" else atom
+
+
+def parse_fetch_items(data: list) -> List[dict]:
+    """
+    Parses a raw `UID FETCH` response into one dict per message, mapping the
+    upper-cased item name (UID, BODYSTRUCTURE, BODY[HEADER], BODY[1]<0>, ...)
+    to its value. Lists become Python lists, strings/literals become bytes.
+    """
+    reader = _Reader(_flatten(data))
+    messages = []
+    while not reader.at_end():
+        reader.read()  # message sequence number
+        items = reader.read()
+        if not isinstance(items, list):
+            continue
+        messages.append({
+            bytes(items[i]).upper().decode(): items[i + 1]
+            for i in range(0, len(items) - 1, 2)
+        })
+    return messages
+
+
+@dataclass
+class BodyPart:
+    part: str
+    mime_type: str
+    params: dict = field(default_factory=dict)
+    encoding: str = "7bit"
+    size: int = 0
+    disposition: Optional[str] = None
+    filename: Optional[str] = None
+
+    @property
+    def charset(self) -> Optional[str]:
+        return self.params.get("charset")
+
+    @property
+    def is_attachment(self) -> bool:
+        return self.disposition == "attachment" and bool(self.filename)
+
+    @property
+    def is_body_candidate(self) -> bool:
+        """Plain or HTML text that is not an attachment."""
+        return self.mime_type in ("text/plain", "text/html") and self.disposition != "attachment"
+
+
+def _s(value) -> str:
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else (value or "")
+
+
+def _int(value) -> int:
+    """Numeric BODYSTRUCTURE field; 0 when missing or malformed."""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    return {_s(value[i]).lower(): _s(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+
+def decode_text(payload: bytes, charset: Optional[str]) -> str:
+    """
+    Decodes a (possibly truncated) text part with its declared charset, falling
+    back to UTF-8 when the charset is missing, unknown or does not fit the bytes.
+    """
+    try:
+        codec = codecs.lookup(charset).name if charset else "utf-8"
+    except LookupError:
+        codec = "utf-8"
+    for candidate in dict.fromkeys((codec, "utf-8")):
+        try:
+            return payload.decode(candidate)
+        except UnicodeDecodeError:
+            continue
+    # A partial fetch may also end inside a multi-byte character
+    return payload.decode(codec, errors="replace")
+
+
+def decode_header_text(value) -> str:
+    """
+    Decodes a header value chunk by chunk, each RFC 2047 encoded word with its own
+    charset and raw 8-bit bytes as UTF-8. Malformed values fall back to the raw
+    text, never raise.
+    """
+    if value is None:
+        return ""
+    try:
+        chunks = decode_header(value if isinstance(value, Header) else str(value))
+    except HeaderParseError:
+        return str(value).encode("utf-8", "surrogateescape").decode("utf-8", "replace")
+    return "".join(
+        decode_text(chunk, charset) if isinstance(chunk, bytes) else chunk
+        for chunk, charset in chunks
+    )
+
+
+def _decode_extended(value: str) -> str:
+    """
+    RFC 2231 extended value, `charset'language'percent-encoded`: utf-8''Q3%20report.pdf
+    or utf-8'en-us'Q3%20report.pdf. Unknown charsets fall back to UTF-8.
+    """
+    pieces = value.split("'", 2)
+    charset, encoded = (pieces[0], pieces[2]) if len(pieces) == 3 else ("", value)
+    try:
+        charset = codecs.lookup(charset).name if charset else "utf-8"
+    except LookupError:
+        charset = "utf-8"
+    return unquote(encoded, encoding=charset, errors="replace")
+
+
+def _decode_filename(params: dict) -> Optional[str]:
+    name = params.get("filename") or params.get("name")
+    if not name:
+        extended = params.get("filename*") or params.get("name*")
+        return _decode_extended(extended) if extended else None
+    try:
+        return str(make_header(decode_header(name)))
+    except Exception:
+        return name
+
+
+def _single_part(body: list, part: str) -> BodyPart:
+    mime_type = f"{_s(body[0])}/{_s(body[1])}".lower()
+    params = _params(body[2])
+    # Extension data sits after the type-specific fields
+    if mime_type.startswith("text/"):
+        ext = 8
+    elif mime_type == "message/rfc822":
+        ext = 10
+    else:
+        ext = 7
+    disposition = None
+    dsp_params = {}
+    if len(body) > ext + 1 and isinstance(body[ext + 1], list):
+        disposition = _s(body[ext + 1][0]).lower()
+        dsp_params = _params(body[ext + 1][1] if len(body[ext + 1]) > 1 else None)
+    return BodyPart(
+        part=part,
+        mime_type=mime_type,
+        params=params,
+        encoding=_s(body[5]).lower() or "7bit",
+        size=_int(body[6]),
+        disposition=disposition,
+        filename=_decode_filename({**params, **dsp_params}),
+    )
+
+
+def walk_bodystructure(body: list, prefix: str = "") -> Iterator[BodyPart]:
+    """
+    Yields every leaf part of a parsed BODYSTRUCTURE with its IMAP part number
+    ("1", "1.2", ...). Attached messages are reported as a single part.
+    """
+    if body and isinstance(body[0], list):
+        index = 1
+        for child in body:
+            if not isinstance(child, list):
+                break
+            yield from walk_bodystructure(child, f"{prefix}{index}.")
+            index += 1
+    else:
+        yield _single_part(body, prefix.rstrip(".") or "1")
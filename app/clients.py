@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+
+_clients: Dict[str, object] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+_timings: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Records how long the wrapped block took in the startup report. Only the first
+    run is kept, so Streamlit reruns do not overwrite the cold-start numbers.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings.setdefault(name, time.perf_counter() - start)
+
+
+def get_client(name: str, factory: Callable[[], object]):
+    """
+    Returns the process-wide client registered under `name`, creating it with
+    `factory` on first use. Creation happens once even when several threads
+    (or Streamlit reruns) ask at the same time.
+    """
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _clients:
+            with timed(f"create {name}"):
+                _clients[name] = factory()
+        return _clients[name]
+
+
+def set_client(name: str, client: object):
+    """Registers `client` under `name` ahead of first use, e.g. a stand-in for benchmarks."""
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        _clients[name] = client
+
+
+def startup_report() -> List[dict]:
+    """Import / client-creation timings recorded so far in this process."""
+    return [{"name": name, "seconds": seconds} for name, seconds in _timings.items()]
+
+
+# --- Clients --- #
+def _configure_genai():
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    return genai
+
+
+def get_genai_model(model_name: str = GEMINI_MODEL_NAME):
+    """Shared `google.generativeai` model used for RAG answers."""
+    def _factory():
+        genai = get_client("genai", _configure_genai)
+        return genai.GenerativeModel(model_name)
+
+    return get_client(f"genai-model:{model_name}", _factory)
+
+
+def get_chat_llm(model_name: str = GEMINI_MODEL_NAME):
+    """Shared LangChain chat model used for task extraction."""
+    def _factory():
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        return ChatGoogleGenerativeAI(
+            model=model_name,
+            temperature=0,
+            max_tokens=None,
+        )
+
+    return get_client(f"chat-llm:{model_name}", _factory)
@@ -1,15 +1,35 @@
 
 import imaplib
-import email
-from email.header import decode_header
-from typing import List
-import re
-from bs4 import BeautifulSoup
-from app.task_extractor import extract_todo_from_email
-import json
-import os 
+import logging
+from email.parser import BytesHeaderParser
+from email.utils import parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional
+from app.body_cleaner import clean_email_body
+from app.bodystructure import decode_header_text, decode_text
+from app.task_extractor import extract_todos_concurrently
+from app.triage import triage_email
+from app.imap_fetcher import (
+    IMAPConnectionPool,
+    chunked,
+    download_part,
+    fetch_message_ids,
+    fetch_summaries,
+    fetch_summary_batch,
+    get_uidvalidity,
+    list_folders,
+    quote_mailbox,
+    uid_search,
+    uid_search_since,
+)
+from app.sync_state import get_sync_state_store
+from app.blob_store import AttachmentStore
+from app.tracing import add, span
 from datetime import datetime, timedelta
 
+logger = logging.getLogger("opspilot.mail")
+
 def build_search_criteria(from_date: str, to_date: str = None) -> str:
 
     if not to_date or from_date == to_date:
@@ -23,154 +43,365 @@ def build_search_criteria(from_date: str, to_date: str = None) -> str:
             to_date = to_dt.strftime("%d-%b-%Y")
         return f'(SINCE {from_date} BEFORE {to_date})'
 
-def clean_email_body(body: str) -> str:
+def build_email_data(summary: dict, mailbox_state=None) -> dict:
     """
-    Cleans raw email body text by removing unwanted links, logos, and boilerplate.
+    Builds the email_data dict used for extraction from a message summary
+    (headers + text part + attachment metadata, see `fetch_summaries`).
+    Attachments are only recorded, not downloaded. Bulk mail is flagged by the
+    local triage stage (see `app/triage.py`) so it can skip the LLM.
     """
-    soup = BeautifulSoup(body, "html.parser")
-    body = soup.get_text()
-    
-    # Remove URLs
-    body = re.sub(r'https?://\S+', '', body)
-    
-    # Remove images, logos, etc.
-    body = re.sub(r'(?i)(logo|icon|image|powered by|view in browser|calendar)', '', body)
+    if summary.get("error"):
+        # The fetch could not parse this message's structure (see `fetch_summary_batch`)
+        raise ValueError(summary["error"])
+    with span("mime.parse", log=False):
+        msg = BytesHeaderParser().parsebytes(summary["header"])
+        subject = decode_header_text(msg["Subject"])
+        from_email = decode_header_text(msg.get("From"))
+        date = msg.get("Date")
+        try:
+            iso_date = parsedate_to_datetime(date).isoformat() if date else None
+        except (TypeError, ValueError):
+            iso_date = None
 
-    # Remove extra dashes or repeated chars
-    body = re.sub(r'[-=]{2,}', '', body)
+        # Declared charset first; the part may also be cut short by the partial fetch
+        text_part = summary["text_part"]
+        body = decode_text(summary["text"], text_part.charset if text_part else None)
+    with span("clean_body", log=False):
+        cleaned_body = clean_email_body(body)
 
-    # Replace \r\n and \xa0 and strip extra spaces
-    body = body.replace('\r', '').replace('\n', '\n').replace('\xa0', ' ')
-    body = re.sub(r'\n{3,}', '\n\n', body)  # Limit empty lines to 2
+    attachments = [part.filename for part in summary["attachments"]]
+    if mailbox_state is not None:
+        with span("sync_state.record_attachments", log=False):
+            mailbox_state.record_attachments(summary["uid"], summary["attachments"], iso_date)
+    with span("triage", log=False):
+        triage = triage_email(msg, subject, cleaned_body)
 
-    # Optional: Remove "Manage notifications", "Privacy Policy" etc.
-    cutoff_keywords = ['Manage notifications', 'Privacy policy', 'Contact us', 'Copyright']
-    for kw in cutoff_keywords:
-        body = body.split(kw)[0]
+    email_data = {
+        "subject": subject,
+        "from": from_email,
+        "date": date,
+        "body": cleaned_body,
+        "attachments":attachments if attachments else None,
+        "attachment_meta": [
+            {"filename": a.filename, "size": a.size, "mime_type": a.mime_type, "part": a.part}
+            for a in summary["attachments"]
+        ],
+        "uid": str(summary["uid"]),
+        "triage": triage,
+    }
+    return email_data
 
-    return body.strip()
+def _build_or_skip(summary: dict, mailbox_state=None) -> Optional[dict]:
+    """
+    `build_email_data`, isolated per message: one email that cannot be parsed is
+    logged and recorded as failed instead of ending the run. It is not marked
+    processed, and `_pending_since` searches it again on the next since-last-sync
+    run (a date-range sync finds it through `filter_unprocessed`).
+    """
+    try:
+        return build_email_data(summary, mailbox_state)
+    except Exception:
+        add("mime.errors")
+        logger.exception("Skipping UID %s: could not parse the message", summary.get("uid"))
+        if mailbox_state is not None:
+            mailbox_state.mark_failed(summary["uid"])
+        return None
 
-SEEN_UIDS_FILE = "seen_uids.json"
+def _pending_since(server: imaplib.IMAP4, state) -> List[int]:
+    """
+    UIDs above the last synced UID, plus earlier ones that failed to parse: `last_uid`
+    moves past a failed message as soon as a later one is processed.
+    """
+    # Duplicates handled ahead of still-pending UIDs sit above `last_uid` but are done
+    return state.filter_unprocessed(sorted(set(state.failed_uids()) | set(uid_search_since(server, state.last_uid))))
 
-def load_seen_uids():
-    if os.path.exists(SEEN_UIDS_FILE):
-        with open(SEEN_UIDS_FILE, "r") as f:
-            return set(json.load(f)["seen_uids"])
-    return set()
+def _claim_owned(server: imaplib.IMAP4, email_host: str, email_user: str, state, uids: List[int], message_ids=None) -> List[int]:
+    """
+    Claims `uids` of one folder by Message-ID and returns the ones this folder owns.
+    The Message-IDs are fetched on `server` unless `message_ids` already has them.
+    Copies already owned by another folder (an earlier sync, or a folder claimed
+    before this one) are marked processed and dropped before any body is fetched.
+    They only move `last_uid` when no owned UID below them is still pending, so a
+    run that stops early never leaves an owned message under `last_uid`.
+    """
+    if message_ids is None:
+        message_ids = fetch_message_ids(server, uids)
+    owned, duplicates = [], []
+    for uid in uids:
+        mid = message_ids.get(uid)
+        if mid is None or get_sync_state_store().claim_message(email_host, email_user, mid, state.mailbox_id, uid):
+            owned.append(uid)
+        else:
+            add("imap.duplicates_skipped")
+            duplicates.append(uid)
+    lowest_owned = min(owned, default=None)
+    for uid in duplicates:
+        state.mark_processed(uid, advance=lowest_owned is None or uid < lowest_owned)
+    return owned
 
-def save_seen_uids(uids):
-    with open(SEEN_UIDS_FILE, "w") as f:
-        json.dump({"seen_uids": list(uids)}, f)
-        
+MAILBOX = "INBOX"
+# UIDs per fetch job in multi-folder mode; smaller than FETCH_BATCH_SIZE so a single
+# large folder is still spread across the pooled connections
+FOLDER_FETCH_BATCH_SIZE = 100
 
-def process_mail(from_date:str,to_date:str,email_host: str, email_user: str, email_pass: str) -> List[dict]:
+
+def _result(email_data: dict, extraction: Optional[str], mailbox: str) -> dict:
+    return {
+        "subject": email_data["subject"],
+        "from": email_data["from"],
+        "date": email_data["date"],
+        "attachments": email_data["attachments"],
+        "attachment_meta": email_data["attachment_meta"],
+        "uid": email_data["uid"],
+        "mailbox": mailbox,
+        "triage": email_data["triage"],
+        "body": email_data["body"],
+        "extraction": extraction
+    }
+
+def stream_mail(
+    from_date: str,
+    to_date: str,
+    email_host: str,
+    email_user: str,
+    email_pass: str,
+    on_total: Optional[Callable[[int], None]] = None,
+    since_last_sync: bool = False,
+) -> Iterator[dict]:
     """
-    Fetches recent emails using IMAP protocol and returns subject + body.
+    Streaming version of `process_mail`: yields each processed email as soon as
+    its extraction is ready instead of collecting them into a list.
 
     Args:
-        limit (int): Number of recent emails to fetch (default is 5).
+        on_total: optional callback, called once with the number of new emails
+            that are about to be processed (useful for progress bars).
+        since_last_sync: ignore the date range and fetch only mail that arrived
+            after the last synced UID of this account. The first sync of a mailbox
+            (no synced UID yet) still uses the date range.
 
-    Returns:
-        List[dict]: List of emails with subject, from, date, and body.
+    Yields:
+        dict: subject, from, date, attachments, uid, mailbox, triage, cleaned body and extraction of one email,
+        or a single {"error": ...} dict if the run fails.
     """
 
     EMAIL_HOST = email_host
     EMAIL_USER = email_user
     EMAIL_PASS = email_pass
 
-    seen_uids = load_seen_uids()
-    new_seen_uids = set()
-    
-    results =[]
+    # Spans the whole run, including the time the caller spends on each yielded email
+    with span("sync", since_last_sync=since_last_sync, emails=0) as sync_attributes:
+        server = None
+        try:
+            with span("imap.connect"):
+                server = imaplib.IMAP4_SSL(EMAIL_HOST)
+                try:
+                    server.login(EMAIL_USER, EMAIL_PASS)
+                except imaplib.IMAP4.error as e:
+                    yield {"error": "Login failed. Please check your email and app password."}
+                    return
+                server.select(MAILBOX)
+                sync_state = get_sync_state_store().mailbox(
+                    EMAIL_HOST, EMAIL_USER, MAILBOX, get_uidvalidity(server, MAILBOX)
+                )
 
-    try:
-        server = imaplib.IMAP4_SSL(EMAIL_HOST)
+            # One UID SEARCH, then drop already-processed UIDs before any body is downloaded
+            with span("imap.search") as search_attributes:
+                # An account without sync state falls back to the date range, not the whole mailbox
+                if since_last_sync and sync_state.last_uid:
+                    pending_uids = _pending_since(server, sync_state)
+                else:
+                    search_criteria = build_search_criteria(from_date,to_date)
+                    pending_uids = sync_state.filter_unprocessed(uid_search(server, search_criteria))
+                # Same Message-ID claims as the multi-folder sync, so the two modes never process a message twice
+                pending_uids = _claim_owned(server, EMAIL_HOST, EMAIL_USER, sync_state, pending_uids)
+                search_attributes["pending"] = len(pending_uids)
+            if on_total:
+                on_total(len(pending_uids))
+
+            # Headers, BODYSTRUCTURE and the text part only; attachments stay on the server
+            def _parsed_emails():
+                for summary in fetch_summaries(server, pending_uids):
+                    email_data = _build_or_skip(summary, sync_state)
+                    if email_data is not None:
+                        yield email_data
+
+            # Gemini calls run concurrently while later batches are still being fetched
+            for email_data, extraction in extract_todos_concurrently(_parsed_emails()):
+                # Appended one UID at a time, so an early stop keeps everything already shown
+                sync_state.mark_processed(email_data["uid"])
+                sync_attributes["emails"] += 1
+                yield _result(email_data, extraction, MAILBOX)
+
+        except Exception as e:
+            yield {"error": str(e)}
+        finally:
+            # Also on errors, failed logins and when the caller stops iterating early
+            if server is not None:
+                try:
+                    server.logout()
+                except Exception:
+                    pass
+
+
+def stream_mail_folders(
+    from_date: str,
+    to_date: str,
+    email_host: str,
+    email_user: str,
+    email_pass: str,
+    on_total: Optional[Callable[[int], None]] = None,
+    since_last_sync: bool = False,
+    folders: Optional[List[str]] = None,
+) -> Iterator[dict]:
+    """
+    Multi-folder variant of `stream_mail`: syncs every selectable folder (or just
+    `folders`) over a small pool of IMAP connections.
+
+    Folders are searched in parallel, then their pending UIDs are split into fetch
+    jobs that run on the pooled connections, so a large backfill is not limited to
+    one TCP stream. A message that sits in several folders (INBOX, a label, Gmail's
+    All Mail) is claimed by Message-ID for the first folder in `list_folders` order
+    (or in `folders` order) that has it, unless an earlier sync already owns it; the
+    other copies are marked processed after fetching only their Message-ID.
+
+    Yields the same dicts as `stream_mail`, whose "mailbox" tells the folder.
+    """
+    pool = IMAPConnectionPool(email_host, email_user, email_pass)
+    with span("sync", since_last_sync=since_last_sync, emails=0, folders=0) as sync_attributes:
         try:
-            server.login(EMAIL_USER, EMAIL_PASS)
-        except imaplib.IMAP4.error as e:
-            return [{"error": "Login failed. Please check your email and app password."}]
-        server.select("inbox")
-
-        # Fetch recent N emails
-        search_criteria = build_search_criteria(from_date,to_date)
-        status, messages = server.search(None, search_criteria)
-        email_ids = messages[0].split()
-
-        for eid in email_ids:
-            # Get UID of this message
-            _, uid_data = server.fetch(eid, "(UID)")
-            uid = uid_data[0].decode().split()[2]
-
-            if uid in seen_uids:
-                continue  # skip already processed
-
-            # Fetch message
-            _, msg_data = server.fetch(eid, "(RFC822)")
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-                    subject, encoding = decode_header(msg["Subject"])[0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode(encoding or "utf-8")
-                    from_email = msg.get("From")
-                    date = msg.get("Date")
-
-                    # Get email body
-                    body = ""
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            if part.get_content_type() == "text/plain":
-                                body = part.get_payload(decode=True).decode()
-                                break
+            try:
+                with pool.connection() as server:
+                    folder_names = folders or list_folders(server)
+            except imaplib.IMAP4.error:
+                yield {"error": "Login failed. Please check your email and app password."}
+                return
+            sync_attributes["folders"] = len(folder_names)
+
+            def _search(folder: str):
+                with pool.connection(folder) as server:
+                    state = get_sync_state_store().mailbox(
+                        email_host, email_user, folder, get_uidvalidity(server, quote_mailbox(folder))
+                    )
+                    if since_last_sync and state.last_uid:
+                        uids = _pending_since(server, state)
                     else:
-                        body = msg.get_payload(decode=True).decode()
-
-                    cleaned_body = clean_email_body(body)
-
-                    attachments = []
-                    for part in msg.walk():
-                        content_disposition = str(part.get("Content-Disposition"))
-                        if "attachment" in content_disposition:
-                            filename = part.get_filename()
-                            if filename:
-                                decoded_filename, enc = decode_header(filename)[0]
-                                if isinstance(decoded_filename, bytes):
-                                    decoded_filename = decoded_filename.decode(enc or "utf-8")
-                              
-                                payload = part.get_payload(decode=True)
-                                if payload:  # only save non-empty payloads
-                                    save_path = f"attachments/{EMAIL_USER}/"
-                                    os.makedirs(save_path, exist_ok=True)
-
-                                full_path = os.path.join(save_path, decoded_filename)
-                                with open(full_path, "wb") as f:
-                                    f.write(payload)
-
-                                attachments.append(decoded_filename)
-                                
-                    email_data = {
-                        "subject": subject,
-                        "from": from_email,
-                        "date": date,
-                        "body": cleaned_body,
-                        "attachments":attachments if attachments else None
-                    }
-                    
-                    extraction =extract_todo_from_email(email_data)
-                    results.append({
-                        "subject": email_data["subject"],
-                        "from": email_data["from"],
-                        "date": email_data["date"],
-                        "attachments": email_data["attachments"],
-                        "extraction": extraction
-                    })
-                    new_seen_uids.add(uid)
-                    
-        seen_uids.update(new_seen_uids)
-        save_seen_uids(seen_uids)
-        server.logout()
-        return results
-
-    except Exception as e:
-        return [{"error": str(e)}]
-    
+                        uids = state.filter_unprocessed(uid_search(server, build_search_criteria(from_date, to_date)))
+                    return folder, state, uids, fetch_message_ids(server, uids)
+
+            with span("imap.search") as search_attributes:
+                with ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="imap-search") as executor:
+                    found = list(executor.map(_search, folder_names))
+                # Claimed one folder at a time in priority order (INBOX first, All Mail last),
+                # so ownership never depends on which worker finishes first
+                searched = [
+                    (folder, state, _claim_owned(None, email_host, email_user, state, uids, message_ids))
+                    for folder, state, uids, message_ids in found
+                ]
+                search_attributes["pending"] = sum(len(uids) for _, _, uids in searched)
+            if on_total:
+                on_total(search_attributes["pending"])
+
+            def _fetch(folder: str, state, batch: List[int]) -> list:
+                with pool.connection(folder) as server:
+                    with span("imap.fetch_summaries", messages=len(batch), mailbox=folder):
+                        summaries = fetch_summary_batch(server, batch)
+                return [(folder, state, summary) for summary in summaries]
+
+            states = {}
+
+            def _parse(fetched: list):
+                for folder, state, summary in fetched:
+                    email_data = _build_or_skip(summary, state)
+                    if email_data is None:
+                        continue
+                    email_data["mailbox"] = folder
+                    states[folder] = state
+                    yield email_data
+
+            def _parsed_emails():
+                # Fetch jobs run on the pool; at most 2 per connection wait ahead of the parser
+                jobs = (
+                    (folder, state, batch)
+                    for folder, state, uids in searched
+                    for batch in chunked(uids, FOLDER_FETCH_BATCH_SIZE)
+                )
+                with ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="imap-fetch") as executor:
+                    in_flight = deque()
+                    for job in jobs:
+                        in_flight.append(executor.submit(_fetch, *job))
+                        while len(in_flight) > 2 * pool.size:
+                            yield from _parse(in_flight.popleft().result())
+                    while in_flight:
+                        yield from _parse(in_flight.popleft().result())
+
+            for email_data, extraction in extract_todos_concurrently(_parsed_emails()):
+                states[email_data["mailbox"]].mark_processed(email_data["uid"])
+                sync_attributes["emails"] += 1
+                yield _result(email_data, extraction, email_data["mailbox"])
+
+        except Exception as e:
+            yield {"error": str(e)}
+        finally:
+            pool.close()
+
+
+def process_mail(from_date:str,to_date:str,email_host: str, email_user: str, email_pass: str) -> List[dict]:
+    """
+    Fetches recent emails using IMAP protocol and returns subject + body.
+
+    Returns:
+        List[dict]: List of emails with subject, from, date, attachments and extraction.
+    """
+    results = []
+    for result in stream_mail(from_date, to_date, email_host, email_user, email_pass):
+        if "error" in result:
+            return [result]
+        results.append(result)
+    return results
+
+
+def download_attachment(email_host: str, email_user: str, email_pass: str, attachment: dict) -> str:
+    """
+    📎 Downloads one attachment on demand into the user's content-addressed store.
+
+    `attachment` is an entry from `SyncStateStore.list_attachments`. The part is
+    hashed while it streams to disk, so identical files received in different
+    emails end up as one blob. Returns the local blob path; an attachment that is
+    already in the manifest is not fetched again.
+    """
+    store = AttachmentStore(email_user)
+    key = store.message_key(attachment)
+    existing = store.lookup(key)
+    if existing:
+        add("attachment.store_hits")
+        return str(existing)
+
+    with span("attachment.download", mime_type=attachment.get("mime_type")) as attributes:
+        server = imaplib.IMAP4_SSL(email_host)
+        try:
+            server.login(email_user, email_pass)
+            mailbox = quote_mailbox(attachment["mailbox"])
+            status, data = server.select(mailbox, readonly=True)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"SELECT {attachment['mailbox']} failed: {data}")
+            if get_uidvalidity(server, mailbox) != attachment["uidvalidity"]:
+                raise imaplib.IMAP4.error("Mailbox was renumbered (UIDVALIDITY changed); please sync again.")
+
+            writer = store.writer(attachment["filename"])
+            try:
+                download_part(server, attachment["uid"], attachment["part"], attachment["encoding"], writer)
+            except Exception:
+                writer.abort()
+                raise
+            digest = writer.commit()
+            attributes["bytes"] = writer.size
+            add("attachment.bytes_written", writer.size)
+            return str(store.record(
+                key, attachment["filename"], digest, writer.size,
+                uid=attachment["uid"], date=attachment.get("date"),
+            ))
+        finally:
+            try:
+                server.logout()
+            except Exception:
+                pass
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parseaddr
+from typing import Optional
+
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "extraction_cache.sqlite3")
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "50000"))
+EXTRACTION_CACHE_MAX_AGE_DAYS = float(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "90"))
+# Eviction runs once every N writes instead of on every put
+_EVICT_EVERY = 200
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _normalize(text) -> str:
+    return _WS_RE.sub(" ", str(text or "")).strip().casefold()
+
+
+def prompt_version(template: str, model_name: str = "") -> str:
+    """
+    Short fingerprint of the prompt template (and model) so that editing
+    the email task prompt automatically invalidates old cache entries.
+    """
+    return hashlib.sha256(f"{model_name}\x00{template}".encode("utf-8")).hexdigest()[:16]
+
+
+def extraction_cache_key(email_data: dict, version: str) -> str:
+    """
+    Content address of an email: normalized sender address, subject, cleaned body
+    and attachment names, plus the prompt version. The date is left out on purpose
+    so that the same content received twice maps to one entry.
+    """
+    sender = parseaddr(str(email_data.get("from") or ""))[1] or email_data.get("from")
+    payload = json.dumps([
+        version,
+        _normalize(sender),
+        _normalize(email_data.get("subject")),
+        _normalize(email_data.get("body")),
+        sorted(email_data.get("attachments") or []),
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite-backed cache of LLM extractions with age- and size-based eviction.
+    Safe to share between the extraction worker threads.
+    """
+
+    def __init__(
+        self,
+        path: str = EXTRACTION_CACHE_PATH,
+        max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+        max_age_days: float = EXTRACTION_CACHE_MAX_AGE_DAYS,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extractions_accessed ON extractions(accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE extractions SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._evict(time.time())
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        # Age: drop anything older than max_age
+        self._conn.execute(
+            "DELETE FROM extractions WHERE created_at < ?", (now - self.max_age_seconds,)
+        )
+        # Size: keep only the most recently used max_entries rows
+        self._conn.execute(
+            """DELETE FROM extractions WHERE key IN (
+                SELECT key FROM extractions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
@@ -0,0 +1,456 @@
+import binascii
+import imaplib
+import logging
+import os
+import queue
+import re
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+from app.bodystructure import parse_fetch_items, walk_bodystructure
+from app.tracing import add, span
+
+# Number of messages requested per UID FETCH round-trip
+FETCH_BATCH_SIZE = 200
+# How many fetched batches may wait in memory ahead of the consumer
+PREFETCH_BATCHES = 2
+# Only this much of the text/plain part is downloaded per message
+MAX_TEXT_PART_BYTES = 256 * 1024
+# Partial-fetch size used when streaming an attachment to disk
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+# Connections one multi-folder sync opens to its account
+IMAP_SYNC_CONNECTIONS = int(os.getenv("IMAP_SYNC_CONNECTIONS", "4"))
+# Open pooled connections per server host, across all accounts (servers cap these, Gmail at 15)
+IMAP_MAX_CONNECTIONS_PER_SERVER = int(os.getenv("IMAP_MAX_CONNECTIONS_PER_SERVER", "8"))
+# Folders with any of these LIST flags are not synced
+SKIP_FOLDER_FLAGS = {"\\noselect", "\\nonexistent", "\\trash", "\\junk", "\\drafts"}
+
+_LIST_RE = re.compile(rb'\((?P<flags>[^)]*)\) (?P<delimiter>"(?:[^"\\]|\\.)*"|NIL) ?(?P<name>.*)$')
+_MESSAGE_ID_RE = re.compile(rb"^Message-ID:\s*(<[^>\r\n]+>)", re.IGNORECASE | re.MULTILINE)
+
+logger = logging.getLogger("opspilot.imap")
+
+
+def uid_search(server: imaplib.IMAP4, criteria: str) -> List[int]:
+    """
+    Runs a single `UID SEARCH` and returns the matching UIDs in ascending order.
+    """
+    status, data = server.uid("SEARCH", None, criteria)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+    if not data or not data[0]:
+        return []
+    return sorted(int(uid) for uid in data[0].split())
+
+
+def uid_search_since(server: imaplib.IMAP4, last_uid: int, criteria: str = None) -> List[int]:
+    """
+    Returns UIDs strictly greater than `last_uid` with one `UID SEARCH UID n:*` query.
+
+    `n:*` always matches the highest UID in the mailbox even when it is below n,
+    so the result is filtered again on the client.
+    """
+    query = f"UID {last_uid + 1}:*"
+    if criteria:
+        query = f"{query} {criteria}"
+    return [uid for uid in uid_search(server, query) if uid > last_uid]
+
+
+def quote_mailbox(name: str) -> str:
+    """Quotes a mailbox name for SELECT / STATUS; imaplib passes it through as-is."""
+    return '"%s"' % name.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _unquote(name: bytes) -> str:
+    name = name.strip()
+    if name.startswith(b'"') and name.endswith(b'"'):
+        name = re.sub(rb"\\(.)", rb"\1", name[1:-1])
+    return name.decode("ascii", errors="replace")
+
+
+def list_folders(server: imaplib.IMAP4, skip_flags=SKIP_FOLDER_FLAGS) -> List[str]:
+    """
+    Selectable folders of the account from one `LIST "" "*"`, INBOX first and
+    catch-all folders (Gmail's All Mail, flagged \\All) last, so a message found in
+    several folders is attributed to the most specific one. Names are returned
+    as the server spells them (modified UTF-7); pass them through `quote_mailbox`.
+    """
+    status, data = server.list()
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"LIST failed: {data}")
+    folders = []
+    for item in data:
+        # Names sent as literals arrive as (b'(flags) "/" {n}', b'name')
+        line, literal = (item[0], item[1]) if isinstance(item, tuple) else (item, None)
+        match = _LIST_RE.match(line or b"")
+        if not match:
+            continue
+        flags = {flag.lower() for flag in match.group("flags").decode("ascii", errors="replace").split()}
+        if flags & skip_flags:
+            continue
+        name = _unquote(literal if literal is not None else match.group("name"))
+        folders.append((name.upper() != "INBOX", "\\all" in flags, name))
+    return [name for *_, name in sorted(folders)]
+
+
+def message_id(header: bytes) -> Optional[str]:
+    """The Message-ID of a raw header block, or None when the message has none."""
+    match = _MESSAGE_ID_RE.search(header or b"")
+    return match.group(1).decode("ascii", errors="replace").strip().lower() if match else None
+
+
+def get_uidvalidity(server: imaplib.IMAP4, mailbox: str) -> int:
+    """
+    Reads UIDVALIDITY from the untagged SELECT response, falling back to STATUS.
+    """
+    _, data = server.response("UIDVALIDITY")
+    if data and data[0]:
+        return int(data[0])
+    status, data = server.status(mailbox, "(UIDVALIDITY)")
+    match = re.search(rb"UIDVALIDITY (\d+)", data[0] or b"") if status == "OK" else None
+    if not match:
+        raise imaplib.IMAP4.error(f"Could not read UIDVALIDITY for {mailbox}")
+    return int(match.group(1))
+
+
+def compress_uid_set(uids: Iterable[int]) -> str:
+    """
+    Turns a list of UIDs into a compact IMAP message set, e.g. [1,2,3,7] -> "1:3,7".
+    """
+    ranges = []
+    start = prev = None
+    for uid in sorted(set(uids)):
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append(f"{start}:{prev}" if start != prev else str(start))
+            start = prev = uid
+    if start is not None:
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def chunked(items: List, size: int) -> Iterator[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _prefetched(produce_batches: Callable[[], Iterator[list]]) -> Iterator:
+    """
+    Runs `produce_batches` (which talks to the IMAP server) on a background
+    thread and yields the items of every batch it produces. At most
+    PREFETCH_BATCHES batches wait in memory ahead of the consumer.
+    """
+    batches = queue.Queue(maxsize=PREFETCH_BATCHES)
+    stop = threading.Event()
+    done = object()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _producer():
+        try:
+            for batch in produce_batches():
+                if not _put(batch):
+                    return
+        except Exception as e:
+            _put(e)
+            return
+        _put(done)
+
+    worker = threading.Thread(target=_producer, daemon=True)
+    worker.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is done:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        stop.set()
+        worker.join()
+
+
+def _uid_fetch(server: imaplib.IMAP4, message_set: str, items: str) -> list:
+    with span("imap.fetch", log=False):
+        status, data = server.uid("FETCH", message_set, items)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+    add("imap.fetch_calls")
+    add("imap.bytes_fetched", sum(len(item[1]) for item in data if isinstance(item, tuple)))
+    return data
+
+
+def _decode_transfer(payload: bytes, encoding: str) -> bytes:
+    if encoding == "base64":
+        payload = b"".join(payload.split())
+        # Partial fetches may end in the middle of a 4-char quantum
+        return binascii.a2b_base64(payload[:len(payload) // 4 * 4])
+    if encoding == "quoted-printable":
+        return binascii.a2b_qp(payload)
+    return payload
+
+
+def fetch_summary_batch(
+    server: imaplib.IMAP4,
+    uids: List[int],
+    max_text_bytes: int = MAX_TEXT_PART_BYTES,
+) -> List[dict]:
+    """Summaries (see `fetch_summaries`) of one batch of UIDs, fetched synchronously."""
+    data = _uid_fetch(server, compress_uid_set(uids), "(UID BODYSTRUCTURE BODY.PEEK[HEADER])")
+    summaries = {}
+    for item in parse_fetch_items(data):
+        if "UID" not in item or "BODYSTRUCTURE" not in item:
+            continue
+        try:
+            uid = int(item["UID"])
+        except (TypeError, ValueError):
+            logger.warning("Ignoring FETCH item with malformed UID %r", item["UID"])
+            continue
+        summary = {"uid": uid, "header": item.get("BODY[HEADER]") or b"", "text": b"", "text_part": None, "attachments": []}
+        summaries[uid] = summary
+        try:
+            # One walk picks the body (first plain part, else first HTML part) and the attachments
+            plain = html = None
+            for part in walk_bodystructure(item["BODYSTRUCTURE"]):
+                if part.is_attachment:
+                    summary["attachments"].append(part)
+                elif part.is_body_candidate:
+                    if part.mime_type == "text/plain":
+                        plain = plain or part
+                    else:
+                        html = html or part
+            summary["text_part"] = plain or html
+        except Exception as e:
+            # One odd BODYSTRUCTURE must not end the batch; `build_email_data` rejects it
+            summary.update(text_part=None, attachments=[], error=f"BODYSTRUCTURE: {e!r}")
+
+    # One partial fetch per distinct text part number across the batch
+    by_part = {}
+    for uid, summary in summaries.items():
+        if summary["text_part"]:
+            by_part.setdefault(summary["text_part"].part, []).append(uid)
+    for part, part_uids in by_part.items():
+        data = _uid_fetch(
+            server, compress_uid_set(part_uids), f"(UID BODY.PEEK[{part}]<0.{max_text_bytes}>)"
+        )
+        for item in parse_fetch_items(data):
+            uid = int(item.get("UID", 0))
+            if uid not in summaries:
+                continue
+            payload = next(
+                (v for k, v in item.items() if k.startswith(f"BODY[{part}]")), None
+            ) or b""
+            try:
+                summaries[uid]["text"] = _decode_transfer(payload, summaries[uid]["text_part"].encoding)
+            except (binascii.Error, ValueError) as e:
+                summaries[uid]["error"] = f"text part: {e!r}"
+
+    return [summaries[uid] for uid in sorted(summaries)]
+
+
+def fetch_message_ids(server: imaplib.IMAP4, uids: List[int], batch_size: int = FETCH_BATCH_SIZE) -> Dict[int, str]:
+    """
+    Message-ID of every UID that has one. Only that header field is downloaded
+    (`BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)]`), so duplicates can be dropped before
+    anything else is fetched.
+    """
+    ids = {}
+    for batch in chunked(uids, batch_size):
+        data = _uid_fetch(server, compress_uid_set(batch), "(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])")
+        for item in parse_fetch_items(data):
+            if "UID" not in item:
+                continue
+            header = next((v for k, v in item.items() if k.startswith("BODY[HEADER.FIELDS")), None)
+            mid = message_id(header or b"")
+            if mid:
+                ids[int(item["UID"])] = mid
+    return ids
+
+
+def fetch_summaries(
+    server: imaplib.IMAP4,
+    uids: List[int],
+    batch_size: int = FETCH_BATCH_SIZE,
+    max_text_bytes: int = MAX_TEXT_PART_BYTES,
+) -> Iterator[dict]:
+    """
+    Yields a lightweight summary of every message without downloading attachments:
+
+        {"uid", "header": raw header bytes, "text": transfer-decoded body bytes,
+         "text_part": BodyPart | None, "attachments": [BodyPart, ...]}
+
+    The body is the first text/plain part, or the first text/html part when there
+    is none; `text_part.charset` tells how to decode "text" (see `decode_text`).
+    A message whose structure cannot be parsed gets an "error" entry instead of
+    ending the batch.
+
+    Each batch costs one `UID FETCH (BODYSTRUCTURE BODY.PEEK[HEADER])` plus one
+    partial `BODY.PEEK[part]<0.max_text_bytes>` fetch per distinct text part number
+    (usually just "1" and "1.1"), and is prefetched on a background thread (see `_prefetched`).
+    """
+    if not uids:
+        return
+
+    def _batches():
+        for batch in chunked(uids, batch_size):
+            with span("imap.fetch_summaries", messages=len(batch)) as attributes:
+                summaries = fetch_summary_batch(server, batch, max_text_bytes)
+                attributes["attachments"] = sum(len(s["attachments"]) for s in summaries)
+            yield summaries
+
+    yield from _prefetched(_batches)
+
+
+# --- Connection pool (multi-folder sync) --- #
+_server_slots = {}
+_server_slots_lock = threading.Lock()
+
+
+def _server_slot(host: str) -> threading.BoundedSemaphore:
+    with _server_slots_lock:
+        return _server_slots.setdefault(host.lower(), threading.BoundedSemaphore(IMAP_MAX_CONNECTIONS_PER_SERVER))
+
+
+class IMAPConnectionPool:
+    """
+    Up to `size` logged-in connections to one account, opened on demand and reused.
+
+    Every open connection also holds one of the IMAP_MAX_CONNECTIONS_PER_SERVER slots
+    of its host, so parallel syncs of several accounts on one provider stay under
+    the server's connection limit. A pool only waits for a slot while it holds no
+    connection; otherwise it grows when a slot is free and else waits for one of its
+    own connections to come back, so pools never block each other for good. A
+    connection that raised is logged out instead of going back to the pool.
+    """
+
+    def __init__(self, host: str, user: str, password: str, size: int = IMAP_SYNC_CONNECTIONS):
+        self.host = host
+        self.user = user
+        self.size = max(size, 1)
+        self._password = password
+        self._idle = []  # [(server, selected mailbox)]
+        self._open = 0  # connections opened (or being opened), idle ones included
+        self._cond = threading.Condition()
+        self._slot = _server_slot(host)
+
+    def _checkout(self):
+        """An idle (server, selected mailbox), or (None, None) once a new connection may be opened."""
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._open < self.size and (self._open == 0 or self._slot.acquire(blocking=False)):
+                    first = self._open == 0
+                    self._open += 1
+                    break
+                # Our own connections notify when they come back; other pools' slots free up silently
+                self._cond.wait(timeout=0.5)
+        if first:
+            # Holding no connection of our own, waiting here cannot hold up this pool's other jobs
+            self._slot.acquire()
+        return None, None
+
+    def _release(self):
+        self._slot.release()
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def _connect(self) -> imaplib.IMAP4:
+        try:
+            server = imaplib.IMAP4_SSL(self.host)
+            server.login(self.user, self._password)
+            return server
+        except BaseException:
+            self._release()
+            raise
+
+    def _discard(self, server: imaplib.IMAP4):
+        try:
+            server.logout()
+        except Exception:
+            pass
+        self._release()
+
+    @contextmanager
+    def connection(self, mailbox: Optional[str] = None) -> Iterator[imaplib.IMAP4]:
+        """
+        A logged-in connection, with `mailbox` selected read-only when given (and
+        not already selected on it).
+        """
+        server, selected = self._checkout()
+        if server is None:
+            server = self._connect()
+        try:
+            if mailbox is not None and mailbox != selected:
+                status, data = server.select(quote_mailbox(mailbox), readonly=True)
+                if status != "OK":
+                    raise imaplib.IMAP4.error(f"SELECT {mailbox} failed: {data}")
+                selected = mailbox
+            yield server
+        except BaseException:
+            self._discard(server)
+            raise
+        with self._cond:
+            self._idle.append((server, selected))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._discard(server)
+
+
+def download_part(
+    server: imaplib.IMAP4,
+    uid: int,
+    part: str,
+    encoding: str,
+    out: BinaryIO,
+    chunk_size: int = DOWNLOAD_CHUNK_BYTES,
+) -> int:
+    """
+    Streams one MIME part (`BODY.PEEK[part]`) into `out` using partial fetches of
+    `chunk_size` bytes, decoding base64 / quoted-printable incrementally so the
+    whole attachment is never held in memory. Returns the number of bytes written.
+    """
+    pending = b""
+    written = 0
+    offset = 0
+    while True:
+        data = _uid_fetch(server, str(uid), f"(BODY.PEEK[{part}]<{offset}.{chunk_size}>)")
+        items = parse_fetch_items(data)
+        chunk = next(
+            (v for item in items for k, v in item.items() if k.startswith(f"BODY[{part}]")), None
+        ) or b""
+        offset += len(chunk)
+        last = len(chunk) < chunk_size
+
+        pending += chunk
+        if encoding == "base64":
+            pending = b"".join(pending.split())
+            cut = len(pending) if last else len(pending) // 4 * 4
+        elif encoding == "quoted-printable":
+            # Only decode complete lines so soft line breaks are never split
+            cut = len(pending) if last else pending.rfind(b"\n") + 1
+        else:
+            cut = len(pending)
+        decoded = _decode_transfer(pending[:cut], encoding)
+        pending = pending[cut:]
+        out.write(decoded)
+        written += len(decoded)
+        if last:
+            return written
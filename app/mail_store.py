@@ -0,0 +1,311 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import List, Optional
+
+from app.clients import get_client
+
+MAIL_STORE_PATH = os.getenv("MAIL_STORE_PATH", "mail_store.sqlite3")
+
+_JSON_FIELDS = ("attachments", "attachment_meta", "triage")
+# Indexed for full-text search, in this order
+_FTS_COLUMNS = ("subject", "sender", "body", "todo", "important_info")
+# Columns missing from stores written before search existed
+_ADDED_COLUMNS = {
+    "body": "TEXT",
+    "todo": "TEXT",
+    "important_info": "TEXT",
+    "has_attachments": "INTEGER NOT NULL DEFAULT 0",
+    "triage_action": "TEXT",
+}
+
+_EXTRACTION_RE = re.compile(
+    r"To-Do Task:\**\s*(?P<todo>.*?)\s*\**\s*Important Information[^:]*:\**\s*(?P<info>.*)",
+    re.DOTALL | re.IGNORECASE,
+)
+_NONE_VALUES = {"", "none", "none.", "n/a"}
+
+
+def _iso_date(date: Optional[str]) -> Optional[str]:
+    try:
+        return parsedate_to_datetime(date).isoformat() if date else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _field(value: str) -> Optional[str]:
+    value = value.strip().strip("*").strip()
+    return None if value.lower() in _NONE_VALUES else value
+
+
+def split_extraction(extraction: Optional[str]):
+    """(todo, important_info) from an extraction's text, each None when the model said "None"."""
+    match = _EXTRACTION_RE.search(extraction or "")
+    if not match:
+        return _field(extraction or ""), None
+    return _field(match.group("todo")), _field(match.group("info"))
+
+
+def fts_query(text: str) -> str:
+    """
+    Turns free text into an FTS5 query: every word must match, as a prefix, so
+    "inv sub" finds "Invoice submitted". Quotes keep FTS operators in the text inert.
+    """
+    return " ".join('"%s"*' % word.replace('"', '""') for word in text.split())
+
+
+class MailStore:
+    """
+    Processed emails (headers, triage verdict and extraction) per account, written
+    by the sync daemon (`app/sync_daemon.py`) or a manual fetch and read by the UI.
+
+    Each account also keeps the outcome of its last sync run, so the UI can tell
+    how fresh its view is without talking to the mail server.
+
+    Subject, sender, cleaned body and the extracted To-Do / Important Information
+    are indexed with FTS5, so everything processed before can be searched and
+    filtered without going back to IMAP or the LLM. Without FTS5 in the SQLite
+    build, search falls back to LIKE scans.
+    """
+
+    def __init__(self, path: str = MAIL_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS emails (
+                host TEXT NOT NULL,
+                user TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                subject TEXT,
+                sender TEXT,
+                date TEXT,
+                iso_date TEXT,
+                attachments TEXT,
+                attachment_meta TEXT,
+                triage TEXT,
+                extraction TEXT,
+                body TEXT,
+                todo TEXT,
+                important_info TEXT,
+                has_attachments INTEGER NOT NULL DEFAULT 0,
+                triage_action TEXT,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (host, user, mailbox, uid)
+            )"""
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(emails)")}
+        added = [name for name in _ADDED_COLUMNS if name not in columns]
+        for name in added:
+            self._conn.execute(f"ALTER TABLE emails ADD COLUMN {name} {_ADDED_COLUMNS[name]}")
+        if added:
+            self._backfill()
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_emails_account_date ON emails(host, user, iso_date)"
+        )
+        self.fts = self._create_fts_index()
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS sync_runs (
+                host TEXT NOT NULL,
+                user TEXT NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                emails INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (host, user)
+            )"""
+        )
+        self._conn.commit()
+
+    def _backfill(self):
+        rows = self._conn.execute("SELECT rowid, extraction, attachments, triage FROM emails").fetchall()
+        self._conn.executemany(
+            "UPDATE emails SET todo = ?, important_info = ?, has_attachments = ?, triage_action = ? "
+            "WHERE rowid = ?",
+            [
+                (
+                    *split_extraction(extraction),
+                    int(bool(json.loads(attachments or "null"))),
+                    (json.loads(triage or "null") or {}).get("action"),
+                    rowid,
+                )
+                for rowid, extraction, attachments, triage in rows
+            ],
+        )
+
+    def _create_fts_index(self) -> bool:
+        """External-content FTS5 table over `emails`, kept in sync by triggers."""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'emails_fts'"
+        ).fetchone()
+        columns = ", ".join(_FTS_COLUMNS)
+        old_columns = ", ".join(f"old.{c}" for c in _FTS_COLUMNS)
+        new_columns = ", ".join(f"new.{c}" for c in _FTS_COLUMNS)
+        try:
+            self._conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5("
+                f"{columns}, content='emails', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')"
+            )
+        except sqlite3.OperationalError:
+            return False
+        self._conn.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS emails_fts_insert AFTER INSERT ON emails BEGIN
+                INSERT INTO emails_fts (rowid, {columns}) VALUES (new.rowid, {new_columns});
+            END;
+            CREATE TRIGGER IF NOT EXISTS emails_fts_delete AFTER DELETE ON emails BEGIN
+                INSERT INTO emails_fts (emails_fts, rowid, {columns}) VALUES ('delete', old.rowid, {old_columns});
+            END;
+            CREATE TRIGGER IF NOT EXISTS emails_fts_update AFTER UPDATE ON emails BEGIN
+                INSERT INTO emails_fts (emails_fts, rowid, {columns}) VALUES ('delete', old.rowid, {old_columns});
+                INSERT INTO emails_fts (rowid, {columns}) VALUES (new.rowid, {new_columns});
+            END;
+        """)
+        if not exists:
+            # Index whatever the store already held
+            self._conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+        return True
+
+    def save(self, host: str, user: str, result: dict, mailbox: str = "INBOX"):
+        """
+        Stores one result yielded by `stream_mail`, replacing an earlier copy of it.
+        The result's own "mailbox" (multi-folder sync) wins over `mailbox`.
+        """
+        mailbox = result.get("mailbox") or mailbox
+        todo, important_info = split_extraction(result["extraction"])
+        values = {
+            "subject": result["subject"],
+            "sender": result["from"],
+            "date": result["date"],
+            "iso_date": _iso_date(result["date"]),
+            **{field: json.dumps(result.get(field)) for field in _JSON_FIELDS},
+            "extraction": result["extraction"],
+            "body": result.get("body"),
+            "todo": todo,
+            "important_info": important_info,
+            "has_attachments": int(bool(result.get("attachments"))),
+            "triage_action": (result.get("triage") or {}).get("action"),
+            "synced_at": time.time(),
+        }
+        # An upsert (not INSERT OR REPLACE) so the update trigger re-indexes the row
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO emails (host, user, mailbox, uid, %s) VALUES (?, ?, ?, ?, %s) "
+                "ON CONFLICT (host, user, mailbox, uid) DO UPDATE SET %s"
+                % (
+                    ", ".join(values),
+                    ", ".join("?" * len(values)),
+                    ", ".join(f"{name} = excluded.{name}" for name in values),
+                ),
+                (host.lower(), user.lower(), mailbox, int(result["uid"]), *values.values()),
+            )
+            self._conn.commit()
+
+    def list_emails(
+        self,
+        host: str,
+        user: str,
+        since: Optional[str] = None,
+        before: Optional[str] = None,
+        query: Optional[str] = None,
+        with_tasks: bool = False,
+        with_attachments: bool = False,
+        hide_bulk: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Stored emails of an account in the same shape as `stream_mail` results.
+
+        Args:
+            since / before: ISO days (YYYY-MM-DD), inclusive / exclusive like IMAP's
+                SINCE / BEFORE; emails without a parseable date always match.
+            query: full-text search over subject, sender, body, To-Do and Important
+                Information. Results are then ranked by relevance and carry a
+                "snippet"; otherwise they are ordered newest first.
+            with_tasks: only emails with an extracted To-Do.
+            with_attachments: only emails with attachments.
+            hide_bulk: leave out emails the triage stage skipped.
+        """
+        where = ["e.host = ?", "e.user = ?"]
+        params = [host.lower(), user.lower()]
+        if since:
+            where.append("(e.iso_date IS NULL OR substr(e.iso_date, 1, 10) >= ?)")
+            params.append(since)
+        if before:
+            where.append("(e.iso_date IS NULL OR substr(e.iso_date, 1, 10) < ?)")
+            params.append(before)
+        if with_tasks:
+            where.append("e.todo IS NOT NULL")
+        if with_attachments:
+            where.append("e.has_attachments = 1")
+        if hide_bulk:
+            where.append("(e.triage_action IS NULL OR e.triage_action != 'skip')")
+
+        columns = "e.mailbox, e.uid, e.subject, e.sender, e.date, e.attachments, e.attachment_meta, e.triage, e.extraction"
+        search = fts_query(query or "")
+        if search and self.fts:
+            sql = (
+                f"SELECT {columns}, snippet(emails_fts, -1, '**', '**', '…', 12) "
+                "FROM emails_fts JOIN emails e ON e.rowid = emails_fts.rowid "
+                f"WHERE emails_fts MATCH ? AND {' AND '.join(where)} "
+                "ORDER BY bm25(emails_fts), e.iso_date DESC"
+            )
+            params.insert(0, search)
+        else:
+            if search:
+                for word in query.split():
+                    where.append("(" + " OR ".join(f"e.{c} LIKE ?" for c in _FTS_COLUMNS) + ")")
+                    params.extend([f"%{word}%"] * len(_FTS_COLUMNS))
+            sql = f"SELECT {columns}, NULL FROM emails e WHERE {' AND '.join(where)} ORDER BY e.iso_date DESC, e.uid DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        results = []
+        for mailbox, uid, subject, sender, date, *json_values, extraction, snippet in rows:
+            result = {"uid": str(uid), "mailbox": mailbox, "subject": subject, "from": sender, "date": date}
+            result.update(zip(_JSON_FIELDS, (json.loads(value) for value in json_values)))
+            result["extraction"] = extraction
+            if snippet is not None:
+                result["snippet"] = snippet
+            results.append(result)
+        return results
+
+    def start_run(self, host: str, user: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sync_runs (host, user, started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (host, user) DO UPDATE SET started_at = excluded.started_at, finished_at = NULL",
+                (host.lower(), user.lower(), time.time()),
+            )
+            self._conn.commit()
+
+    def finish_run(self, host: str, user: str, emails: int, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sync_runs SET finished_at = ?, emails = ?, error = ? WHERE host = ? AND user = ?",
+                (time.time(), emails, error, host.lower(), user.lower()),
+            )
+            self._conn.commit()
+
+    def last_run(self, host: str, user: str) -> Optional[dict]:
+        """started_at, finished_at (None while running), emails and error of the last sync, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT started_at, finished_at, emails, error FROM sync_runs WHERE host = ? AND user = ?",
+                (host.lower(), user.lower()),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("started_at", "finished_at", "emails", "error"), row))
+
+
+def get_mail_store() -> MailStore:
+    return get_client("mail-store", MailStore)
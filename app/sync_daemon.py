@@ -0,0 +1,161 @@
+"""
+Background sync daemon: keeps the mail store (`app/mail_store.py`) up to date for the
+configured accounts, outside of any Streamlit session.
+
+    python -m app.sync_daemon                  # sync every SYNC_INTERVAL_S seconds
+    python -m app.sync_daemon --once           # one pass over all accounts, then exit
+
+Accounts are read from `accounts.json` (SYNC_ACCOUNTS_PATH):
+
+    [{"host": "imap.gmail.com", "user": "me@gmail.com", "password_env": "GMAIL_APP_PASSWORD"}]
+
+`password` may be given inline instead of `password_env`. Every sync searches the last
+SYNC_LOOKBACK_DAYS days; messages the sync state already marks as processed are dropped
+before anything is downloaded, so only new mail reaches the LLM.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import List, Optional
+
+from app.email_handler import download_attachment, stream_mail, stream_mail_folders
+from app.sync_state import get_sync_state_store
+from app.mail_store import MailStore, get_mail_store
+from app.tracing import span
+
+SYNC_ACCOUNTS_PATH = os.getenv("SYNC_ACCOUNTS_PATH", "accounts.json")
+SYNC_INTERVAL_S = float(os.getenv("SYNC_INTERVAL_S", "300"))
+# Accounts synced at the same time; LLM calls still share one rate limit
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "4"))
+SYNC_LOOKBACK_DAYS = int(os.getenv("SYNC_LOOKBACK_DAYS", "7"))
+# Download and index new PDF / DOCX attachments, so RAG works without waiting on the UI
+SYNC_ATTACHMENTS = os.getenv("SYNC_ATTACHMENTS", "1") == "1"
+# Sync every folder (Sent, labels, ...) over pooled connections instead of INBOX only
+SYNC_ALL_FOLDERS = os.getenv("SYNC_ALL_FOLDERS", "0") == "1"
+
+logger = logging.getLogger("opspilot.sync")
+
+
+def load_accounts(path: str = SYNC_ACCOUNTS_PATH) -> List[dict]:
+    """Reads the account list, resolving `password_env` to the password itself."""
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+    resolved = []
+    for account in accounts:
+        password = account.get("password") or os.getenv(account.get("password_env", ""), "")
+        if not password:
+            raise ValueError(f"No password for {account['user']} (set `password` or `password_env`)")
+        resolved.append({"host": account["host"], "user": account["user"], "password": password})
+    return resolved
+
+
+def _sync_attachments(account: dict, messages: set):
+    from app.attachment_rag import SUPPORTED_EXTENSIONS, ingest_files_to_vector_db
+
+    pending = [
+        a for a in get_sync_state_store().list_attachments(account["host"], account["user"])
+        if (a["mailbox"], str(a["uid"])) in messages and a["filename"].lower().endswith(SUPPORTED_EXTENSIONS)
+    ]
+    for attachment in pending:
+        try:
+            download_attachment(account["host"], account["user"], account["password"], attachment)
+        except Exception:
+            logger.exception("Downloading %s for %s failed", attachment["filename"], account["user"])
+    if pending:
+        ingest_files_to_vector_db(f"attachments/{account['user']}")
+
+
+def sync_account(account: dict, store: Optional[MailStore] = None) -> dict:
+    """
+    Runs one sync of `account` and persists every processed email as it is yielded,
+    so an interrupted run keeps what it already finished.
+
+    ✅ Output:
+        - user, emails (number stored this run), error (None on success)
+    """
+    store = store or get_mail_store()
+    host, user = account["host"], account["user"]
+    store.start_run(host, user)
+
+    today = date.today()
+    emails, error, messages = 0, None, set()
+    stream = stream_mail_folders if SYNC_ALL_FOLDERS else stream_mail
+    with span("daemon.sync_account") as attributes:
+        try:
+            for res in stream(
+                from_date=(today - timedelta(days=SYNC_LOOKBACK_DAYS)).strftime("%d-%b-%Y"),
+                to_date=(today + timedelta(days=1)).strftime("%d-%b-%Y"),
+                email_host=host,
+                email_user=user,
+                email_pass=account["password"],
+            ):
+                if "error" in res:
+                    error = res["error"]
+                    break
+                store.save(host, user, res)
+                emails += 1
+                if res["attachments"]:
+                    messages.add((res["mailbox"], res["uid"]))
+            if SYNC_ATTACHMENTS and messages:
+                _sync_attachments(account, messages)
+        except Exception as e:
+            error = str(e)
+        attributes.update(emails=emails, error=error)
+
+    store.finish_run(host, user, emails, error)
+    if error:
+        logger.warning("Sync of %s failed after %d emails: %s", user, emails, error)
+    else:
+        logger.info("Synced %s: %d new emails", user, emails)
+    return {"user": user, "emails": emails, "error": error}
+
+
+def run_once(accounts: List[dict], max_workers: int = SYNC_WORKERS) -> List[dict]:
+    """Syncs all accounts, up to `max_workers` of them in parallel."""
+    if not accounts:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync") as pool:
+        return list(pool.map(sync_account, accounts))
+
+
+def run_forever(
+    accounts: List[dict],
+    interval_s: float = SYNC_INTERVAL_S,
+    max_workers: int = SYNC_WORKERS,
+    stop: Optional[threading.Event] = None,
+):
+    """Repeats `run_once` every `interval_s` seconds (measured start to start) until `stop` is set."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        started = time.monotonic()
+        run_once(accounts, max_workers)
+        stop.wait(max(0.0, interval_s - (time.monotonic() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the configured mail accounts in the background.")
+    parser.add_argument("--accounts", default=SYNC_ACCOUNTS_PATH, help="account list (JSON)")
+    parser.add_argument("--interval", type=float, default=SYNC_INTERVAL_S, help="seconds between syncs")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS, help="accounts synced in parallel")
+    parser.add_argument("--once", action="store_true", help="sync once and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(message)s")
+    accounts = load_accounts(args.accounts)
+    if args.once:
+        run_once(accounts, args.workers)
+        return
+    try:
+        run_forever(accounts, args.interval, args.workers)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
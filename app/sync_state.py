@@ -0,0 +1,229 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional
+
+from app.clients import get_client
+
+SYNC_STATE_PATH = os.getenv("SYNC_STATE_PATH", "sync_state.sqlite3")
+# Max number of host parameters per `IN (...)` lookup
+_LOOKUP_CHUNK = 500
+# Syncs that retry a message that could not be parsed before it is given up on
+SYNC_MAX_PARSE_ATTEMPTS = int(os.getenv("SYNC_MAX_PARSE_ATTEMPTS", "5"))
+
+
+class MailboxState:
+    """
+    Sync state of one (host, user, mailbox, UIDVALIDITY): the highest UID that
+    was synced and the set of UIDs that were processed.
+
+    UIDs are stored one row each, so marking a message as processed is a single
+    append instead of rewriting the whole state.
+    """
+
+    def __init__(self, store: "SyncStateStore", mailbox_id: int, last_uid: int):
+        self._store = store
+        self.mailbox_id = mailbox_id
+        self.last_uid = last_uid
+
+    def filter_unprocessed(self, uids: Iterable[int]) -> List[int]:
+        """Returns the UIDs from `uids` that have not been processed yet, in order."""
+        uids = list(uids)
+        done = set()
+        with self._store._lock:
+            for i in range(0, len(uids), _LOOKUP_CHUNK):
+                chunk = uids[i:i + _LOOKUP_CHUNK]
+                rows = self._store._conn.execute(
+                    "SELECT uid FROM processed_uids WHERE mailbox_id = ? AND uid IN (%s)"
+                    % ",".join("?" * len(chunk)),
+                    (self.mailbox_id, *chunk),
+                ).fetchall()
+                done.update(row[0] for row in rows)
+        return [uid for uid in uids if uid not in done]
+
+    def record_attachments(self, uid: int, attachments: list, date: Optional[str] = None):
+        """
+        Stores attachment metadata (from BODYSTRUCTURE) so the file can be
+        downloaded later, on demand, without re-fetching the message.
+        `date` is the message date (ISO 8601), kept as RAG chunk metadata.
+        """
+        if not attachments:
+            return
+        with self._store._lock:
+            self._store._conn.executemany(
+                "INSERT OR REPLACE INTO attachments "
+                "(mailbox_id, uid, part, filename, mime_type, size, encoding, date) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (self.mailbox_id, int(uid), a.part, a.filename, a.mime_type, a.size, a.encoding, date)
+                    for a in attachments
+                ],
+            )
+            self._store._conn.commit()
+
+    def mark_failed(self, uid: int):
+        """
+        Records a message that could not be processed. `last_uid` still moves past it
+        once a later UID is done, so `failed_uids` is what brings it back next sync.
+        """
+        with self._store._lock:
+            self._store._conn.execute(
+                "INSERT INTO failed_uids (mailbox_id, uid) VALUES (?, ?) "
+                "ON CONFLICT (mailbox_id, uid) DO UPDATE SET attempts = attempts + 1",
+                (self.mailbox_id, int(uid)),
+            )
+            self._store._conn.commit()
+
+    def failed_uids(self) -> List[int]:
+        """UIDs that failed in an earlier sync and are still worth another attempt."""
+        with self._store._lock:
+            rows = self._store._conn.execute(
+                "SELECT uid FROM failed_uids WHERE mailbox_id = ? AND attempts < ? ORDER BY uid",
+                (self.mailbox_id, SYNC_MAX_PARSE_ATTEMPTS),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_processed(self, uid: int, advance: bool = True):
+        """
+        Records `uid` as done. With `advance=False`, `last_uid` stays where it is, for
+        UIDs handled ahead of lower ones that are still pending in this run.
+        """
+        uid = int(uid)
+        with self._store._lock:
+            self._store._conn.execute(
+                "INSERT OR IGNORE INTO processed_uids (mailbox_id, uid) VALUES (?, ?)",
+                (self.mailbox_id, uid),
+            )
+            self._store._conn.execute(
+                "DELETE FROM failed_uids WHERE mailbox_id = ? AND uid = ?", (self.mailbox_id, uid)
+            )
+            if advance and uid > self.last_uid:
+                self.last_uid = uid
+                self._store._conn.execute(
+                    "UPDATE mailboxes SET last_uid = ? WHERE id = ?", (uid, self.mailbox_id)
+                )
+            self._store._conn.commit()
+
+
+class SyncStateStore:
+    """
+    Per-account, UIDVALIDITY-aware replacement for the old global `seen_uids.json`.
+
+    A UIDVALIDITY change means the server renumbered the mailbox, so it simply
+    starts a fresh state row and the old UIDs are never matched again.
+    """
+
+    def __init__(self, path: str = SYNC_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS mailboxes (
+                id INTEGER PRIMARY KEY,
+                host TEXT NOT NULL,
+                user TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                last_uid INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (host, user, mailbox, uidvalidity)
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS processed_uids (
+                mailbox_id INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                PRIMARY KEY (mailbox_id, uid)
+            ) WITHOUT ROWID"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS failed_uids (
+                mailbox_id INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (mailbox_id, uid)
+            ) WITHOUT ROWID"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS attachments (
+                mailbox_id INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                part TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                mime_type TEXT,
+                size INTEGER,
+                encoding TEXT,
+                date TEXT,
+                PRIMARY KEY (mailbox_id, uid, part)
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS message_ids (
+                host TEXT NOT NULL,
+                user TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                mailbox_id INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                PRIMARY KEY (host, user, message_id)
+            ) WITHOUT ROWID"""
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(attachments)")}
+        if "date" not in columns:
+            # State files written before message dates were recorded
+            self._conn.execute("ALTER TABLE attachments ADD COLUMN date TEXT")
+        self._conn.commit()
+
+    def mailbox(self, host: str, user: str, mailbox: str, uidvalidity: int) -> MailboxState:
+        key = (host.lower(), user.lower(), mailbox, int(uidvalidity))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO mailboxes (host, user, mailbox, uidvalidity) "
+                "VALUES (?, ?, ?, ?)",
+                key,
+            )
+            self._conn.commit()
+            mailbox_id, last_uid = self._conn.execute(
+                "SELECT id, last_uid FROM mailboxes "
+                "WHERE host = ? AND user = ? AND mailbox = ? AND uidvalidity = ?",
+                key,
+            ).fetchone()
+        return MailboxState(self, mailbox_id, last_uid)
+
+    def claim_message(self, host: str, user: str, message_id: str, mailbox_id: int, uid: int) -> bool:
+        """
+        Records (mailbox, UID) as the copy of `message_id` that gets processed, unless
+        another copy already is (the same mail in INBOX, a label and All Mail).
+        Returns True when this copy owns the message.
+        """
+        key = (host.lower(), user.lower(), message_id)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO message_ids (host, user, message_id, mailbox_id, uid) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (*key, mailbox_id, int(uid)),
+            )
+            self._conn.commit()
+            owner = self._conn.execute(
+                "SELECT mailbox_id, uid FROM message_ids WHERE host = ? AND user = ? AND message_id = ?",
+                key,
+            ).fetchone()
+        return owner == (mailbox_id, int(uid))
+
+    def list_attachments(self, host: str, user: str) -> List[dict]:
+        """All known attachments of an account, newest message first."""
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT m.mailbox, m.uidvalidity, a.uid, a.part, a.filename,
+                          a.mime_type, a.size, a.encoding, a.date
+                   FROM attachments a JOIN mailboxes m ON m.id = a.mailbox_id
+                   WHERE m.host = ? AND m.user = ?
+                   ORDER BY a.uid DESC, a.part""",
+                (host.lower(), user.lower()),
+            ).fetchall()
+        keys = ("mailbox", "uidvalidity", "uid", "part", "filename", "mime_type", "size", "encoding", "date")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+def get_sync_state_store() -> SyncStateStore:
+    """Process-wide sync state, opened on first use rather than at import time."""
+    return get_client("sync-state", SyncStateStore)
@@ -1,20 +1,19 @@
-import google.generativeai as genai
-from langchain.prompts import PromptTemplate
-from dotenv import load_dotenv
-from langchain.tools import StructuredTool
-from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import Annotated
-import os 
-
-load_dotenv()
-
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel("gemini-2.0-flash")
+from typing import Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from app.utils import TokenBucket, count_tokens, truncate_to_tokens
+from app.clients import GEMINI_MODEL_NAME, get_chat_llm, get_client
+from app.extraction_cache import ExtractionCache, extraction_cache_key, prompt_version
+from app.tracing import record_llm_call, register_cache, span
+import json
+import os
+import re
+import threading
 
 # Prompt Template for extarcting To-Do from the Email
-email_task_prompt = PromptTemplate(
-    input_variables=["sender", "subject", "date", "email_body","attachments"],
-    template="""
+EMAIL_TASK_INPUT_VARIABLES = ["sender", "subject", "date", "email_body","attachments"]
+EMAIL_TASK_TEMPLATE = """
 You are a highly accurate email task and information extraction assistant.
 
 Below is the detailed content of an email the user received. Your job is to extract the following clearly and concisely:
@@ -49,27 +48,338 @@ Attachments:
 -----
 ### **Your Output (Follow the format strictly):**
 """
+
+# Packed variant: the instructions are sent once for several emails and the answer
+# comes back as JSON (literal braces are doubled for PromptTemplate)
+BATCH_TASK_INPUT_VARIABLES = ["count", "emails"]
+BATCH_TASK_TEMPLATE = """
+You are a highly accurate email task and information extraction assistant.
+
+Below are {count} emails the user received, one JSON object per line, each with a numeric "id". For every email extract:
+
+1 **To-Do Task:** Is there any clear, actionable task for the user? Example tasks: reply to someone, complete an assignment, attend a meeting, check an app. If none, write "None".
+2 **Important Information / Notifications:** Any important non-actionable info the user should note? E.g., meetings scheduled, upcoming deadlines, notifications from apps, policy updates. If none, write "None".
+3 **Ignore irrelevant content:** Completely ignore ads, newsletters, promotions if they contain no useful task or info.
+
+---
+
+### 📄 **Output Format (Strictly follow this structure):**
+
+Return only a JSON array with exactly one object per email, without code fences or any other text:
+[{{"id": <email id>, "todo": "<actionable task or None>", "important_info": "<important info or None>"}}]
+
+---
+
+### **Emails:**
+{emails}
+"""
+
+# --- Packing settings --- #
+# Max emails per packed request; 1 sends one request per email
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "8"))
+# Max prompt tokens of a packed request (instructions included)
+EXTRACTION_BATCH_TOKENS = int(os.getenv("EXTRACTION_BATCH_TOKENS", "6000"))
+# Email bodies are cut to this many tokens in both modes
+EMAIL_BODY_TOKEN_CAP = int(os.getenv("EMAIL_BODY_TOKEN_CAP", "800"))
+
+
+def _build_task_chain():
+    from langchain_core.prompts import PromptTemplate
+
+    email_task_prompt = PromptTemplate(
+        input_variables=EMAIL_TASK_INPUT_VARIABLES,
+        template=EMAIL_TASK_TEMPLATE,
+    )
+    return email_task_prompt | get_chat_llm()
+
+
+def get_task_chain():
+    """Prompt | Gemini chain, built on first use and shared by every thread."""
+    return get_client("task-chain", _build_task_chain)
+
+
+def _build_batch_chain():
+    from langchain_core.prompts import PromptTemplate
+
+    batch_task_prompt = PromptTemplate(
+        input_variables=BATCH_TASK_INPUT_VARIABLES,
+        template=BATCH_TASK_TEMPLATE,
+    )
+    return batch_task_prompt | get_chat_llm()
+
+
+def get_batch_chain():
+    """Packed-prompt | Gemini chain, built on first use and shared by every thread."""
+    return get_client("batch-task-chain", _build_batch_chain)
+
+
+def _build_extraction_cache() -> ExtractionCache:
+    cache = ExtractionCache()
+    register_cache("extraction", cache)
+    return cache
+
+
+def get_extraction_cache() -> ExtractionCache:
+    return get_client("extraction-cache", _build_extraction_cache)
+
+
+# --- Extraction cache (skips the LLM for content we have already processed) --- #
+# Both templates and the body cap are part of the version: either mode may fill an entry
+PROMPT_VERSION = prompt_version(
+    f"{EMAIL_TASK_TEMPLATE}\x00{BATCH_TASK_TEMPLATE}\x00{EMAIL_BODY_TOKEN_CAP}", GEMINI_MODEL_NAME
 )
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0,
-    max_tokens=None,
+
+
+# --- Counters (read by the UI / benchmarks) --- #
+extraction_stats = {"emails": 0, "llm_calls": 0, "prompt_tokens": 0, "batch_fallbacks": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for name, value in deltas.items():
+            extraction_stats[name] += value
+
+
+# --- Concurrency / quota settings --- #
+# Max number of Gemini calls in flight at once
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "8"))
+# Requests per minute allowed by the Gemini quota (free tier of gemini-2.0-flash is 15 RPM)
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "5"))
+
+gemini_rate_limiter = TokenBucket(rate=GEMINI_RPM / 60.0, capacity=GEMINI_BURST)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def _is_retryable(exc: BaseException) -> bool:
+    """True for quota (429) and server-side (5xx) errors."""
+    from google.api_core import exceptions as google_exceptions
+
+    if isinstance(exc, (google_exceptions.TooManyRequests,
+                        google_exceptions.ResourceExhausted,
+                        google_exceptions.ServerError)):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return code in RETRYABLE_STATUS_CODES
+
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True,
 )
+def _invoke_task_chain(input_prompt: dict, chain=None, prompt_tokens: int = 0) -> str:
+    # Every attempt (retries included) counts against the quota
+    with span("llm.rate_limit_wait", log=False):
+        gemini_rate_limiter.acquire()
+    with span("llm.extract", emails=input_prompt.get("count", 1)):
+        message = (chain or get_task_chain()).invoke(input_prompt)
+        record_llm_call("extract", prompt_tokens, message.content, message)
+    return message.content
 
-task_chain = email_task_prompt | llm
 
-# Gemini Based Function for extracting
-def extract_todo_from_email(email_data: dict) -> str:
-    """
-    📌 Extracts actionable tasks from a given email body.
-    Returns a clear, numbered list of tasks.
-    """
-    input_prompt ={
+def _prompt_input(email_data: dict) -> dict:
+    return {
         'sender': email_data["from"],
         'subject':email_data["subject"],
         'date':email_data["date"],
-        'email_body':email_data["body"],
+        'email_body':truncate_to_tokens(email_data["body"], EMAIL_BODY_TOKEN_CAP),
         'attachments':email_data["attachments"]
     }
-    return task_chain.invoke(input_prompt).content
-    
+
+# Gemini Based Function for extracting
+def extract_todo_from_email(email_data: dict, check_cache: bool = True) -> str:
+    """
+    📌 Extracts actionable tasks from a given email body.
+    Returns a clear, numbered list of tasks.
+
+    `check_cache=False` is for callers that already looked the email up and missed,
+    so the miss is not counted twice in the cache statistics.
+    """
+    input_prompt = _prompt_input(email_data)
+    cache_key = extraction_cache_key(email_data, PROMPT_VERSION)
+    extraction_cache = get_extraction_cache()
+    cached = extraction_cache.get(cache_key) if check_cache else None
+    if cached is not None:
+        return cached
+
+    prompt_tokens = count_tokens(EMAIL_TASK_TEMPLATE.format(**input_prompt))
+    _count(emails=1, llm_calls=1, prompt_tokens=prompt_tokens)
+    extraction = _invoke_task_chain(input_prompt, prompt_tokens=prompt_tokens)
+    extraction_cache.put(cache_key, extraction)
+    return extraction
+
+
+# --- Packed extraction --- #
+_CODE_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_BATCH_TEMPLATE_TOKENS = None
+
+
+def _batch_template_tokens() -> int:
+    global _BATCH_TEMPLATE_TOKENS
+    if _BATCH_TEMPLATE_TOKENS is None:
+        _BATCH_TEMPLATE_TOKENS = count_tokens(BATCH_TASK_TEMPLATE)
+    return _BATCH_TEMPLATE_TOKENS
+
+
+def _email_line(email_id: int, email_data: dict) -> str:
+    """One email of a packed prompt, as a single JSON line."""
+    input_prompt = _prompt_input(email_data)
+    return json.dumps({
+        "id": email_id,
+        "sender": input_prompt["sender"],
+        "subject": input_prompt["subject"],
+        "date": input_prompt["date"],
+        "body": input_prompt["email_body"],
+        "attachments": input_prompt["attachments"],
+    }, ensure_ascii=False, default=str)
+
+
+def _format_extraction(todo: Optional[str], important_info: Optional[str]) -> str:
+    """Same text layout as a single-email answer, so the UI and cache see one format."""
+    return f"To-Do Task: {todo or 'None'}  \nImportant Information: {important_info or 'None'}"
+
+
+def parse_batch_output(raw: str, ids: List[int]) -> Optional[dict]:
+    """
+    Validates a packed answer: a JSON array holding exactly one object per id,
+    each with an integer "id" and string (or null) "todo" / "important_info".
+    Returns {id: extraction text}, or None when the answer does not match.
+    """
+    try:
+        items = json.loads(_CODE_FENCE_RE.sub("", raw))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(items, list) or len(items) != len(ids):
+        return None
+
+    extractions = {}
+    for item in items:
+        if not isinstance(item, dict):
+            return None
+        email_id = item.get("id")
+        todo = item.get("todo")
+        important_info = item.get("important_info")
+        if (
+            type(email_id) is not int
+            or email_id not in ids
+            or email_id in extractions
+            or not isinstance(todo, (str, type(None)))
+            or not isinstance(important_info, (str, type(None)))
+        ):
+            return None
+        extractions[email_id] = _format_extraction(todo, important_info)
+    return extractions
+
+
+def extract_todos_packed(emails: List[dict], check_cache: bool = True) -> List[str]:
+    """
+    📦 Extracts tasks from several emails with one Gemini request.
+
+    The emails are packed into `BATCH_TASK_TEMPLATE` and the model answers with a
+    JSON array. If the answer fails validation, every email is extracted on its
+    own with `extract_todo_from_email`. Results are cached per email and returned
+    in input order. `check_cache` is passed on to those calls.
+    """
+    if len(emails) == 1:
+        return [extract_todo_from_email(emails[0], check_cache)]
+
+    lines = [_email_line(email_id, email_data) for email_id, email_data in enumerate(emails)]
+    input_prompt = {"count": len(emails), "emails": "\n".join(lines)}
+    prompt_tokens = _batch_template_tokens() + sum(count_tokens(line) for line in lines)
+    _count(emails=len(emails), llm_calls=1, prompt_tokens=prompt_tokens)
+    raw = _invoke_task_chain(input_prompt, chain=get_batch_chain(), prompt_tokens=prompt_tokens)
+    extractions = parse_batch_output(raw, list(range(len(emails))))
+    if extractions is None:
+        # The emails are counted again by the per-email calls
+        _count(batch_fallbacks=1, emails=-len(emails))
+        return [extract_todo_from_email(email_data, check_cache) for email_data in emails]
+
+    extraction_cache = get_extraction_cache()
+    results = []
+    for email_id, email_data in enumerate(emails):
+        extraction_cache.put(extraction_cache_key(email_data, PROMPT_VERSION), extractions[email_id])
+        results.append(extractions[email_id])
+    return results
+
+
+def _resolved(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+_PENDING = object()
+
+
+def _extract_pack(emails: List[dict], known: list) -> List[str]:
+    """Extracts the emails whose result is not known yet and merges them back in order."""
+    # Pending emails already missed the cache in `extract_todos_concurrently`
+    extracted = iter(extract_todos_packed(
+        [email_data for email_data, value in zip(emails, known) if value is _PENDING],
+        check_cache=False,
+    ))
+    return [next(extracted) if value is _PENDING else value for value in known]
+
+
+def extract_todos_concurrently(
+    emails: Iterable[dict],
+    max_concurrency: int = EXTRACTION_CONCURRENCY,
+) -> Iterator[Tuple[dict, str]]:
+    """
+    ⚡ Runs the extraction over many emails with a bounded thread pool.
+
+    Emails are pulled lazily from `emails`. Cached emails reuse their extraction
+    and emails that triage marked as "skip" get None, both without an LLM call.
+    With `EXTRACTION_BATCH_SIZE` > 1, the others are packed into requests of up to
+    that many emails and `EXTRACTION_BATCH_TOKENS` prompt tokens. At most
+    `2 * max_concurrency` requests are in flight at a time, and (email_data,
+    extraction) pairs are yielded in the same order the emails came in, as soon
+    as every earlier request has finished.
+    """
+    extraction_cache = get_extraction_cache()
+    batch_size = max(EXTRACTION_BATCH_SIZE, 1)
+    budget = EXTRACTION_BATCH_TOKENS - _batch_template_tokens() if batch_size > 1 else 0
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        # Each entry is (emails, future resolving to their extractions)
+        in_flight = deque()
+        # Emails waiting for the next request; known results ride along to keep their order
+        pack, known, pending, pack_tokens = [], [], 0, 0
+
+        def _flush():
+            nonlocal pack, known, pending, pack_tokens
+            if pack:
+                future = pool.submit(_extract_pack, pack, known) if pending else _resolved(known)
+                in_flight.append((pack, future))
+                pack, known, pending, pack_tokens = [], [], 0, 0
+
+        def _drain(limit: int):
+            # Waits only while more than `limit` requests are in flight, but always
+            # hands over finished results at the head right away
+            while in_flight and (len(in_flight) > limit or in_flight[0][1].done()):
+                batch, future = in_flight.popleft()
+                yield from zip(batch, future.result())
+
+        for email_data in emails:
+            skip = (email_data.get("triage") or {}).get("action") == "skip"
+            cached = None if skip else extraction_cache.get(extraction_cache_key(email_data, PROMPT_VERSION))
+            if skip or cached is not None:
+                pack.append(email_data)
+                known.append(cached)
+                if not pending or len(pack) >= 4 * batch_size:
+                    _flush()
+            else:
+                tokens = count_tokens(_email_line(0, email_data)) if budget else 0
+                if pending and (pending >= batch_size or pack_tokens + tokens > budget):
+                    _flush()
+                pack.append(email_data)
+                known.append(_PENDING)
+                pending += 1
+                pack_tokens += tokens
+                if pending >= batch_size:
+                    _flush()
+            yield from _drain(2 * max_concurrency - 1)
+        _flush()
+        yield from _drain(0)
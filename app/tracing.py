@@ -0,0 +1,205 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from app.clients import GEMINI_MODEL_NAME, get_client
+from app.utils import count_tokens
+
+# One JSON object per finished span is appended here; empty disables the log
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "traces.jsonl")
+# Mirror spans to OpenTelemetry (needs `opentelemetry-api`; exporters are configured by the SDK)
+OTEL_TRACING = os.getenv("OTEL_TRACING", "0") == "1"
+# Gemini list prices in USD per million tokens, used for the cost estimate
+GEMINI_INPUT_USD_PER_MTOK = float(os.getenv("GEMINI_INPUT_USD_PER_MTOK", "0.10"))
+GEMINI_OUTPUT_USD_PER_MTOK = float(os.getenv("GEMINI_OUTPUT_USD_PER_MTOK", "0.40"))
+
+# --- Aggregates (read by the diagnostics panel / benchmarks) --- #
+_stages: Dict[str, dict] = {}
+counters: Dict[str, float] = {}
+_caches: Dict[str, object] = {}
+_lock = threading.Lock()
+_span_ids = itertools.count(1)
+_local = threading.local()
+
+
+def _load_otel_tracer():
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return False
+    return trace.get_tracer("opspilot")
+
+
+def _otel_tracer():
+    return get_client("otel-tracer", _load_otel_tracer) if OTEL_TRACING else False
+
+
+def _trace_log():
+    # Line-buffered, so every span reaches the file as soon as it ends
+    return get_client("trace-log", lambda: open(TRACE_LOG_PATH, "a", buffering=1, encoding="utf-8"))
+
+
+def add(name: str, value: float = 1):
+    """Adds `value` to the counter `name` (bytes transferred, LLM tokens, ...)."""
+    with _lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+def record_duration(name: str, seconds: float):
+    """Adds one timing to the aggregate of stage `name` without writing a log line."""
+    with _lock:
+        stage = _stages.setdefault(name, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+        stage["count"] += 1
+        stage["total_s"] += seconds
+        stage["max_s"] = max(stage["max_s"], seconds)
+
+
+def register_cache(name: str, cache):
+    """Includes a cache with `hits` / `misses` attributes in the hit-rate report."""
+    with _lock:
+        _caches[name] = cache
+
+
+@contextmanager
+def span(name: str, log: bool = True, **attributes):
+    """
+    Times the wrapped block as stage `name` and yields its attribute dict, which
+    the block may fill in (counts, bytes, tokens). Spans opened inside it on the
+    same thread become its children.
+
+    Every span is added to the stage aggregates. With `log=True` it is also
+    written to the JSON trace log and mirrored to OpenTelemetry; per-email
+    stages pass `log=False` so large syncs do not flood the log.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    span_id = next(_span_ids)
+    record = {
+        "name": name,
+        "span_id": span_id,
+        "parent_id": parent["span_id"] if parent else None,
+        "trace_id": parent["trace_id"] if parent else span_id,
+        "attributes": attributes,
+    }
+    stack.append(record)
+    tracer = _otel_tracer() if log else False
+    otel_span = tracer.start_span(name) if tracer else None
+    started_at = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        # Not always the top: a generator suspended inside a span may be resumed later
+        stack.remove(record)
+        record_duration(name, seconds)
+        if otel_span is not None:
+            for key, value in attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    otel_span.set_attribute(key, value)
+            if error:
+                otel_span.set_attribute("error", error)
+            otel_span.end()
+        if log and TRACE_LOG_PATH:
+            record.update(start=started_at, duration_s=round(seconds, 6), thread=threading.current_thread().name)
+            if error:
+                record["error"] = error
+            try:
+                _trace_log().write(json.dumps(record, default=str) + "\n")
+            except OSError:
+                pass
+
+
+def _usage_tokens(response):
+    """(input, output) tokens reported by LangChain or google-generativeai, or None."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+
+
+def record_llm_call(name: str, input_tokens: int, output_text: str, response=None) -> dict:
+    """
+    Counts one LLM call under `name` (e.g. "extract", "answer"): input / output tokens
+    and their estimated cost. Counts reported by the API in `response` win over the
+    local estimates. Returns the numbers, which are also added to the current span.
+    """
+    reported = _usage_tokens(response) or (None, None)
+    usage = {
+        "input_tokens": reported[0] if reported[0] is not None else input_tokens,
+        "output_tokens": reported[1] if reported[1] is not None else count_tokens(output_text or ""),
+    }
+    usage["cost_usd"] = (
+        usage["input_tokens"] * GEMINI_INPUT_USD_PER_MTOK + usage["output_tokens"] * GEMINI_OUTPUT_USD_PER_MTOK
+    ) / 1e6
+    add(f"llm.{name}.calls")
+    for key, value in usage.items():
+        add(f"llm.{name}.{key}", value)
+    stack = getattr(_local, "stack", None)
+    if stack:
+        for key, value in usage.items():
+            stack[-1]["attributes"][key] = stack[-1]["attributes"].get(key, 0) + value
+    return usage
+
+
+def diagnostics() -> dict:
+    """
+    Snapshot of everything recorded in this process.
+
+    ✅ Output:
+        - stages: [{name, count, total_s, mean_s, max_s}], slowest total first
+        - llm: per call type and in total, calls / input_tokens / output_tokens / cost_usd
+        - caches: {name: {hits, misses, hit_rate}}
+        - counters: every raw counter (bytes transferred, ...)
+        - model: model name the cost estimate is based on
+    """
+    with _lock:
+        stages = [
+            {"name": name, **stage, "mean_s": stage["total_s"] / stage["count"]}
+            for name, stage in _stages.items()
+        ]
+        counter_values = dict(counters)
+        caches = dict(_caches)
+
+    llm = {"total": {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}}
+    for key, value in counter_values.items():
+        if key.startswith("llm."):
+            name, metric = key[len("llm."):].rsplit(".", 1)
+            llm.setdefault(name, {})[metric] = value
+            llm["total"][metric] += value
+
+    cache_report = {}
+    for name, cache in caches.items():
+        lookups = cache.hits + cache.misses
+        cache_report[name] = {
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "hit_rate": cache.hits / lookups if lookups else 0.0,
+        }
+
+    return {
+        "stages": sorted(stages, key=lambda s: s["total_s"], reverse=True),
+        "llm": llm,
+        "caches": cache_report,
+        "counters": counter_values,
+        "model": GEMINI_MODEL_NAME,
+    }
+
+
+def reset_diagnostics():
+    """Clears the stage aggregates and counters (cache hit counts are kept by the caches)."""
+    with _lock:
+        _stages.clear()
+        counters.clear()
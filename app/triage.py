@@ -0,0 +1,178 @@
+import json
+import os
+import re
+import threading
+from email.message import Message
+from email.utils import getaddresses, parseaddr
+from fnmatch import fnmatch
+from typing import List
+
+# --- Triage settings --- #
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "1") == "1"
+# Emails scoring at or above this are skipped without an LLM call
+TRIAGE_THRESHOLD = float(os.getenv("TRIAGE_THRESHOLD", "3.0"))
+# Optional JSON file: {"allow": ["boss@company.com", "*@university.edu"], "deny": ["*@shop.example"]}
+TRIAGE_RULES_PATH = os.getenv("TRIAGE_RULES_PATH", "triage_rules.json")
+
+# Bulk-mail infrastructure and typical marketing subdomains
+MARKETING_DOMAINS = [
+    "mcsv.net", "mcdlv.net", "rsgsv.net", "mailchimpapp.net", "sendgrid.net",
+    "klaviyomail.com", "hubspotemail.net", "ccsend.com", "exacttarget.com",
+    "sailthru.com", "mktomail.com", "createsend.com", "sparkpostmail.com",
+    "news.*", "newsletter.*", "newsletters.*", "marketing.*", "promo.*",
+    "promotions.*", "offers.*", "deals.*",
+] + [d.strip().lower() for d in os.getenv("TRIAGE_MARKETING_DOMAINS", "").split(",") if d.strip()]
+
+_NOREPLY_RE = re.compile(r"^(no[-_.]?reply|do[-_.]?not[-_.]?reply|newsletter|news|marketing|promo(tions)?|offers|deals)\b", re.I)
+
+# Header signals and their weights
+HEADER_WEIGHTS = {
+    "list_unsubscribe": 2.0,
+    "precedence_bulk": 2.0,
+    "marketing_domain": 2.0,
+    "campaign_header": 1.5,
+    "noreply_sender": 1.0,
+    "list_id": 0.5,
+}
+
+# Small linear text classifier: presence of a phrase adds its weight to the score.
+# Positive phrases point to promotions / newsletters, negative ones to mail a person
+# has to act on, so a real deadline in a bulk-sent email is still extracted.
+TEXT_WEIGHTS = {
+    r"unsubscribe": 1.5,
+    r"view (this email )?in (your|a) browser": 1.5,
+    r"\d+\s?% off": 1.2,
+    r"shop now": 1.2,
+    r"free shipping": 1.2,
+    r"promo(tion)? code|coupon": 1.2,
+    r"limited[- ]time": 1.0,
+    r"newsletter": 1.0,
+    r"discount": 1.0,
+    r"buy now|order now": 1.0,
+    r"sale|deals?": 0.8,
+    r"exclusive|special offer": 0.6,
+    r"webinar|digest|weekly roundup": 0.5,
+    r"action required|response required": -1.5,
+    r"deadline|due (date|by|on)": -1.2,
+    r"interview": -1.2,
+    r"meeting|calendar invite|invitation": -1.0,
+    r"assignment|submission": -1.0,
+    r"verification code|one[- ]time (password|code)|otp": -1.0,
+    r"invoice|payment (due|failed|received)": -0.8,
+    r"password|security alert|sign[- ]in attempt": -0.8,
+    r"please (reply|respond|confirm|review|sign)": -0.8,
+    r"schedule|reschedule": -0.6,
+}
+TEXT_BIAS = -1.0
+_TEXT_FEATURES = [(re.compile(rf"\b(?:{pattern})\b", re.I), weight) for pattern, weight in TEXT_WEIGHTS.items()]
+
+# Only the start of the body is scored; promotional footers sit further down in long mail
+_TEXT_SCAN_CHARS = 4000
+
+
+def _load_rules(path: str = TRIAGE_RULES_PATH) -> dict:
+    rules = {"allow": [], "deny": []}
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            loaded = json.load(f)
+        rules["allow"] += loaded.get("allow", [])
+        rules["deny"] += loaded.get("deny", [])
+    rules["allow"] += [p.strip() for p in os.getenv("TRIAGE_ALLOW", "").split(",") if p.strip()]
+    rules["deny"] += [p.strip() for p in os.getenv("TRIAGE_DENY", "").split(",") if p.strip()]
+    rules["allow"] = [p.lower() for p in rules["allow"]]
+    rules["deny"] = [p.lower() for p in rules["deny"]]
+    return rules
+
+
+triage_rules = _load_rules()
+
+# Counters for the UI: every skipped email is one extraction (LLM input) saved
+triage_stats = {"checked": 0, "skipped": 0, "allowed": 0, "denied": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(*names: str):
+    with _stats_lock:
+        for name in names:
+            triage_stats[name] += 1
+
+
+def _domain(address: str) -> str:
+    return address.rsplit("@", 1)[-1].lower() if "@" in address else ""
+
+
+def _matches(address: str, patterns: List[str]) -> bool:
+    """Sender patterns match the full address ("*@shop.com") or the domain ("*.shop.com")."""
+    domain = _domain(address)
+    return any(fnmatch(address, p) or (domain and fnmatch(domain, p)) for p in patterns)
+
+
+def _is_marketing_domain(domain: str) -> bool:
+    return any(
+        fnmatch(domain, pattern) if "*" in pattern else domain == pattern or domain.endswith("." + pattern)
+        for pattern in MARKETING_DOMAINS
+    )
+
+
+def header_signals(msg: Message) -> List[str]:
+    """Names of the bulk-mail header signals present in `msg` (see HEADER_WEIGHTS)."""
+    signals = []
+    if msg.get("List-Unsubscribe"):
+        signals.append("list_unsubscribe")
+    # "Precedence: list" is ordinary mailing-list mail (course lists, GitHub), not bulk
+    if str(msg.get("Precedence", "")).strip().lower() in ("bulk", "junk"):
+        signals.append("precedence_bulk")
+    if msg.get("List-Id"):
+        signals.append("list_id")
+    if any(msg.get(h) for h in ("X-Campaign", "X-CampaignID", "X-Mailchimp-Campaign", "X-MC-User", "Feedback-ID")):
+        signals.append("campaign_header")
+
+    sender = parseaddr(str(msg.get("From") or ""))[1].lower()
+    if _NOREPLY_RE.match(sender.split("@", 1)[0]):
+        signals.append("noreply_sender")
+    # Bulk senders often show up only in Return-Path / Sender
+    routing = [sender] + [a.lower() for _, a in getaddresses(
+        [str(msg.get(h)) for h in ("Return-Path", "Sender") if msg.get(h)]
+    )]
+    if any(_is_marketing_domain(_domain(a)) for a in routing if a):
+        signals.append("marketing_domain")
+    return signals
+
+
+def text_score(text: str) -> float:
+    """Score of the local text classifier; positive means promotional."""
+    text = (text or "")[:_TEXT_SCAN_CHARS]
+    return TEXT_BIAS + sum(weight for regex, weight in _TEXT_FEATURES if regex.search(text))
+
+
+def triage_email(msg: Message, subject: str, body: str) -> dict:
+    """
+    🧹 Decides, without an LLM call, whether an email is worth extracting.
+
+    Allow / deny rules on the sender win. Otherwise header signals and the text
+    classifier are added up; a score of at least TRIAGE_THRESHOLD skips the email,
+    but only if the text itself reads as promotional (headers alone never skip).
+
+    ✅ Output:
+        - action: "extract" or "skip"
+        - reason: the rule or signals behind the decision
+        - score: combined score (None for rule matches)
+    """
+    sender = parseaddr(str(msg.get("From") or ""))[1].lower()
+    _count("checked")
+    if not TRIAGE_ENABLED:
+        return {"action": "extract", "reason": "triage disabled", "score": None}
+    if _matches(sender, triage_rules["allow"]):
+        _count("allowed")
+        return {"action": "extract", "reason": "allow rule", "score": None}
+    if _matches(sender, triage_rules["deny"]):
+        _count("denied", "skipped")
+        return {"action": "skip", "reason": "deny rule", "score": None}
+
+    signals = header_signals(msg)
+    promotional = text_score(f"{subject}\n{body}")
+    score = sum(HEADER_WEIGHTS[s] for s in signals) + promotional
+    if promotional > 0 and score >= TRIAGE_THRESHOLD:
+        _count("skipped")
+        return {"action": "skip", "reason": ", ".join(signals) or "promotional text", "score": round(score, 2)}
+    return {"action": "extract", "reason": ", ".join(signals) or "no bulk signals", "score": round(score, 2)}
@@ -0,0 +1,118 @@
+import threading
+from collections import OrderedDict
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to keep outgoing API calls under a quota.
+
+    `rate` tokens are added per second up to `capacity`; `acquire` blocks until
+    enough tokens are available.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class LRUCache:
+    """
+    Small thread-safe in-memory cache with LRU eviction and a per-entry TTL.
+    `get` returns None on a miss or an expired entry.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def keys(self) -> list:
+        with self._lock:
+            now = time.monotonic()
+            return [k for k, (created, _) in self._data.items() if now - created <= self.ttl]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# --- Token counting --- #
+def _load_encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken missing or its encoding file cannot be downloaded
+        return False
+
+
+def _encoding():
+    from app.clients import get_client
+
+    return get_client("tiktoken-encoding", _load_encoding)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count of `text` with tiktoken's cl100k encoding, a close enough stand-in
+    for Gemini's tokenizer when budgeting. Falls back to ~4 characters per token.
+    """
+    encoding = _encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts `text` to at most `max_tokens` tokens."""
+    text = text or ""
+    encoding = _encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[: max_tokens * 4]
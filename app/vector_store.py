@@ -0,0 +1,489 @@
+import abc
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.clients import get_client
+
+# "pinecone" (default) or "local"
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+PINECONE_INDEX_NAME = "rag-search"
+PINECONE_EMBED_MODEL = "llama-text-embed-v2"
+
+logger = logging.getLogger("opspilot.vector_store")
+
+# --- Local backend settings --- #
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", "vector_store")
+# sentence-transformers model used when the package is installed
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "all-MiniLM-L6-v2")
+HASHING_EMBED_DIM = 512
+# "flat" (exact search) or "ivf" (inverted file over k-means clusters)
+LOCAL_VECTOR_INDEX = os.getenv("LOCAL_VECTOR_INDEX", "flat")
+# Store vectors as int8 instead of float32 (4x smaller, slightly less exact)
+LOCAL_VECTOR_QUANTIZE = os.getenv("LOCAL_VECTOR_QUANTIZE", "0") == "1"
+IVF_MIN_VECTORS = 4096
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# Rows scored per matrix multiply during flat search
+SEARCH_BLOCK_ROWS = 65536
+
+
+class VectorStore(abc.ABC):
+    """
+    Interface used by `ingest_files_to_vector_db` and `query_vector_db`.
+
+    Records are dicts with `_id`, `chunk_text` and any metadata fields. Search
+    hits use Pinecone's shape: {"_id", "_score", "fields": {...}}, and `filter`
+    uses Pinecone's metadata filter language (see `matches_filter`).
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def upsert(self, namespace: str, records: List[dict]):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, ids: List[str]):
+        ...
+
+    @abc.abstractmethod
+    def search(self, namespace: str, query: str, top_k: int = 5, filter: Optional[dict] = None) -> List[dict]:
+        ...
+
+
+def _matches_condition(value, condition) -> bool:
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    # List fields (e.g. every filename a blob was received under) match on any element
+    values = value if isinstance(value, list) else [value]
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = operand in values
+        elif op == "$ne":
+            ok = operand not in values
+        elif op == "$in":
+            ok = any(v in operand for v in values)
+        elif op == "$nin":
+            ok = not any(v in operand for v in values)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            try:
+                ok = value is not None and {
+                    "$gt": value > operand,
+                    "$gte": value >= operand,
+                    "$lt": value < operand,
+                    "$lte": value <= operand,
+                }[op]
+            except TypeError:
+                ok = False
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if not ok:
+            return False
+    return True
+
+
+def matches_filter(fields: dict, filter: Optional[dict]) -> bool:
+    """
+    Evaluates the subset of Pinecone's metadata filters used here: field equality,
+    $eq / $ne / $in / $nin / $gt / $gte / $lt / $lte, and $and / $or.
+    """
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            ok = all(matches_filter(fields, f) for f in condition)
+        elif key == "$or":
+            ok = any(matches_filter(fields, f) for f in condition)
+        else:
+            ok = _matches_condition(fields.get(key), condition)
+        if not ok:
+            return False
+    return True
+
+
+class PineconeVectorStore(VectorStore):
+    """Pinecone index with server-side (integrated) embedding."""
+
+    name = "pinecone"
+
+    def __init__(self, api_key: Optional[str] = None, index_name: str = PINECONE_INDEX_NAME):
+        from pinecone import Pinecone
+
+        pc = Pinecone(api_key=api_key or os.getenv("PINECONE_API_KEY"))
+        # --- Create index if needed --- #
+        if not pc.has_index(index_name):
+            pc.create_index_for_model(
+                name=index_name,
+                cloud="aws",
+                region="us-east-1",
+                embed={
+                "model": PINECONE_EMBED_MODEL,
+                "field_map": {"text": "chunk_text"}
+                }
+            )
+        self.index = pc.Index(index_name)
+
+    def upsert(self, namespace: str, records: List[dict]):
+        self.index.upsert_records(namespace=namespace, records=records)
+
+    def delete(self, namespace: str, ids: List[str]):
+        self.index.delete(ids=ids, namespace=namespace)
+
+    def search(self, namespace: str, query: str, top_k: int = 5, filter: Optional[dict] = None) -> List[dict]:
+        query_spec = {"top_k": top_k, "inputs": {"text": query}}
+        if filter:
+            query_spec["filter"] = filter
+        results = self.index.search(
+            namespace=namespace,
+            query=query_spec
+        )
+        return results["result"]["hits"]
+
+
+class HashingEmbedder:
+    """
+    Dependency-free fallback embedder: feature-hashed word unigrams and bigrams,
+    L2-normalized. Much weaker than a neural model, but deterministic and fast.
+    """
+
+    _TOKEN_RE = re.compile(r"\w+")
+
+    def __init__(self, dim: int = HASHING_EMBED_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _bucket(self, token: str) -> int:
+        return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = self._TOKEN_RE.findall(text.lower())
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                h = self._bucket(feature)
+                out[row, h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str = LOCAL_EMBED_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=64, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def load_local_embedder():
+    """
+    sentence-transformers when installed and its model loads, otherwise the hashing
+    embedder (e.g. offline without the model in the local cache).
+    """
+    try:
+        return SentenceTransformerEmbedder()
+    except ImportError:
+        return HashingEmbedder()
+    except Exception:
+        logger.warning("Could not load %s, using the hashing embedder", LOCAL_EMBED_MODEL, exc_info=True)
+        return HashingEmbedder()
+
+
+class _Namespace:
+    """
+    One namespace of the local store on disk:
+
+        vectors.f32 / vectors.i8   row-major matrix, memory-mapped for search
+        records.json               ids, chunk texts and metadata, row-aligned
+        ivf.npz                    optional k-means centroids + row assignments
+
+    Deletes leave tombstones (id None) that are compacted once they pile up.
+    """
+
+    def __init__(self, path: Path, dim: int, quantize: bool):
+        self.path = path
+        self.dim = dim
+        self.quantize = quantize
+        self.dtype = np.int8 if quantize else np.float32
+        self.vectors_path = path / ("vectors.i8" if quantize else "vectors.f32")
+        self.records_path = path / "records.json"
+        self.ivf_path = path / "ivf.npz"
+        self.lock = threading.Lock()
+        self.records: List[Optional[dict]] = []
+        self.row_of: Dict[str, int] = {}
+        self._matrix = None
+        self._ivf = None
+        # Matching rows per filter, dropped whenever records change
+        self._filter_rows: Dict[str, np.ndarray] = {}
+        if self.records_path.exists():
+            with open(self.records_path, "r") as f:
+                self.records = json.load(f)
+            self.row_of = {r["_id"]: i for i, r in enumerate(self.records) if r}
+
+    # --- storage --- #
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.quantize:
+            return np.clip(np.rint(vectors * 127.0), -127, 127).astype(np.int8)
+        return vectors.astype(np.float32)
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            rows = len(self.records)
+            if rows == 0 or not self.vectors_path.exists():
+                self._matrix = np.zeros((0, self.dim), dtype=self.dtype)
+            else:
+                self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    def _save_records(self):
+        tmp = self.records_path.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.records, f)
+        os.replace(tmp, self.records_path)
+        self._filter_rows.clear()
+
+    def _invalidate(self):
+        self._matrix = None
+        self._ivf = None
+        if self.ivf_path.exists():
+            self.ivf_path.unlink()
+
+    def append(self, records: List[dict], vectors: np.ndarray):
+        self.path.mkdir(parents=True, exist_ok=True)
+        new_rows = []
+        for record, vector in zip(records, vectors):
+            if record["_id"] in self.row_of:
+                # Upsert of an existing id: tombstone the old row
+                self.records[self.row_of.pop(record["_id"])] = None
+            new_rows.append(vector)
+            self.row_of[record["_id"]] = len(self.records)
+            self.records.append(record)
+        new_rows = np.asarray(new_rows, dtype=np.float32)
+        with open(self.vectors_path, "ab") as f:
+            f.write(self._encode(new_rows).tobytes())
+        self._save_records()
+        self._matrix = None
+        if self.ivf_path.exists():
+            # Route new rows to their nearest existing centroid instead of re-clustering
+            centroids, assignments, _ = self._ivf_index()
+            assignments = np.concatenate([assignments, np.argmax(new_rows @ centroids.T, axis=1).astype(np.int32)])
+            self._ivf = (centroids, assignments, _inverted_lists(assignments, len(centroids)))
+            np.savez(self.ivf_path, centroids=centroids, assignments=assignments)
+
+    def remove(self, ids: List[str]):
+        for _id in ids:
+            row = self.row_of.pop(_id, None)
+            if row is not None:
+                self.records[row] = None
+        if self.records and len(self.row_of) < 0.75 * len(self.records):
+            self._compact()
+        else:
+            self._save_records()
+        self._ivf = None
+
+    def _compact(self):
+        keep = [i for i, r in enumerate(self.records) if r]
+        matrix = np.array(self.matrix()[keep]) if keep else np.zeros((0, self.dim), dtype=self.dtype)
+        self._matrix = None
+        tmp = self.vectors_path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(matrix.tobytes())
+        os.replace(tmp, self.vectors_path)
+        self.records = [self.records[i] for i in keep]
+        self.row_of = {r["_id"]: i for i, r in enumerate(self.records)}
+        self._save_records()
+        self._invalidate()
+
+    # --- search --- #
+    def _scores(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        scores = rows.astype(np.float32) @ queries.T
+        return scores / 127.0 if self.quantize else scores
+
+    def _ivf_index(self):
+        if self._ivf is None:
+            if self.ivf_path.exists():
+                data = np.load(self.ivf_path)
+                centroids, assignments = data["centroids"], data["assignments"]
+            else:
+                centroids, assignments = _build_ivf(self.matrix())
+                np.savez(self.ivf_path, centroids=centroids, assignments=assignments)
+            self._ivf = (centroids, assignments, _inverted_lists(assignments, len(centroids)))
+        return self._ivf
+
+    def rows_matching(self, filter: dict) -> np.ndarray:
+        """Live rows whose metadata matches `filter`, cached until the records change."""
+        key = json.dumps(filter, sort_keys=True)
+        rows = self._filter_rows.get(key)
+        if rows is None:
+            rows = np.fromiter(
+                (i for i, r in enumerate(self.records) if r and matches_filter(r, filter)),
+                dtype=np.int64,
+            )
+            self._filter_rows[key] = rows
+        return rows
+
+    def search(
+        self, queries: np.ndarray, top_k: int, use_ivf: bool, filter: Optional[dict] = None
+    ) -> List[List[tuple]]:
+        matrix = self.matrix()
+        n = matrix.shape[0]
+        if n == 0:
+            return [[] for _ in range(len(queries))]
+
+        if filter:
+            # Only the matching rows are scored, however large the namespace is
+            return self._exact_search(matrix, queries, top_k, self.rows_matching(filter))
+
+        alive = np.fromiter((r is not None for r in self.records), dtype=bool, count=n)
+        if use_ivf and n >= IVF_MIN_VECTORS:
+            centroids, _, (order, offsets) = self._ivf_index()
+            results = []
+            probes = np.argsort(-(queries @ centroids.T), axis=1)[:, :IVF_NPROBE]
+            for q, lists in zip(queries, probes):
+                candidates = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists])
+                candidates = candidates[alive[candidates]]
+                scores = self._scores(matrix[candidates], q[None, :])[:, 0]
+                k = min(top_k, len(candidates))
+                best = np.argpartition(-scores, k - 1)[:k] if k else []
+                results.append(sorted(((float(scores[i]), int(candidates[i])) for i in best), reverse=True))
+            return results
+
+        return self._exact_search(matrix, queries, top_k, np.flatnonzero(alive))
+
+    def _exact_search(
+        self, matrix: np.ndarray, queries: np.ndarray, top_k: int, candidates: np.ndarray
+    ) -> List[List[tuple]]:
+        """Block-wise matrix multiply over the candidate rows for all queries at once."""
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        dense = len(candidates) == matrix.shape[0]
+        for start in range(0, len(candidates), SEARCH_BLOCK_ROWS):
+            rows = candidates[start:start + SEARCH_BLOCK_ROWS]
+            # Contiguous slices keep the memmap read sequential when nothing is excluded
+            block_rows = matrix[start:start + len(rows)] if dense else matrix[rows]
+            block = self._scores(block_rows, queries).T
+            rows = np.broadcast_to(rows, block.shape)
+            best_scores = np.concatenate([best_scores, block], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        results = []
+        for scores, rows in zip(best_scores, best_rows):
+            hits = sorted(((float(s), int(r)) for s, r in zip(scores, rows) if np.isfinite(s)), reverse=True)
+            results.append(hits[:top_k])
+        return results
+
+
+def _inverted_lists(assignments: np.ndarray, lists: int):
+    """Rows grouped by cluster: rows of list l are order[offsets[l]:offsets[l + 1]]."""
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.searchsorted(assignments[order], np.arange(lists + 1))
+    return order, offsets
+
+
+def _build_ivf(matrix: np.ndarray, iterations: int = 10, seed: int = 0):
+    """Plain k-means (Lloyd) with ~sqrt(n) clusters; returns (centroids, assignments)."""
+    data = np.asarray(matrix, dtype=np.float32)
+    n = data.shape[0]
+    lists = max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(n, size=lists, replace=False)].copy()
+    assignments = np.zeros(n, dtype=np.int32)
+    for _ in range(iterations):
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            block = data[start:start + SEARCH_BLOCK_ROWS]
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        for c in range(lists):
+            members = data[assignments == c]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids, assignments
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Single-machine vector store: a local embedding model plus a float32 (or int8)
+    matrix per namespace, memory-mapped from `LOCAL_VECTOR_DIR`. Works offline.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        root: str = LOCAL_VECTOR_DIR,
+        embedder=None,
+        index_type: str = LOCAL_VECTOR_INDEX,
+        quantize: bool = LOCAL_VECTOR_QUANTIZE,
+    ):
+        self.embedder = embedder or load_local_embedder()
+        self.root = Path(root) / re.sub(r"[^\w.-]", "_", self.embedder.name)
+        self.use_ivf = index_type == "ivf"
+        self.quantize = quantize
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: str) -> _Namespace:
+        with self._lock:
+            if namespace not in self._namespaces:
+                path = self.root / re.sub(r"[^\w.@-]", "_", namespace)
+                self._namespaces[namespace] = _Namespace(path, self.embedder.dim, self.quantize)
+            return self._namespaces[namespace]
+
+    def upsert(self, namespace: str, records: List[dict]):
+        if not records:
+            return
+        vectors = self.embedder.embed([r["chunk_text"] for r in records])
+        ns = self._namespace(namespace)
+        with ns.lock:
+            ns.append(records, vectors)
+
+    def delete(self, namespace: str, ids: List[str]):
+        ns = self._namespace(namespace)
+        with ns.lock:
+            ns.remove(ids)
+
+    def search(self, namespace: str, query: str, top_k: int = 5, filter: Optional[dict] = None) -> List[dict]:
+        return self.search_batch(namespace, [query], top_k, filter)[0]
+
+    def search_batch(
+        self, namespace: str, queries: List[str], top_k: int = 5, filter: Optional[dict] = None
+    ) -> List[List[dict]]:
+        """Top-k search for many queries with one embedding call and shared matrix passes."""
+        vectors = self.embedder.embed(queries)
+        ns = self._namespace(namespace)
+        with ns.lock:
+            results = ns.search(vectors, top_k, self.use_ivf, filter)
+            return [
+                [
+                    {
+                        "_id": ns.records[row]["_id"],
+                        "_score": score,
+                        "fields": {k: v for k, v in ns.records[row].items() if k != "_id"},
+                    }
+                    for score, row in hits
+                ]
+                for hits in results
+            ]
+
+
+def get_vector_store() -> VectorStore:
+    """
+    Process-wide vector store for the backend selected by VECTOR_STORE_BACKEND.
+    Created once, so index checks and HTTP connection pools are reused across calls.
+    """
+    factory = LocalVectorStore if VECTOR_STORE_BACKEND == "local" else PineconeVectorStore
+    return get_client(f"vector-store:{VECTOR_STORE_BACKEND}", factory)
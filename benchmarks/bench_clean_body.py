@@ -0,0 +1,84 @@
+"""
+Throughput benchmark for `clean_email_body`.
+
+    python -m benchmarks.bench_clean_body --size 2000 --html-share 0.5 [--json out.json]
+
+Reports MB/s and emails/s for the current cleaner and, when BeautifulSoup is
+installed, for the previous BeautifulSoup-based implementation as a baseline.
+"""
+import argparse
+import json
+import re
+import time
+
+from app.body_cleaner import clean_email_body
+from benchmarks.corpus import build_corpus
+
+
+def legacy_clean_email_body(body: str) -> str:
+    """The pre-rewrite cleaner, kept here only as a benchmark baseline."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body, "html.parser")
+    body = soup.get_text()
+    body = re.sub(r'https?://\S+', '', body)
+    body = re.sub(r'(?i)(logo|icon|image|powered by|view in browser|calendar)', '', body)
+    body = re.sub(r'[-=]{2,}', '', body)
+    body = body.replace('\r', '').replace('\n', '\n').replace('\xa0', ' ')
+    body = re.sub(r'\n{3,}', '\n\n', body)
+    for kw in ['Manage notifications', 'Privacy policy', 'Contact us', 'Copyright']:
+        body = body.split(kw)[0]
+    return body.strip()
+
+
+def run(cleaner, corpus, repeat: int) -> dict:
+    total_bytes = sum(len(body.encode("utf-8")) for body in corpus)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in corpus:
+            cleaner(body)
+        best = min(best, time.perf_counter() - start)
+    return {
+        "seconds": best,
+        "mb_per_s": total_bytes / best / 1e6,
+        "emails_per_s": len(corpus) / best,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--html-share", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size, args.html_share, args.seed)
+    results = {
+        "corpus": {
+            "emails": len(corpus),
+            "html_share": args.html_share,
+            "megabytes": sum(len(b.encode("utf-8")) for b in corpus) / 1e6,
+        },
+        "clean_email_body": run(clean_email_body, corpus, args.repeat),
+    }
+    try:
+        results["legacy_bs4"] = run(legacy_clean_email_body, corpus, args.repeat)
+    except ImportError:
+        pass
+
+    for name, stats in results.items():
+        if name == "corpus":
+            print(f"corpus: {stats['emails']} emails, {stats['megabytes']:.1f} MB, html_share={stats['html_share']}")
+        else:
+            print(f"{name:>18}: {stats['mb_per_s']:8.1f} MB/s  {stats['emails_per_s']:10.0f} emails/s")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
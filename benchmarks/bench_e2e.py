@@ -0,0 +1,361 @@
+"""
+Offline end-to-end benchmark: sync, ingest and query against local stand-ins.
+
+    python -m benchmarks.bench_e2e --size 500 --html-share 0.4 --attachment-share 0.1 \
+        --imap-latency 0.005 --llm-latency 0.5 --vector-latency 0.02 --json run.json
+
+A synthetic mailbox is served by `benchmarks.imap_server.LocalIMAPServer` over
+plain IMAP on localhost; Gemini and the vector store are replaced by the fakes
+in `benchmarks.fakes`. Every scenario reports throughput, p50 / p99 latency and
+peak memory, and `--json` writes all results (plus the run's settings) for
+comparing runs. All state (sync state, caches, attachments) lives in a fresh
+work directory, so runs do not affect each other or the app's own data.
+
+Scenarios (later ones build on earlier ones, so they always run in this order):
+    sync    stream_mail over the whole mailbox, then an incremental re-sync
+    ingest  download every PDF / DOCX attachment, ingest, then a no-op re-ingest
+    query   blocking query_vector_db and streaming answers over the ingested files
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.corpus import WORDS
+from benchmarks.imap_server import LocalIMAPServer, Mailbox, plain_imap_client
+from benchmarks.mailbox import build_mailbox
+
+SCENARIOS = ("sync", "ingest", "query")
+EMAIL_HOST = "imap.local.test"
+EMAIL_USER = "bench@corp.example"
+EMAIL_PASS = "bench-password"
+
+
+def latency_stats(samples: List[float]) -> dict:
+    """p50 / p99 / mean / max of a list of seconds (nearest-rank percentiles)."""
+    if not samples:
+        return {"count": 0, "p50": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(samples)
+
+    def _rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": _rank(50),
+        "p99": _rank(99),
+        "mean": sum(ordered) / len(ordered),
+        "max": ordered[-1],
+    }
+
+
+@contextmanager
+def measured(result: dict, trace_memory: bool):
+    """Fills `result` with wall-clock seconds and peak traced Python memory (MB)."""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        result["seconds"] = time.perf_counter() - start
+        if trace_memory:
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+
+
+@contextmanager
+def local_imap(messages: List[dict], latency: float):
+    import imaplib
+
+    mailbox = Mailbox(uidvalidity=1)
+    for message in messages:
+        mailbox.append(message["raw"], message["date"])
+    with LocalIMAPServer({"INBOX": mailbox}, latency=latency) as server:
+        # The app always connects with IMAP4_SSL; point it at the plain local server
+        original = imaplib.IMAP4_SSL
+        imaplib.IMAP4_SSL = plain_imap_client(server.port)
+        try:
+            yield server
+        finally:
+            imaplib.IMAP4_SSL = original
+
+
+def run_sync(messages: List[dict], args) -> dict:
+    from app.email_handler import stream_mail
+    from app.task_extractor import extraction_stats
+    from app.triage import triage_stats
+
+    first, last = messages[0]["date"], messages[-1]["date"]
+    from_date = first.strftime("%d-%b-%Y")
+    to_date = (last + timedelta(days=1)).strftime("%d-%b-%Y")
+    calls_before = dict(extraction_stats)
+    skipped_before = triage_stats["skipped"]
+
+    result = {}
+    gaps = []
+    emails = 0
+    with measured(result, args.trace_memory):
+        start = previous = time.perf_counter()
+        for res in stream_mail(from_date, to_date, EMAIL_HOST, EMAIL_USER, EMAIL_PASS):
+            if "error" in res:
+                raise RuntimeError(res["error"])
+            now = time.perf_counter()
+            if not emails:
+                result["first_result_s"] = now - start
+            gaps.append(now - previous)
+            previous = now
+            emails += 1
+
+    result.update({
+        "emails": emails,
+        "emails_per_s": emails / result["seconds"] if result["seconds"] else None,
+        "latency_between_results": latency_stats(gaps),
+        "llm_calls": extraction_stats["llm_calls"] - calls_before["llm_calls"],
+        "prompt_tokens": extraction_stats["prompt_tokens"] - calls_before["prompt_tokens"],
+        "triage_skipped": triage_stats["skipped"] - skipped_before,
+    })
+
+    resync = {}
+    with measured(resync, False):
+        resync["emails"] = sum(
+            1 for _ in stream_mail(from_date, to_date, EMAIL_HOST, EMAIL_USER, EMAIL_PASS, since_last_sync=True)
+        )
+    result["resync"] = resync
+    return result
+
+
+def run_ingest(args) -> dict:
+    from app.attachment_rag import SUPPORTED_EXTENSIONS, ingest_files_to_vector_db
+    from app.email_handler import download_attachment
+    from app.sync_state import get_sync_state_store
+
+    attachments = [
+        a for a in get_sync_state_store().list_attachments(EMAIL_HOST, EMAIL_USER)
+        if a["filename"].lower().endswith(SUPPORTED_EXTENSIONS)
+    ]
+    result = {"attachments": len(attachments)}
+
+    download = {}
+    latencies = []
+    downloaded_bytes = 0
+    with measured(download, args.trace_memory):
+        for attachment in attachments:
+            start = time.perf_counter()
+            path = download_attachment(EMAIL_HOST, EMAIL_USER, EMAIL_PASS, attachment)
+            latencies.append(time.perf_counter() - start)
+            downloaded_bytes += os.path.getsize(path)
+    download["mb_per_s"] = downloaded_bytes / 1e6 / download["seconds"] if download["seconds"] else None
+    download["latency"] = latency_stats(latencies)
+    result["download"] = download
+
+    folder = f"attachments/{EMAIL_USER}"
+    ingest = {}
+    with measured(ingest, args.trace_memory):
+        outcome = ingest_files_to_vector_db(folder)
+    if outcome["status"] != "success":
+        raise RuntimeError(f"Ingestion failed: {outcome['error_message']}")
+    ingest.update({
+        "files": len(outcome["ingested_files"]),
+        "chunks": outcome["total_chunks"],
+        "chunks_per_s": outcome["total_chunks"] / ingest["seconds"] if ingest["seconds"] else None,
+        "stages": outcome.get("stats"),
+    })
+    result["ingest"] = ingest
+
+    reingest = {}
+    with measured(reingest, False):
+        ingest_files_to_vector_db(folder)
+    result["reingest_noop"] = reingest
+    return result
+
+
+def run_query(args) -> dict:
+    import random
+
+    from app.attachment_rag import answer_cache, invalidate_rag_cache, query_vector_db, stream_vector_db_answer
+
+    rng = random.Random(args.seed)
+    queries = [
+        f"What does the document say about {rng.choice(WORDS)} and {rng.choice(WORDS)} {i}?"
+        for i in range(args.queries)
+    ]
+    invalidate_rag_cache()
+    answer_cache.clear()
+
+    blocking = {}
+    latencies = []
+    with measured(blocking, args.trace_memory):
+        for query in queries:
+            start = time.perf_counter()
+            outcome = query_vector_db(query, email_user=EMAIL_USER)
+            if outcome["status"] == "error":
+                raise RuntimeError(outcome["error_message"])
+            latencies.append(time.perf_counter() - start)
+    blocking["queries_per_s"] = len(queries) / blocking["seconds"] if blocking["seconds"] else None
+    blocking["latency"] = latency_stats(latencies)
+
+    invalidate_rag_cache()
+    answer_cache.clear()
+    streaming = {}
+    first_tokens, totals = [], []
+    with measured(streaming, args.trace_memory):
+        for query in queries:
+            outcome = stream_vector_db_answer(query, email_user=EMAIL_USER)
+            if outcome["status"] != "success":
+                continue
+            for _ in outcome["answer_stream"]:
+                pass
+            first_tokens.append(outcome["timings"]["first_token_s"])
+            totals.append(outcome["timings"]["total_s"])
+    streaming["time_to_first_token"] = latency_stats(first_tokens)
+    streaming["latency"] = latency_stats(totals)
+    return {"queries": len(queries), "blocking": blocking, "streaming": streaming}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _print_summary(results: Dict[str, dict]):
+    def ms(value):
+        return f"{value * 1000:8.1f} ms" if value is not None else "     n/a"
+
+    sync = results.get("sync")
+    if sync:
+        gaps = sync["latency_between_results"]
+        print(
+            f"sync   : {sync['emails']} emails in {sync['seconds']:.2f}s ({sync['emails_per_s']:.1f}/s), "
+            f"first result {ms(sync.get('first_result_s'))}, gap p50 {ms(gaps['p50'])} p99 {ms(gaps['p99'])}, "
+            f"{sync['llm_calls']} LLM calls, {sync['triage_skipped']} skipped by triage, "
+            f"re-sync {sync['resync']['seconds']:.2f}s"
+        )
+    ingest = results.get("ingest")
+    if ingest:
+        print(
+            f"ingest : {ingest['attachments']} attachments downloaded in {ingest['download']['seconds']:.2f}s, "
+            f"{ingest['ingest']['chunks']} chunks ingested in {ingest['ingest']['seconds']:.2f}s, "
+            f"no-op re-ingest {ingest['reingest_noop']['seconds'] * 1000:.1f} ms"
+        )
+    query = results.get("query")
+    if query:
+        print(
+            f"query  : blocking p50 {ms(query['blocking']['latency']['p50'])} p99 {ms(query['blocking']['latency']['p99'])}, "
+            f"streaming first token p50 {ms(query['streaming']['time_to_first_token']['p50'])} "
+            f"total p50 {ms(query['streaming']['latency']['p50'])}"
+        )
+    for name, stats in results.items():
+        peaks = [v["peak_mb"] for v in [stats, *stats.values()] if isinstance(v, dict) and "peak_mb" in v]
+        if peaks:
+            print(f"{name:<7}: peak traced memory {max(peaks):.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of sync,ingest,query")
+    parser.add_argument("--size", type=int, default=500, help="messages in the synthetic mailbox")
+    parser.add_argument("--html-share", type=float, default=0.4)
+    parser.add_argument("--attachment-share", type=float, default=0.1)
+    parser.add_argument("--attachment-kinds", default="pdf,docx", help="comma-separated: pdf,docx,bin")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--imap-latency", type=float, default=0.005, help="seconds added to every IMAP command")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per extraction call")
+    parser.add_argument("--first-token-latency", type=float, default=0.4, help="seconds to the first answer token")
+    parser.add_argument("--chunk-interval", type=float, default=0.05, help="seconds between streamed answer pieces")
+    parser.add_argument("--vector-latency", type=float, default=0.02, help="seconds per vector store call")
+    parser.add_argument("--vector-store", choices=("fake", "local"), default="fake")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="skip tracemalloc (faster, reports only max RSS)")
+    parser.add_argument("--workdir", help="keep state here instead of a fresh temporary directory")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args()
+
+    wanted = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    # Later scenarios need the state earlier ones create
+    last = max(SCENARIOS.index(s) for s in wanted)
+    scenarios = SCENARIOS[:last + 1]
+
+    json_path = Path(args.json_path).resolve() if args.json_path else None
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="opspilot-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+    # Settings are read at import time, so they go in before any app module is imported
+    os.environ["SYNC_STATE_PATH"] = str(workdir / "sync_state.sqlite3")
+    os.environ["EXTRACTION_CACHE_PATH"] = str(workdir / "extraction_cache.sqlite3")
+    os.environ["LOCAL_VECTOR_DIR"] = str(workdir / "vector_store")
+    os.environ["VECTOR_STORE_BACKEND"] = "local" if args.vector_store == "local" else "pinecone"
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+    os.environ.setdefault("GEMINI_BURST", "1000000")
+
+    from benchmarks.fakes import install_fakes
+
+    install_fakes(
+        llm_latency=args.llm_latency,
+        first_token_latency=args.first_token_latency,
+        chunk_interval=args.chunk_interval,
+        vector_latency=args.vector_latency,
+        fake_vector_store=args.vector_store == "fake",
+    )
+
+    messages = build_mailbox(
+        size=args.size,
+        html_share=args.html_share,
+        attachment_share=args.attachment_share,
+        attachment_kinds=tuple(k.strip() for k in args.attachment_kinds.split(",")),
+        seed=args.seed,
+    )
+    results = {}
+    with local_imap(messages, args.imap_latency):
+        if "sync" in scenarios:
+            results["sync"] = run_sync(messages, args)
+        if "ingest" in scenarios:
+            results["ingest"] = run_ingest(args)
+        if "query" in scenarios:
+            results["query"] = run_query(args)
+
+    from app.tracing import diagnostics
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workdir": str(workdir),
+            # ru_maxrss is KB on Linux
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "args": vars(args),
+        },
+        "results": {name: results[name] for name in scenarios if name in wanted},
+        # Per-stage timings, token / cost estimates and cache hit rates over the whole run
+        "diagnostics": diagnostics(),
+    }
+    _print_summary(report["results"])
+    print(f"max RSS {report['meta']['max_rss_mb']:.1f} MB")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
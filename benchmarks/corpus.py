@@ -0,0 +1,69 @@
+"""
+Synthetic email body corpus for benchmarks.
+
+Bodies are generated from a fixed seed so runs are comparable: short plain-text
+notifications, medium plain-text mails and large HTML newsletters full of
+links, images, tracking pixels and footer boilerplate.
+"""
+import random
+from typing import List
+
+WORDS = (
+    "meeting project deadline review report invoice team update schedule please "
+    "confirm attached document submit assignment reminder account security order "
+    "shipment tomorrow friday week quarter budget draft feedback call agenda notes"
+).split()
+
+FOOTER = (
+    "Manage notifications | Privacy policy | Contact us\n"
+    "Copyright 2025 Example Corp. All rights reserved."
+)
+
+
+def _sentence(rng: random.Random, n: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def plain_body(rng: random.Random, paragraphs: int) -> str:
+    parts = []
+    for _ in range(paragraphs):
+        parts.append(" ".join(_sentence(rng) for _ in range(rng.randint(2, 5))))
+        if rng.random() < 0.3:
+            parts.append(f"See https://example.com/{rng.randint(1, 10**6)}?utm_source=mail")
+    parts.append("--\n" + FOOTER)
+    return "\r\n\r\n".join(parts)
+
+
+def html_body(rng: random.Random, blocks: int) -> str:
+    rows = []
+    for i in range(blocks):
+        rows.append(
+            "<tr><td style=\"padding:12px;font-family:Arial\">"
+            f"<img src=\"https://cdn.example.com/img/{i}.png\" alt=\"logo\">"
+            f"<h2>{_sentence(rng, 5)}</h2>"
+            f"<p>{_sentence(rng)} {_sentence(rng)}&nbsp;&amp; more</p>"
+            f"<a href=\"https://example.com/track/{rng.randint(1, 10**9)}\">View in browser</a>"
+            "</td></tr>"
+        )
+    return (
+        "<!DOCTYPE html><html><head><title>Newsletter</title>"
+        "<style>td{color:#333}.x{display:none}</style></head><body>"
+        "<table width=\"600\">" + "".join(rows) + "</table>"
+        "<!-- tracking --><img src=\"https://t.example.com/pixel.gif\" width=\"1\">"
+        f"<p>{FOOTER}</p></body></html>"
+    )
+
+
+def build_corpus(size: int = 1000, html_share: float = 0.5, seed: int = 42) -> List[str]:
+    """
+    Returns `size` bodies, `html_share` of them HTML newsletters (5-200 blocks)
+    and the rest plain-text mails (1-15 paragraphs).
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        if rng.random() < html_share:
+            corpus.append(html_body(rng, rng.randint(5, 200)))
+        else:
+            corpus.append(plain_body(rng, rng.randint(1, 15)))
+    return corpus
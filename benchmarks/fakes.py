@@ -0,0 +1,139 @@
+"""
+Stand-ins for Gemini and the vector store with configurable latency.
+
+`install_fakes` registers them in the client registry (`app.clients.set_client`)
+under the names the app looks up, so `process_mail`, `ingest_files_to_vector_db`
+and `query_vector_db` run unchanged without network access or API keys.
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from app.vector_store import VectorStore, matches_filter
+
+_WORD_RE = re.compile(r"\w+")
+FAKE_EXTRACTION = "To-Do Task: None  \nImportant Information: None"
+
+
+class FakeTaskChain:
+    """`prompt | llm` chain stand-in: answers single and packed extraction prompts."""
+
+    def __init__(self, latency: float = 0.5):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, input_prompt: dict):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if "emails" in input_prompt:
+            ids = [json.loads(line)["id"] for line in input_prompt["emails"].splitlines() if line]
+            content = json.dumps([{"id": i, "todo": None, "important_info": None} for i in ids])
+        else:
+            content = FAKE_EXTRACTION
+        return SimpleNamespace(content=content)
+
+
+class FakeGenerativeModel:
+    """
+    `google.generativeai.GenerativeModel` stand-in. The first piece arrives after
+    `first_token_latency`, then `chunks` more every `chunk_interval` seconds.
+    """
+
+    def __init__(self, first_token_latency: float = 0.4, chunk_interval: float = 0.05, chunks: int = 20):
+        self.first_token_latency = first_token_latency
+        self.chunk_interval = chunk_interval
+        self.chunks = chunks
+
+    def _pieces(self):
+        time.sleep(self.first_token_latency)
+        yield "Based on the documents, "
+        for i in range(self.chunks):
+            time.sleep(self.chunk_interval)
+            yield f"point {i} of the answer. "
+
+    def generate_content(self, contents, stream: bool = False):
+        pieces = (SimpleNamespace(text=text) for text in self._pieces())
+        if stream:
+            return pieces
+        text = "".join(p.text for p in pieces)
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class FakeVectorStore(VectorStore):
+    """
+    In-memory vector store: bag-of-words overlap scoring, metadata filters, and a
+    fixed delay per upsert / delete / search call to mimic a hosted index.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self._namespaces: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, namespace: str, records: List[dict]):
+        time.sleep(self.latency)
+        with self._lock:
+            ns = self._namespaces.setdefault(namespace, {})
+            for record in records:
+                ns[record["_id"]] = {**record, "_words": Counter(_WORD_RE.findall(record["chunk_text"].lower()))}
+
+    def delete(self, namespace: str, ids: List[str]):
+        time.sleep(self.latency)
+        with self._lock:
+            ns = self._namespaces.get(namespace, {})
+            for _id in ids:
+                ns.pop(_id, None)
+
+    def search(self, namespace: str, query: str, top_k: int = 5, filter: Optional[dict] = None) -> List[dict]:
+        time.sleep(self.latency)
+        words = set(_WORD_RE.findall(query.lower()))
+        with self._lock:
+            records = list(self._namespaces.get(namespace, {}).values())
+        scored = []
+        for record in records:
+            fields = {k: v for k, v in record.items() if k not in ("_id", "_words")}
+            if not matches_filter(fields, filter):
+                continue
+            score = sum(record["_words"][w] for w in words) / (1 + sum(record["_words"].values()))
+            scored.append((score, record["_id"], fields))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [{"_id": _id, "_score": score, "fields": fields} for score, _id, fields in scored[:top_k]]
+
+    def __len__(self) -> int:
+        return sum(len(ns) for ns in self._namespaces.values())
+
+
+def install_fakes(
+    llm_latency: float = 0.5,
+    first_token_latency: float = 0.4,
+    chunk_interval: float = 0.05,
+    vector_latency: float = 0.02,
+    fake_vector_store: bool = True,
+) -> dict:
+    """
+    Registers the fakes before the app creates its real clients. With
+    `fake_vector_store=False` the configured backend (e.g. the local store) is used.
+    """
+    from app.clients import GEMINI_MODEL_NAME, set_client
+    from app.vector_store import VECTOR_STORE_BACKEND
+
+    fakes = {
+        "task_chain": FakeTaskChain(llm_latency),
+        "genai_model": FakeGenerativeModel(first_token_latency, chunk_interval),
+    }
+    set_client("task-chain", fakes["task_chain"])
+    set_client("batch-task-chain", fakes["task_chain"])
+    set_client(f"genai-model:{GEMINI_MODEL_NAME}", fakes["genai_model"])
+    if fake_vector_store:
+        fakes["vector_store"] = FakeVectorStore(vector_latency)
+        set_client(f"vector-store:{VECTOR_STORE_BACKEND}", fakes["vector_store"])
+    return fakes
@@ -0,0 +1,350 @@
+"""
+Local IMAP server stand-in for benchmarks.
+
+Speaks the subset of IMAP4rev1 that the app uses, over a real TCP socket, so
+`imaplib` and the fetch / parse code run exactly as they do against Gmail:
+
+    CAPABILITY, LOGIN, SELECT / EXAMINE, STATUS, LIST, NOOP, LOGOUT,
+    UID SEARCH  (ALL, UID <set>, ON / SINCE / BEFORE <date>),
+    UID FETCH   (UID, FLAGS, INTERNALDATE, RFC822, RFC822.SIZE, BODYSTRUCTURE,
+                 BODY[.PEEK][HEADER | HEADER.FIELDS (...) | <part>]<offset.length>)
+
+`latency` adds a fixed delay to every command to mimic a network round-trip.
+The app connects with `IMAP4_SSL`; `plain_imap_client(port)` returns a drop-in
+replacement that talks plain IMAP to this server.
+"""
+import imaplib
+import re
+import socketserver
+import threading
+import time
+from datetime import datetime
+from email import message_from_bytes
+from email.message import Message
+from email.policy import compat32
+from typing import Dict, List, Optional
+
+_TOKEN_RE = re.compile(rb'"((?:\\.|[^"\\])*)"|(\([^)]*\))|(\S+)')
+_FETCH_ITEM_RE = re.compile(r"[A-Z0-9.]+(?:\[[^\]]*\])?(?:<\d+(?:\.\d+)?>)?", re.I)
+_SECTION_RE = re.compile(r"^BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)(?:\.(\d+))?>)?$", re.I)
+_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def _quote(value: Optional[str]) -> str:
+    if value is None:
+        return "NIL"
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _param_list(pairs) -> str:
+    if not pairs:
+        return "NIL"
+    return "(" + " ".join(f"{_quote(k.upper())} {_quote(str(v))}" for k, v in pairs) + ")"
+
+
+def _encoded_payload(part: Message) -> bytes:
+    payload = part.get_payload(decode=False)
+    if isinstance(payload, bytes):
+        return payload
+    return (payload or "").encode("ascii", "surrogateescape")
+
+
+def _bodystructure(part: Message) -> str:
+    if part.is_multipart():
+        children = "".join(_bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+    payload = _encoded_payload(part)
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        _param_list(part.get_params()[1:] if part.get_params() else None),
+        "NIL",
+        "NIL",
+        _quote(str(part.get("Content-Transfer-Encoding", "7bit")).upper()),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    disposition = part.get_content_disposition()
+    if disposition:
+        params = part.get_params(header="content-disposition") or []
+        fields += ["NIL", f"({_quote(disposition.upper())} {_param_list(params[1:])})"]
+    return "(" + " ".join(fields) + ")"
+
+
+class StoredMessage:
+    def __init__(self, uid: int, raw: bytes, date: datetime):
+        self.uid = uid
+        self.raw = raw
+        self.date = date
+        self._msg = None
+        self._structure = None
+
+    @property
+    def msg(self) -> Message:
+        if self._msg is None:
+            self._msg = message_from_bytes(self.raw, policy=compat32)
+        return self._msg
+
+    @property
+    def header(self) -> bytes:
+        head, sep, _ = self.raw.partition(b"\n\n")
+        return head + sep
+
+    def bodystructure(self) -> str:
+        if self._structure is None:
+            self._structure = _bodystructure(self.msg)
+        return self._structure
+
+    def section(self, spec: str) -> bytes:
+        spec = spec.upper()
+        if spec == "":
+            return self.raw
+        if spec == "HEADER":
+            return self.header
+        if spec.startswith("HEADER.FIELDS"):
+            wanted = set(re.findall(r"[\w-]+", spec.split("(", 1)[1]))
+            lines = [
+                f"{name}: {value}\r\n"
+                for name, value in self.msg.items() if name.upper() in wanted
+            ]
+            return ("".join(lines) + "\r\n").encode("utf-8", "surrogateescape")
+        part = self.msg
+        for index in spec.split("."):
+            if part.is_multipart():
+                part = part.get_payload()[int(index) - 1]
+            elif index != "1":
+                return b""
+        if part.is_multipart():
+            return part.as_bytes().partition(b"\n\n")[2]
+        return _encoded_payload(part)
+
+
+class Mailbox:
+    def __init__(self, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.messages: List[StoredMessage] = []
+        self.lock = threading.Lock()
+
+    @property
+    def uidnext(self) -> int:
+        return (self.messages[-1].uid if self.messages else 0) + 1
+
+    def append(self, raw: bytes, date: datetime) -> int:
+        with self.lock:
+            uid = self.uidnext
+            self.messages.append(StoredMessage(uid, raw, date))
+            return uid
+
+    def resolve(self, message_set: str) -> List[StoredMessage]:
+        """Messages in an IMAP UID set ("1:3,7", "5:*"); `n:*` always includes the highest UID."""
+        if not self.messages:
+            return []
+        highest = self.messages[-1].uid
+        uids = set()
+        ranges = []
+        for piece in message_set.split(","):
+            lo, _, hi = piece.partition(":")
+            lo = highest if lo == "*" else int(lo)
+            hi = lo if not hi else highest if hi == "*" else int(hi)
+            ranges.append((min(lo, hi), max(lo, hi)))
+        for m in self.messages:
+            if any(lo <= m.uid <= hi for lo, hi in ranges):
+                uids.add(m.uid)
+        return [m for m in self.messages if m.uid in uids]
+
+
+def _parse_date(value: str):
+    day, month, year = value.split("-")
+    return datetime(int(year), _MONTHS.index(month.capitalize()) + 1, int(day)).date()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "LocalIMAPServer"
+
+    def send(self, line: str):
+        self.wfile.write(line.encode("utf-8") + b"\r\n")
+
+    def handle(self):
+        self.selected: Optional[Mailbox] = None
+        self.send("* OK [CAPABILITY IMAP4rev1] Local IMAP stand-in ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.rstrip(b"\r\n").split(b" ", 2)
+            if len(parts) < 2:
+                continue
+            tag = parts[0].decode()
+            command = parts[1].decode().upper()
+            args = parts[2] if len(parts) > 2 else b""
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            try:
+                if self.dispatch(tag, command, args) is False:
+                    return
+            except Exception as e:
+                self.send(f"{tag} BAD {e}")
+            self.wfile.flush()
+
+    def dispatch(self, tag: str, command: str, args: bytes):
+        tokens = [
+            re.sub(rb"\\(.)", rb"\1", m.group(1)).decode("utf-8") if m.lastindex == 1
+            else m.group(m.lastindex).decode("utf-8")
+            for m in _TOKEN_RE.finditer(args)
+        ]
+        if command == "CAPABILITY":
+            self.send("* CAPABILITY IMAP4rev1")
+        elif command == "NOOP":
+            pass
+        elif command == "LOGOUT":
+            self.send("* BYE logging out")
+            self.send(f"{tag} OK LOGOUT completed")
+            return False
+        elif command == "LOGIN":
+            expected = self.server.users.get(tokens[0]) if self.server.users else tokens[1]
+            if expected != tokens[1]:
+                self.send(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials")
+                return
+        elif command == "LIST":
+            for name in self.server.mailboxes:
+                self.send(f'* LIST (\\HasNoChildren) "/" {_quote(name)}')
+        elif command in ("SELECT", "EXAMINE"):
+            mailbox = self.server.mailboxes.get(tokens[0])
+            if mailbox is None:
+                self.send(f"{tag} NO Mailbox does not exist")
+                return
+            self.selected = mailbox
+            self.send(f"* {len(mailbox.messages)} EXISTS")
+            self.send("* 0 RECENT")
+            self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+            self.send(f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID")
+            mode = "READ-ONLY" if command == "EXAMINE" else "READ-WRITE"
+            self.send(f"{tag} OK [{mode}] {command} completed")
+            return
+        elif command == "STATUS":
+            mailbox = self.server.mailboxes[tokens[0]]
+            self.send(
+                f"* STATUS {_quote(tokens[0])} (MESSAGES {len(mailbox.messages)} "
+                f"UIDNEXT {mailbox.uidnext} UIDVALIDITY {mailbox.uidvalidity})"
+            )
+        elif command == "UID":
+            sub, _, rest = args.partition(b" ")
+            sub = sub.decode().upper()
+            if sub == "SEARCH":
+                self.uid_search(rest.decode())
+            elif sub == "FETCH":
+                message_set, _, items = rest.decode().partition(" ")
+                self.uid_fetch(message_set, items)
+            else:
+                self.send(f"{tag} BAD Unsupported UID command")
+                return
+        else:
+            self.send(f"{tag} BAD Unsupported command")
+            return
+        self.send(f"{tag} OK {command} completed")
+
+    def uid_search(self, criteria: str):
+        tokens = criteria.replace("(", " ").replace(")", " ").split()
+        matches = list(self.selected.messages)
+        i = 0
+        while i < len(tokens):
+            key = tokens[i].upper()
+            if key == "ALL":
+                i += 1
+                continue
+            value = tokens[i + 1]
+            if key == "UID":
+                allowed = {m.uid for m in self.selected.resolve(value)}
+                matches = [m for m in matches if m.uid in allowed]
+            elif key in ("ON", "SINCE", "BEFORE"):
+                day = _parse_date(value)
+                compare = {
+                    "ON": lambda d: d == day,
+                    "SINCE": lambda d: d >= day,
+                    "BEFORE": lambda d: d < day,
+                }[key]
+                matches = [m for m in matches if compare(m.date.date())]
+            else:
+                raise ValueError(f"Unsupported search key {key}")
+            i += 2
+        self.send("* SEARCH" + "".join(f" {m.uid}" for m in matches))
+
+    def uid_fetch(self, message_set: str, items: str):
+        names = [n.upper() for n in _FETCH_ITEM_RE.findall(items)]
+        if "UID" not in names:
+            names.insert(0, "UID")
+        wanted = {m.uid for m in self.selected.resolve(message_set)}
+        for seq, m in enumerate(self.selected.messages, start=1):
+            if m.uid not in wanted:
+                continue
+            out = [f"* {seq} FETCH (".encode()]
+            for n, name in enumerate(names):
+                prefix = b" " if n else b""
+                if name == "UID":
+                    out.append(prefix + f"UID {m.uid}".encode())
+                elif name == "FLAGS":
+                    out.append(prefix + b"FLAGS (\\Seen)")
+                elif name == "INTERNALDATE":
+                    out.append(prefix + m.date.strftime('INTERNALDATE "%d-%b-%Y %H:%M:%S +0000"').encode())
+                elif name == "RFC822.SIZE":
+                    out.append(prefix + f"RFC822.SIZE {len(m.raw)}".encode())
+                elif name == "BODYSTRUCTURE":
+                    out.append(prefix + b"BODYSTRUCTURE " + m.bodystructure().encode("utf-8"))
+                elif name == "RFC822":
+                    out.append(prefix + f"RFC822 {{{len(m.raw)}}}\r\n".encode() + m.raw)
+                else:
+                    match = _SECTION_RE.match(name)
+                    if not match:
+                        raise ValueError(f"Unsupported fetch item {name}")
+                    spec, offset, length = match.groups()
+                    data = m.section(spec)
+                    label = f"BODY[{spec}]"
+                    if offset is not None:
+                        start = int(offset)
+                        data = data[start:start + int(length)] if length else data[start:]
+                        label += f"<{start}>"
+                    out.append(prefix + f"{label} {{{len(data)}}}\r\n".encode() + data)
+            out.append(b")\r\n")
+            self.wfile.write(b"".join(out))
+
+
+class LocalIMAPServer(socketserver.ThreadingTCPServer):
+    """
+    In-process IMAP server on 127.0.0.1 (random port by default) serving the
+    given mailboxes. Use as a context manager; `port` holds the bound port.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        mailboxes: Optional[Dict[str, Mailbox]] = None,
+        users: Optional[Dict[str, str]] = None,
+        latency: float = 0.0,
+        port: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.mailboxes = mailboxes if mailboxes is not None else {"INBOX": Mailbox()}
+        self.users = users or {}
+        self.latency = latency
+        self.port = self.server_address[1]
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def plain_imap_client(port: int):
+    """Factory with IMAP4_SSL's signature that connects to the local server without TLS."""
+    def _connect(host: str = "", *args, **kwargs):
+        return imaplib.IMAP4("127.0.0.1", port)
+
+    return _connect
@@ -0,0 +1,105 @@
+"""
+Synthetic mailbox for the end-to-end benchmarks.
+
+Messages are built from a fixed seed, like `corpus.py`: a mix of plain-text
+mails, HTML newsletters (sent as multipart/alternative with a bulk-mail
+List-Unsubscribe header) and mails with PDF / DOCX attachments. Every message
+is returned as raw RFC 822 bytes plus its internal date, ready to be served by
+`benchmarks.imap_server.LocalIMAPServer`.
+"""
+import io
+import random
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+from typing import Dict, List, Tuple
+
+from benchmarks.corpus import WORDS, _sentence, html_body, plain_body
+
+SENDERS = ["alice@corp.example", "bob@university.example", "it-support@corp.example", "hr@corp.example"]
+BULK_SENDERS = ["news@news.shop.example", "noreply@deals.example"]
+
+
+def _pdf_bytes(rng: random.Random, pages: int) -> bytes:
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        text = "\n".join(_sentence(rng, 14) for _ in range(40))
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _docx_bytes(rng: random.Random, paragraphs: int) -> bytes:
+    import docx
+
+    document = docx.Document()
+    for _ in range(paragraphs):
+        document.add_paragraph(" ".join(_sentence(rng) for _ in range(4)))
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def _attachment(rng: random.Random, kinds: List[str], pages: int) -> Tuple[str, str, bytes]:
+    kind = rng.choice(kinds)
+    name = f"{rng.choice(WORDS)}-{rng.choice(WORDS)}-{rng.randint(1, 999)}"
+    if kind == "pdf":
+        return f"{name}.pdf", "application/pdf", _pdf_bytes(rng, rng.randint(1, pages))
+    if kind == "docx":
+        return (
+            f"{name}.docx",
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            _docx_bytes(rng, rng.randint(5, 10 * pages)),
+        )
+    return f"{name}.bin", "application/octet-stream", rng.randbytes(rng.randint(10, 200) * 1024)
+
+
+def build_mailbox(
+    size: int = 500,
+    html_share: float = 0.4,
+    attachment_share: float = 0.1,
+    attachment_kinds: Tuple[str, ...] = ("pdf", "docx"),
+    max_attachment_pages: int = 5,
+    start: datetime = datetime(2025, 1, 6, 8, 0, tzinfo=timezone.utc),
+    days: int = 5,
+    seed: int = 42,
+) -> List[Dict]:
+    """
+    Returns `size` messages as {"raw": bytes, "date": datetime}, spread over `days`
+    days from `start`. `html_share` of them are newsletters and `attachment_share`
+    carry one or two attachments of `attachment_kinds` ("pdf", "docx", "bin").
+    """
+    rng = random.Random(seed)
+    step = timedelta(days=days) / max(size, 1)
+    messages = []
+    for i in range(size):
+        date = start + step * i
+        msg = EmailMessage()
+        msg["Message-ID"] = f"<bench-{seed}-{i}@mail.example>"
+        msg["Date"] = format_datetime(date)
+        msg["To"] = "me@corp.example"
+
+        if rng.random() < html_share:
+            msg["From"] = f"Shop <{rng.choice(BULK_SENDERS)}>"
+            msg["Subject"] = f"{rng.randint(10, 70)}% off: {_sentence(rng, 4)}"
+            msg["List-Unsubscribe"] = "<mailto:unsubscribe@shop.example>"
+            msg["Precedence"] = "bulk"
+            msg.set_content("View this email in your browser. Shop now, free shipping.")
+            msg.add_alternative(html_body(rng, rng.randint(5, 60)), subtype="html")
+        else:
+            msg["From"] = rng.choice(SENDERS)
+            msg["Subject"] = _sentence(rng, 6)
+            msg.set_content(plain_body(rng, rng.randint(1, 10)).replace("\r\n", "\n"))
+
+        if rng.random() < attachment_share:
+            for _ in range(rng.randint(1, 2)):
+                filename, mime_type, data = _attachment(rng, list(attachment_kinds), max_attachment_pages)
+                maintype, subtype = mime_type.split("/", 1)
+                msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+
+        messages.append({"raw": msg.as_bytes(), "date": date})
+    return messages
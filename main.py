@@ -1,9 +1,14 @@
 import streamlit as st
-from datetime import datetime, date
-from app.email_handler import process_mail
-from app.attachment_rag import ingest_files_to_vector_db,query_vector_db
-from langchain.document_loaders import PyPDFLoader
-import glob,os
+from datetime import date, timedelta
+from app.clients import timed, startup_report
+with timed("import app modules"):
+    from app.email_handler import stream_mail, stream_mail_folders, download_attachment
+    from app.sync_state import get_sync_state_store
+    from app.blob_store import AttachmentStore
+    from app.attachment_rag import ingest_in_background,stream_vector_db_answer,preview_document,SUPPORTED_EXTENSIONS,file_filter
+    from app.tracing import diagnostics, reset_diagnostics
+    from app.mail_store import get_mail_store, split_extraction
+import glob,os,time
 # Set Streamlit page config
 st.set_page_config(page_title="SmartMail Tasks", layout="wide")
 
@@ -39,18 +44,106 @@ with st.sidebar:
     st.header("📅 Filter Emails")
     from_date = st.date_input("From Date", value=date.today())
     to_date = st.date_input("To Date (optional)", value=None)
+    since_last_sync = st.checkbox("🆕 Only new mail since last sync", value=False)
+    all_folders = st.checkbox("📁 All folders (Sent, labels, ...)", value=False)
 
     st.header("🧹 Filter Options")
     show_only_with_tasks = st.checkbox("✅ Only emails with extracted tasks", value=False)
     show_only_with_attachments = st.checkbox("📎 Only emails with attachments", value=False)
+    hide_bulk_mail = st.checkbox("🧹 Hide bulk mail skipped by triage", value=False)
+    search_text = st.text_input("🔍 Search stored emails", placeholder="Subject, sender, body or task")
+    search_all_dates = st.checkbox("Search all dates", value=True)
 
     fetch_btn = st.button("🔄 Fetch Emails")
 
+    with st.expander("⏱️ Startup report"):
+        # Clients are created lazily and reused across reruns, so this only grows on first use
+        for entry in startup_report():
+            st.text(f"{entry['name']}: {entry['seconds'] * 1000:.0f} ms")
+
+    with st.expander("🩺 Diagnostics"):
+        # Totals since the app process started (or the last reset), across every run
+        report = diagnostics()
+        llm_total = report["llm"]["total"]
+        st.metric("LLM calls", int(llm_total["calls"]))
+        st.text(
+            f"Tokens: {int(llm_total['input_tokens'])} in / {int(llm_total['output_tokens'])} out\n"
+            f"Estimated cost ({report['model']}): ${llm_total['cost_usd']:.4f}"
+        )
+        counters = report["counters"]
+        st.text(
+            f"IMAP fetched: {counters.get('imap.bytes_fetched', 0) / 1e6:.2f} MB\n"
+            f"Attachments written: {counters.get('attachment.bytes_written', 0) / 1e6:.2f} MB"
+        )
+        for name, cache in report["caches"].items():
+            st.text(f"{name} cache: {cache['hit_rate']:.0%} hits ({cache['hits']}/{cache['hits'] + cache['misses']})")
+        if report["stages"]:
+            st.dataframe(
+                [
+                    {
+                        "stage": stage["name"],
+                        "count": stage["count"],
+                        "total (s)": round(stage["total_s"], 3),
+                        "mean (ms)": round(stage["mean_s"] * 1000, 1),
+                        "max (ms)": round(stage["max_s"] * 1000, 1),
+                    }
+                    for stage in report["stages"]
+                ],
+                hide_index=True,
+            )
+        if st.button("Reset diagnostics"):
+            reset_diagnostics()
+            st.rerun()
+
+imap_map = {
+"Gmail": "imap.gmail.com",
+"Yahoo": "imap.mail.yahoo.com"
+}
+email_host = imap_map.get(email_provider, custom_imap)
+
+# ------------------------------
+# 🗂️ Mail Store
+# ------------------------------
+# Processed emails are kept in the local mail store, filled by the sync daemon
+# (`python -m app.sync_daemon`) or the Fetch button, so reruns and page loads only read it.
+mail_store = get_mail_store()
+# Same day range as the IMAP search: SINCE from_date BEFORE to_date
+before_date = to_date if to_date and to_date > from_date else from_date + timedelta(days=1)
+day_range = {"since": from_date.isoformat(), "before": before_date.isoformat()}
+if search_text and search_all_dates:
+    day_range = {}
+cached_results, shown_results = [], []
+if email_host and email_user:
+    cached_results = mail_store.list_emails(email_host, email_user, **day_range)
+    # Search and filters run against the local FTS index, never against IMAP
+    shown_results = mail_store.list_emails(
+        email_host,
+        email_user,
+        **day_range,
+        query=search_text,
+        with_tasks=show_only_with_tasks,
+        with_attachments=show_only_with_attachments,
+        hide_bulk=hide_bulk_mail,
+    )
+
+def is_skipped(res: dict) -> bool:
+    return (res.get("triage") or {}).get("action") == "skip"
+
+def passes_filters(res: dict) -> bool:
+    # Same rule as the store's `with_tasks`: the extraction names an actual To-Do
+    if show_only_with_tasks and not split_extraction(res["extraction"])[0]:
+        return False
+    if show_only_with_attachments and not res["attachments"]:
+        return False
+    if hide_bulk_mail and is_skipped(res):
+        return False
+    return True
+
 # ------------------------------
 # 📥 Main Area: Process and Display
 # ------------------------------
 
-if not fetch_btn:
+if not fetch_btn and not cached_results:
     st.markdown("### 👋 Welcome to SmartMail Task Extractor")
     st.markdown("""
     Use the sidebar to:
@@ -64,76 +157,158 @@ if not fetch_btn:
     
 tab1, tab2 = st.tabs(["📬 Email Tasks", "📎 RAG over Attachments"])
 
+def render_email_result(res: dict):
+    with st.expander(f"📨 {res['subject']} — {res['from']}"):
+        col1, col2 = st.columns(2)
+        col1.markdown(f"**🧑 From:** `{res['from']}`")
+        col2.markdown(f"**📅 Date:** `{res['date']}`")
+        if res.get("snippet"):
+            st.markdown(f"**🔍 Match:** {res['snippet']}")
+
+        st.markdown("**📝 Extracted Task:**")
+        if res["extraction"]:
+            st.success(res["extraction"])
+        elif is_skipped(res):
+            st.info(f"🧹 Skipped as bulk mail ({res['triage']['reason']}), no LLM call made.")
+        else:
+            st.info("No task found.")
+
+        st.markdown("**📎 Attachments:**")
+        if res["attachments"]:
+            for a in res["attachment_meta"]:
+                st.markdown(f"- `{a['filename']}` ({a['mime_type']}, {a['size'] / 1024:.0f} KB, fetched on demand)")
+        else:
+            st.text("None")
+
 with tab1:
     if fetch_btn:
-        with st.spinner("Fetching and processing emails..."):
-            from_str = from_date.strftime("%d-%b-%Y")
-            to_str = to_date.strftime("%d-%b-%Y") if to_date else None
-            imap_map = {
-            "Gmail": "imap.gmail.com",
-            "Yahoo": "imap.mail.yahoo.com"
-            }
-
-            email_host = imap_map.get(email_provider, custom_imap)
-            results = process_mail(from_date=from_str,to_date=to_str,email_host=email_host,email_user=email_user,email_pass=email_pass)
-        if results and "error" in results[0]:
-            st.error(results[0]["error"])
-            st.stop()
-        
-        if not results:
+        from_str = from_date.strftime("%d-%b-%Y")
+        to_str = to_date.strftime("%d-%b-%Y") if to_date else None
+
+        # Render each email as soon as it is processed instead of waiting for the whole range
+        progress = st.progress(0, text="Fetching and processing emails...")
+        total = {"count": 0}
+
+        def _on_total(n: int):
+            total["count"] = n
+
+        fetched = []
+        mail_store.start_run(email_host, email_user)
+        # All folders: several IMAP connections, duplicates across folders processed once
+        stream = stream_mail_folders if all_folders else stream_mail
+        for res in stream(from_date=from_str,to_date=to_str,email_host=email_host,email_user=email_user,email_pass=email_pass,on_total=_on_total,since_last_sync=since_last_sync):
+            if "error" in res:
+                progress.empty()
+                mail_store.finish_run(email_host, email_user, len(fetched), res["error"])
+                st.error(res["error"])
+                st.stop()
+
+            # Persisted as it arrives, so closing the tab keeps everything already processed
+            mail_store.save(email_host, email_user, res)
+            fetched.append(res)
+            processed = len(fetched)
+            progress.progress(
+                processed / max(total["count"], 1),
+                text=f"📨 Processed {processed} of {total['count']} emails...",
+            )
+
+            if passes_filters(res):
+                render_email_result(res)
+
+        progress.empty()
+        mail_store.finish_run(email_host, email_user, len(fetched))
+        processed = len(fetched)
+        if not processed:
             st.warning("No emails found in this range.")
         else:
-            st.success("✅ Emails processed successfully!")
-
-            for idx, res in enumerate(results):
-                if show_only_with_tasks and not res["extraction"]:
-                    continue
-                if show_only_with_attachments and not res["attachments"]:
-                    continue
-
-                with st.expander(f"📨 {res['subject']} — {res['from']}"):
-                    col1, col2 = st.columns(2)
-                    col1.markdown(f"**🧑 From:** `{res['from']}`")
-                    col2.markdown(f"**📅 Date:** `{res['date']}`")
-
-                    st.markdown("**📝 Extracted Task:**")
-                    if res["extraction"]:
-                        st.success(res["extraction"])
-                    else:
-                        st.info("No task found.")
-
-                    st.markdown("**📎 Attachments:**")
-                    if res["attachments"]:
-                        for a in res["attachments"]:
-                            st.markdown(f"- `{a}`")
-                    else:
-                        st.text("None")
+            st.success(f"✅ {processed} emails processed successfully!")
+            skipped = sum(is_skipped(res) for res in fetched)
+            if skipped:
+                st.caption(f"🧹 Triage skipped {skipped} bulk emails, saving {skipped} LLM extractions")
+
+    elif cached_results:
+        shown = shown_results
+        last_run = mail_store.last_run(email_host, email_user)
+        synced = ""
+        if last_run and last_run["finished_at"]:
+            synced = f", last synced {time.strftime('%d %b %H:%M', time.localtime(last_run['finished_at']))}"
+        elif last_run:
+            synced = ", sync in progress"
+        st.caption(f"Showing {len(shown)} of {len(cached_results)} stored emails{synced}")
+        for res in shown:
+            render_email_result(res)
 
 with tab2:
     email_user = st.session_state.get("email_user")
     st.header("📎 Ask Questions about Attachments")
 
     user_folder = f"attachments/{email_user}"
-    all_files = glob.glob(f"{user_folder}/*.pdf")
-    file_names = [os.path.basename(f) for f in all_files]
-    selected_file = st.selectbox("📄 Choose a file:", file_names)
+    # One entry per (message, filename), so two emails that both attach invoice.pdf stay apart
+    attachment_options = {
+        f"local/{os.path.basename(f)}": {"filename": os.path.basename(f), "path": f}
+        for f in glob.glob(f"{user_folder}/*")
+        if f.lower().endswith(SUPPORTED_EXTENSIONS)
+    }
+    if email_user:
+        # Downloaded attachments live in the content-addressed store, keyed by message
+        blob_store = AttachmentStore(email_user)
+        for key, entry in blob_store.entries().items():
+            if entry["filename"].lower().endswith(SUPPORTED_EXTENSIONS):
+                attachment_options[key] = entry
+        # Attachments seen during sync are only downloaded once somebody picks them here
+        for a in (get_sync_state_store().list_attachments(email_host, email_user) if email_host else []):
+            if a["filename"].lower().endswith(SUPPORTED_EXTENSIONS):
+                attachment_options.setdefault(
+                    blob_store.message_key(a),
+                    {"filename": a["filename"], "path": None, "mailbox": a["mailbox"], "uid": str(a["uid"]), "attachment": a},
+                )
+    senders = {
+        (res["mailbox"], res["uid"]): res
+        for res in (mail_store.list_emails(email_host, email_user, with_attachments=True) if email_host and email_user else [])
+    }
+
+    def _attachment_label(key: str) -> str:
+        option = attachment_options[key]
+        res = senders.get((option.get("mailbox"), option.get("uid")))
+        return f"{option['filename']} — {res['subject']} ({res['from']})" if res else option["filename"]
+
+    # Nothing is preselected: picking a file that is not local yet starts an IMAP download
+    selected_key = st.selectbox(
+        "📄 Choose a file:",
+        sorted(attachment_options, key=_attachment_label),
+        index=None,
+        placeholder="Pick an attachment",
+        format_func=_attachment_label,
+    )
+    selected_file = attachment_options[selected_key]["filename"] if selected_key else None
 
     if selected_file:
-        file_path = os.path.join(user_folder, selected_file)
+        file_path = attachment_options[selected_key]["path"]
+        if not file_path and not email_pass:
+            st.info(f"{selected_file} is not downloaded yet. Log in with your app password to fetch it.")
+            st.stop()
+        if not file_path:
+            with st.spinner(f"⬇️ Downloading {selected_file}..."):
+                try:
+                    file_path = download_attachment(
+                        email_host, email_user, email_pass, attachment_options[selected_key]["attachment"]
+                    )
+                except Exception as e:
+                    st.error(f"Download failed: {e}")
+                    st.stop()
 
-        # Ingest on selection
-        with st.spinner("🔁 Ingesting document..."):
-            result = ingest_files_to_vector_db(user_folder)
+        # Ingestion runs in the background and only when the folder's file list changed
+        ingest = ingest_in_background(user_folder)
+        if ingest["status"] == "running":
+            st.info("🔁 Indexing attachments in the background. Answers use what is already indexed.")
+            st.button("🔄 Refresh status")
+        elif ingest["status"] == "error":
+            st.error(f"Ingestion error: {ingest['result']['error_message']}")
+        elif ingest["status"] == "success" and ingest["result"]["ingested_files"]:
+            st.success(f"Indexed {len(ingest['result']['ingested_files'])} new file(s)")
 
-        if result["status"] == "success":
-            st.success(f"Added {selected_file} successfully")
-        else:
-            st.error(f"Ingestion error: {result['error_message']}")
-            
         try:
-            loader = PyPDFLoader(file_path)
-            preview_doc = loader.load()
-            preview_text = preview_doc[0].page_content[:500]
+            preview_text = preview_document(file_path)
             st.markdown("### 📘 Preview:")
             st.markdown(f"""
             <div style="
@@ -154,23 +329,38 @@ with tab2:
 
         # Ask user question
         user_query = st.text_input("❓ What do you want to know?")
+        only_selected = st.checkbox(f"Search only in {selected_file}", value=True)
         if st.button("Ask"):
-            with st.spinner("🤖 Generating response..."):
-                result = query_vector_db(user_query)
-                
+            with st.spinner("🔎 Searching documents..."):
+                result = stream_vector_db_answer(
+                    user_query,
+                    email_user=email_user,
+                    filters=file_filter(user_folder, file_path) if only_selected else None,
+                )
+
             if result["status"] == "success":
                 st.markdown("### ✅ Answer")
-                st.markdown(f"""
-                    <div style="background-color: #f0f2f6; padding: 1rem; border-radius: 0.5rem; color: #333;">
-                    {result["answer"]}
-                    </div>
-                    """, unsafe_allow_html=True)
+                # Tokens are rendered as Gemini produces them
+                try:
+                    with st.container(border=True):
+                        st.write_stream(result["answer_stream"])
+                except Exception as e:
+                    st.error(f"Error: {e}")
+                    st.stop()
+                timings = result["timings"]
+                if timings["first_token_s"] is not None:
+                    st.caption(
+                        f"⏱️ First token after {timings['first_token_s']:.2f}s, "
+                        f"complete after {timings['total_s']:.2f}s"
+                        + (" (cached)" if result["cached"] else "")
+                    )
 
                 if result["source_chunks"]:
                     st.markdown("### 📚 Source Chunks (Context used)")
-                    first_chunk = result["source_chunks"][0]
                     with st.expander("📄 View Source Context"):
-                        st.code(first_chunk, language="markdown")
+                        # Deduplicated chunks in the order they were given to the model
+                        for chunk in result["source_chunks"]:
+                            st.code(chunk, language="markdown")
 
             elif result["status"] == "no_results":
                 st.info("No relevant chunks found in the documents.")
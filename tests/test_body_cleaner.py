@@ -0,0 +1,38 @@
+import pytest
+
+from app.body_cleaner import clean_email_body, looks_like_html
+from benchmarks.corpus import build_corpus
+
+bs4 = pytest.importorskip("bs4")
+from benchmarks.bench_clean_body import legacy_clean_email_body  # noqa: E402
+
+INLINE_BODIES = [
+    "<b>Due</b> Friday",
+    "Please <strong>review</strong> the <em>draft</em> before the call.",
+    "<i>Reminder:</i> submit the <u>report</u>",
+    "<span style=\"color:red\">Urgent</span> invoice attached",
+    "Q&amp;A session moved to 5pm",
+    "Tom &amp; Jerry&#39;s budget &#x27;draft&#x27; &ndash; week 3",
+    "Hi team,\r\n\r\n<b>Deadline</b> is tomorrow&nbsp;&amp; see https://example.com/x\r\n\r\nManage notifications",
+]
+
+
+@pytest.mark.parametrize("body", INLINE_BODIES)
+def test_inline_html_is_detected(body):
+    assert looks_like_html(body)
+
+
+@pytest.mark.parametrize("body", INLINE_BODIES)
+def test_inline_html_matches_baseline(body):
+    assert clean_email_body(body) == legacy_clean_email_body(body)
+
+
+@pytest.mark.parametrize("body", ["a < b and c > d", "Fish & chips; 5 > 3", "plain text, no markup"])
+def test_plain_text_is_not_html(body):
+    assert not looks_like_html(body)
+    assert clean_email_body(body) == legacy_clean_email_body(body)
+
+
+def test_plain_corpus_matches_baseline():
+    for body in build_corpus(size=50, html_share=0.0, seed=7):
+        assert clean_email_body(body) == legacy_clean_email_body(body)
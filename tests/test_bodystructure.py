@@ -0,0 +1,109 @@
+import pytest
+
+from app.bodystructure import parse_fetch_items, walk_bodystructure
+
+PLAIN = b'("text" "plain" ("charset" "iso-8859-1") NIL NIL "quoted-printable" 120 4 NIL NIL NIL NIL)'
+HTML = b'("text" "html" ("charset" "utf-8") NIL NIL "base64" 2048 30 NIL NIL NIL NIL)'
+
+
+def _attachment(disposition: bytes, size: bytes = b"52000") -> bytes:
+    return (
+        b'("application" "pdf" ("name" "report.pdf") NIL NIL "base64" ' + size
+        + b' NIL (' + disposition + b') NIL NIL)'
+    )
+
+
+def _structure(body: bytes) -> list:
+    [item] = parse_fetch_items([b"1 (UID 7 BODYSTRUCTURE " + body + b")"])
+    return item["BODYSTRUCTURE"]
+
+
+# --- parse_fetch_items --- #
+def test_parse_fetch_items_with_literals():
+    data = [
+        (b"1 (UID 5 BODY[HEADER] {25}", b"Subject: hi\r\nFrom: a@b\r\n"),
+        b' FLAGS (\\Seen))',
+        (b"2 (UID 9 BODY[HEADER] {13}", b"Subject: x\r\n\r"),
+        b")",
+    ]
+    items = parse_fetch_items(data)
+    assert [int(i["UID"]) for i in items] == [5, 9]
+    assert items[0]["BODY[HEADER]"] == b"Subject: hi\r\nFrom: a@b\r\n"
+    assert items[0]["FLAGS"] == [b"\\Seen"]
+    assert items[1]["BODY[HEADER]"] == b"Subject: x\r\n\r"
+
+
+def test_parse_fetch_items_section_specs_quoted_strings_and_nil():
+    data = [
+        (b'3 (UID 11 BODY[HEADER.FIELDS (MESSAGE-ID)] {20}', b"Message-ID: <a@b>\r\n\r"),
+        b' ENVELOPE ("Mon, 1 Jan 2024" "say \\"hi\\"" NIL))',
+    ]
+    [item] = parse_fetch_items(data)
+    assert item["BODY[HEADER.FIELDS (MESSAGE-ID)]"] == b"Message-ID: <a@b>\r\n\r"
+    assert item["ENVELOPE"] == [b"Mon, 1 Jan 2024", b'say "hi"', None]
+
+
+def test_parse_fetch_items_partial_body_and_lowercase_names():
+    data = [(b"4 (uid 12 body[1]<0> {5}", b"hello"), b")"]
+    [item] = parse_fetch_items(data)
+    assert item == {"UID": b"12", "BODY[1]<0>": b"hello"}
+
+
+def test_parse_fetch_items_rejects_truncated_responses():
+    with pytest.raises(ValueError):
+        parse_fetch_items([b'1 (UID 5 ENVELOPE ("unterminated)'])
+
+
+# --- walk_bodystructure --- #
+def test_single_part_message():
+    [part] = walk_bodystructure(_structure(PLAIN))
+    assert (part.part, part.mime_type, part.charset, part.encoding, part.size) == (
+        "1", "text/plain", "iso-8859-1", "quoted-printable", 120
+    )
+    assert part.is_body_candidate and not part.is_attachment
+
+
+def test_nested_multipart_part_numbers():
+    alternative = b"(" + PLAIN + HTML + b' "alternative" ("boundary" "b2") NIL NIL)'
+    mixed = b"(" + alternative + _attachment(b'"attachment" ("filename" "report.pdf")') + b' "mixed" ("boundary" "b1") NIL NIL)'
+    parts = list(walk_bodystructure(_structure(mixed)))
+    assert [(p.part, p.mime_type) for p in parts] == [
+        ("1.1", "text/plain"), ("1.2", "text/html"), ("2", "application/pdf")
+    ]
+    attachment = parts[2]
+    assert attachment.is_attachment
+    assert (attachment.filename, attachment.size, attachment.disposition) == ("report.pdf", 52000, "attachment")
+
+
+def test_attached_message_is_one_part():
+    rfc822 = (
+        b'("message" "rfc822" NIL NIL NIL "7bit" 900 NIL ' + PLAIN + b' 20 NIL ("attachment" ("filename" "fwd.eml")) NIL NIL)'
+    )
+    mixed = b"(" + PLAIN + rfc822 + b' "mixed" NIL NIL NIL)'
+    parts = list(walk_bodystructure(_structure(mixed)))
+    assert [(p.part, p.mime_type, p.filename) for p in parts] == [
+        ("1", "text/plain", None), ("2", "message/rfc822", "fwd.eml")
+    ]
+
+
+@pytest.mark.parametrize(
+    "filename_param, expected",
+    [
+        (b'"filename*" "utf-8\'\'Q3%20report.pdf"', "Q3 report.pdf"),
+        (b'"filename*" "utf-8\'en-us\'Q3%20report.pdf"', "Q3 report.pdf"),
+        (b'"filename*" "iso-8859-1\'\'r%E9sum%E9.pdf"', "résumé.pdf"),
+        (b'"filename*" "x-unknown\'\'plan%20B.pdf"', "plan B.pdf"),
+        (b'"filename" "=?utf-8?q?r=C3=A9sum=C3=A9.pdf?="', "résumé.pdf"),
+    ],
+)
+def test_attachment_filenames(filename_param, expected):
+    [part] = walk_bodystructure(_structure(
+        b'("application" "pdf" NIL NIL NIL "base64" 10 NIL ("attachment" (' + filename_param + b')) NIL NIL)'
+    ))
+    assert part.filename == expected
+
+
+def test_malformed_size_does_not_raise():
+    [part] = walk_bodystructure(_structure(_attachment(b'"attachment" ("filename" "a.pdf")', size=b'"big"')))
+    assert part.size == 0
+    assert part.filename == "a.pdf"
@@ -0,0 +1,40 @@
+import base64
+
+from app.imap_fetcher import fetch_summary_batch
+
+GOOD = b'("text" "plain" ("charset" "utf-8") NIL NIL "base64" 8 1 NIL NIL NIL NIL)'
+# A BODYSTRUCTURE that is valid IMAP syntax but not a body (too few fields)
+BROKEN = b'("text")'
+
+
+class FakeServer:
+    """Answers `UID FETCH` from canned responses, keyed by a substring of the item list."""
+
+    def __init__(self, responses: dict):
+        self.responses = responses
+
+    def uid(self, command, message_set, items):
+        for key, data in self.responses.items():
+            if key in items:
+                return "OK", data
+        raise AssertionError(items)
+
+
+def test_one_broken_bodystructure_does_not_end_the_batch():
+    server = FakeServer({
+        "BODYSTRUCTURE": [
+            (b"1 (UID 1 BODYSTRUCTURE " + GOOD + b" BODY[HEADER] {13}", b"Subject: a\r\n\r"), b")",
+            (b"2 (UID 2 BODYSTRUCTURE " + BROKEN + b" BODY[HEADER] {13}", b"Subject: b\r\n\r"), b")",
+            (b"3 (UID 3 BODYSTRUCTURE " + GOOD + b" BODY[HEADER] {13}", b"Subject: c\r\n\r"), b")",
+        ],
+        "BODY.PEEK[1]": [
+            (b"1 (UID 1 BODY[1]<0> {8}", base64.b64encode(b"hello")), b")",
+            (b"3 (UID 3 BODY[1]<0> {8}", base64.b64encode(b"world")), b")",
+        ],
+    })
+    summaries = fetch_summary_batch(server, [1, 2, 3])
+    assert [s["uid"] for s in summaries] == [1, 2, 3]
+    assert [s["text"] for s in summaries] == [b"hello", b"", b"world"]
+    assert "error" not in summaries[0] and "error" not in summaries[2]
+    assert summaries[1]["error"].startswith("BODYSTRUCTURE")
+    assert summaries[1]["text_part"] is None and summaries[1]["attachments"] == []
@@ -0,0 +1,52 @@
+from email.message import Message
+
+from app.triage import header_signals, triage_email
+
+
+def _message(headers: dict) -> Message:
+    msg = Message()
+    for name, value in headers.items():
+        msg[name] = value
+    return msg
+
+
+MAILING_LIST = {
+    "From": "Course Staff <cs101@lists.university.edu>",
+    "List-Id": "<cs101.lists.university.edu>",
+    "List-Unsubscribe": "<mailto:cs101-leave@lists.university.edu>",
+    "Precedence": "list",
+}
+GITHUB = {
+    "From": "GitHub <notifications@github.com>",
+    "List-Id": "org/repo <repo.org.github.com>",
+    "List-Unsubscribe": "<https://github.com/notifications/unsubscribe/x>",
+    "Precedence": "list",
+}
+NEWSLETTER = {
+    "From": "Shop <newsletter@news.shop.example>",
+    "List-Unsubscribe": "<https://shop.example/unsub>",
+    "Precedence": "bulk",
+}
+
+
+def test_precedence_list_is_not_bulk():
+    assert "precedence_bulk" not in header_signals(_message(MAILING_LIST))
+    assert "precedence_bulk" in header_signals(_message(NEWSLETTER))
+
+
+def test_mailing_list_mail_needing_action_is_extracted():
+    result = triage_email(_message(MAILING_LIST), "Homework 3", "Please submit by Friday.")
+    assert result["action"] == "extract"
+    result = triage_email(_message(GITHUB), "[org/repo] Fix login (#42)", "@me assigned this issue to you.")
+    assert result["action"] == "extract"
+
+
+def test_headers_alone_never_skip():
+    headers = {**NEWSLETTER, "X-Campaign": "123"}
+    result = triage_email(_message(headers), "Your account", "Here is the summary of your account.")
+    assert result["action"] == "extract"
+
+
+def test_promotional_bulk_mail_is_skipped():
+    result = triage_email(_message(NEWSLETTER), "Weekend sale", "Shop now: 30% off everything, free shipping.")
+    assert result["action"] == "skip"
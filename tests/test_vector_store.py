@@ -0,0 +1,224 @@
+import re
+import sys
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+import app.vector_store as vector_store
+from app.vector_store import HashingEmbedder, LocalVectorStore, PineconeVectorStore, VectorStore, matches_filter
+
+DOCS = [
+    {"_id": "a#0", "chunk_text": "quarterly budget review for the finance team", "source": "budget.pdf", "timestamp": 100},
+    {"_id": "b#0", "chunk_text": "shipment schedule for the friday order", "source": "orders.docx", "timestamp": 200},
+    {"_id": "c#0", "chunk_text": "security policy for account passwords", "source": ["policy.pdf", "copy.pdf"], "timestamp": 300},
+]
+
+
+# --- matches_filter --- #
+@pytest.mark.parametrize(
+    "filter, expected",
+    [
+        (None, True),
+        ({}, True),
+        ({"source": "budget.pdf"}, True),
+        ({"source": "orders.docx"}, False),
+        ({"source": {"$eq": "budget.pdf"}}, True),
+        ({"source": {"$ne": "budget.pdf"}}, False),
+        ({"source": {"$in": ["x.pdf", "budget.pdf"]}}, True),
+        ({"source": {"$nin": ["x.pdf", "budget.pdf"]}}, False),
+        ({"timestamp": {"$gte": 100, "$lt": 200}}, True),
+        ({"timestamp": {"$gt": 100}}, False),
+        ({"timestamp": {"$lte": "not a number"}}, False),
+        ({"missing": {"$gt": 0}}, False),
+        ({"$and": [{"source": "budget.pdf"}, {"timestamp": 100}]}, True),
+        ({"$and": [{"source": "budget.pdf"}, {"timestamp": 200}]}, False),
+        ({"$or": [{"source": "x.pdf"}, {"timestamp": 100}]}, True),
+        ({"$or": [{"source": "x.pdf"}, {"timestamp": 200}]}, False),
+    ],
+)
+def test_matches_filter(filter, expected):
+    assert matches_filter({"source": "budget.pdf", "timestamp": 100}, filter) is expected
+
+
+def test_matches_filter_list_fields_match_any_element():
+    fields = {"source": ["policy.pdf", "copy.pdf"]}
+    assert matches_filter(fields, {"source": "copy.pdf"})
+    assert matches_filter(fields, {"source": {"$in": ["copy.pdf"]}})
+    assert not matches_filter(fields, {"source": {"$ne": "policy.pdf"}})
+    assert not matches_filter(fields, {"source": {"$nin": ["policy.pdf"]}})
+
+
+def test_matches_filter_rejects_unknown_operators():
+    with pytest.raises(ValueError):
+        matches_filter({"source": "a"}, {"source": {"$regex": "a"}})
+
+
+def test_vector_store_is_abstract():
+    with pytest.raises(TypeError):
+        VectorStore()
+
+    class Incomplete(VectorStore):
+        def upsert(self, namespace, records):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+# --- Pinecone, against an in-memory index --- #
+class FakePineconeIndex:
+    """Just enough of Pinecone's integrated-embedding index API: records, delete, search."""
+
+    _WORD_RE = re.compile(r"\w+")
+
+    def __init__(self):
+        self.namespaces = {}
+
+    def upsert_records(self, namespace, records):
+        self.namespaces.setdefault(namespace, {}).update({r["_id"]: dict(r) for r in records})
+
+    def delete(self, ids, namespace):
+        for _id in ids:
+            self.namespaces.get(namespace, {}).pop(_id, None)
+
+    def search(self, namespace, query):
+        words = Counter(self._WORD_RE.findall(query["inputs"]["text"].lower()))
+        hits = []
+        for _id, record in self.namespaces.get(namespace, {}).items():
+            fields = {k: v for k, v in record.items() if k != "_id"}
+            if not matches_filter(fields, query.get("filter")):
+                continue
+            score = sum((words & Counter(self._WORD_RE.findall(fields["chunk_text"].lower()))).values())
+            hits.append({"_id": _id, "_score": float(score), "fields": fields})
+        hits.sort(key=lambda h: h["_score"], reverse=True)
+        return {"result": {"hits": hits[:query["top_k"]]}}
+
+
+@pytest.fixture
+def pinecone_index(monkeypatch):
+    index = FakePineconeIndex()
+    created = []
+
+    class Pinecone:
+        def __init__(self, api_key=None):
+            pass
+
+        def has_index(self, name):
+            return bool(created)
+
+        def create_index_for_model(self, name, **kwargs):
+            created.append((name, kwargs))
+
+        def Index(self, name):
+            return index
+
+    monkeypatch.setitem(sys.modules, "pinecone", SimpleNamespace(Pinecone=Pinecone))
+    index.created = created
+    return index
+
+
+def test_pinecone_creates_missing_index_with_integrated_embedding(pinecone_index):
+    PineconeVectorStore(api_key="test")
+    [(name, spec)] = pinecone_index.created
+    assert name == vector_store.PINECONE_INDEX_NAME
+    assert spec["embed"] == {"model": vector_store.PINECONE_EMBED_MODEL, "field_map": {"text": "chunk_text"}}
+
+
+# --- Every backend through the same interface --- #
+@pytest.fixture(params=["pinecone", "local-flat", "local-ivf-int8"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "pinecone":
+        request.getfixturevalue("pinecone_index")
+        return PineconeVectorStore(api_key="test")
+    if request.param == "local-ivf-int8":
+        # Small enough that the IVF path is taken for the padded corpus below
+        monkeypatch.setattr(vector_store, "IVF_MIN_VECTORS", 16)
+        return LocalVectorStore(root=str(tmp_path), embedder=HashingEmbedder(64), index_type="ivf", quantize=True)
+    return LocalVectorStore(root=str(tmp_path), embedder=HashingEmbedder(64))
+
+
+def _filler(n):
+    return [
+        {"_id": f"filler#{i}", "chunk_text": f"unrelated note number{i} word{i * 7}", "source": "filler.pdf", "timestamp": i}
+        for i in range(n)
+    ]
+
+
+def test_search_returns_best_match_in_pinecone_shape(store):
+    store.upsert("user-a", DOCS + _filler(40))
+    hits = store.search("user-a", "shipment schedule for the friday order", top_k=3)
+    assert len(hits) == 3
+    assert hits[0]["_id"] == "b#0"
+    assert hits[0]["fields"]["chunk_text"] == DOCS[1]["chunk_text"]
+    assert hits[0]["fields"]["source"] == "orders.docx"
+    assert "_id" not in hits[0]["fields"]
+    assert [h["_score"] for h in hits] == sorted((h["_score"] for h in hits), reverse=True)
+
+
+def test_search_applies_metadata_filters(store):
+    store.upsert("user-a", DOCS + _filler(40))
+    hits = store.search("user-a", "shipment schedule for the friday order", top_k=5, filter={"source": "budget.pdf"})
+    assert [h["_id"] for h in hits] == ["a#0"]
+    hits = store.search("user-a", "security policy", top_k=5, filter={"source": "copy.pdf"})
+    assert [h["_id"] for h in hits] == ["c#0"]
+    hits = store.search("user-a", "budget", top_k=5, filter={"timestamp": {"$gte": 200}, "source": {"$ne": "filler.pdf"}})
+    assert {h["_id"] for h in hits} == {"b#0", "c#0"}
+
+
+def test_namespaces_are_isolated(store):
+    store.upsert("user-a", DOCS[:1])
+    store.upsert("user-b", DOCS[1:2])
+    assert [h["_id"] for h in store.search("user-b", "budget review", top_k=5)] == ["b#0"]
+    assert store.search("user-c", "budget review", top_k=5) == []
+
+
+def test_delete_and_reupsert(store):
+    store.upsert("user-a", DOCS + _filler(40))
+    store.delete("user-a", ["b#0", "missing#0"])
+    hits = store.search("user-a", "shipment schedule for the friday order", top_k=50)
+    assert "b#0" not in {h["_id"] for h in hits}
+
+    store.upsert("user-a", [{**DOCS[0], "chunk_text": "shipment schedule for the friday order, updated"}])
+    hits = store.search("user-a", "shipment schedule for the friday order", top_k=50)
+    assert hits[0]["_id"] == "a#0"
+    assert [h["_id"] for h in hits].count("a#0") == 1
+
+
+# --- Local store specifics --- #
+def test_local_store_persists_and_reopens(tmp_path):
+    store = LocalVectorStore(root=str(tmp_path), embedder=HashingEmbedder(64), quantize=True)
+    store.upsert("user-a", DOCS)
+    store.delete("user-a", ["a#0"])
+
+    reopened = LocalVectorStore(root=str(tmp_path), embedder=HashingEmbedder(64), quantize=True)
+    hits = reopened.search("user-a", "security policy for account passwords", top_k=5)
+    assert [h["_id"] for h in hits][:1] == ["c#0"]
+    assert "a#0" not in {h["_id"] for h in hits}
+
+
+def test_local_ivf_int8_matches_exact_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "IVF_MIN_VECTORS", 16)
+    records = DOCS + _filler(200)
+    exact = LocalVectorStore(root=str(tmp_path / "flat"), embedder=HashingEmbedder(64))
+    ivf = LocalVectorStore(root=str(tmp_path / "ivf"), embedder=HashingEmbedder(64), index_type="ivf", quantize=True)
+    exact.upsert("user-a", records)
+    ivf.upsert("user-a", records)
+
+    queries = [r["chunk_text"] for r in records[:20]]
+    exact_hits = exact.search_batch("user-a", queries, top_k=1)
+    ivf_hits = ivf.search_batch("user-a", queries, top_k=1)
+    assert list((tmp_path / "ivf").rglob("ivf.npz"))
+    for query, e, i in zip(queries, exact_hits, ivf_hits):
+        assert e[0]["_id"] == i[0]["_id"], query
+        # int8 scores stay within quantization error of the float32 ones
+        assert i[0]["_score"] == pytest.approx(e[0]["_score"], abs=0.05)
+
+
+@pytest.mark.parametrize("error", [ImportError("no sentence_transformers"), OSError("model not cached")])
+def test_local_embedder_falls_back_to_hashing(monkeypatch, error):
+    def _fail(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(vector_store, "SentenceTransformerEmbedder", _fail)
+    assert isinstance(vector_store.load_local_embedder(), HashingEmbedder)